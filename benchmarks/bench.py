@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+"""
+bench.py - Benchmarks stasher operations on synthetic tracked trees
+
+Every scenario generates its tracked paths and a private data directory in
+a temporary directory, so runs never touch the real stasher data. Results
+are written as JSON and can be compared against an earlier run.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from pathlib import Path
+from typing import Callable
+
+
+ROOT_DIR = Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT_DIR / "src"))
+
+from core.service import Service  # noqa: E402
+
+
+def write_file(path: Path, size: int, rng: random.Random) -> None:
+    """Write a file of random bytes."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(rng.randbytes(size))
+
+
+def make_tiny(root: Path, scale: float, rng: random.Random) -> list[Path]:
+    """Many tiny files spread over a few directories."""
+    count = int(5000 * scale)
+    for i in range(count):
+        write_file(root / "tiny" / f"dir{i % 50}" / f"file{i}.conf", 128, rng)
+    return [root / "tiny"]
+
+
+def make_huge(root: Path, scale: float, rng: random.Random) -> list[Path]:
+    """A few huge files."""
+    size = int(64 * 1024 * 1024 * scale)
+    for i in range(3):
+        write_file(root / "huge" / f"asset{i}.bin", size, rng)
+    return [root / "huge"]
+
+
+def make_deep(root: Path, scale: float, rng: random.Random) -> list[Path]:
+    """A deeply nested directory with a few files on every level."""
+    path = root / "deep"
+    for level in range(int(200 * scale)):
+        path = path / f"level{level}"
+        for i in range(3):
+            write_file(path / f"file{i}", 512, rng)
+    return [root / "deep"]
+
+
+SCENARIOS = {
+    "tiny": make_tiny,
+    "huge": make_huge,
+    "deep": make_deep,
+}
+
+
+class Bench:
+    """Runs timed operations and collects their results."""
+
+    def __init__(self, repeat: int) -> None:
+        self.repeat = repeat
+        self.results = []
+
+    def time(
+        self,
+        scenario: str,
+        operation: str,
+        func: Callable,
+        setup: Callable | None = None,
+        size: int | None = None,
+    ) -> None:
+        """Time func, keeping the best of all repeats.
+
+        With the size of the data func processes, its throughput is
+        reported as well.
+        """
+        timings = []
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                for _ in range(self.repeat):
+                    if setup:
+                        setup()
+                    start = time.perf_counter()
+                    func()
+                    timings.append(time.perf_counter() - start)
+
+        result = {
+            "scenario": scenario,
+            "operation": operation,
+            "seconds": min(timings),
+        }
+        line = f"{scenario:>8} {operation:<20} {result['seconds'] * 1000:10.2f} ms"
+        if size is not None:
+            result["bytes"] = size
+            line += f" {size / result['seconds'] / 1e6:10.1f} MB/s"
+        self.results.append(result)
+        print(line)
+
+
+def tree_stats(paths: list[Path]) -> tuple[int, int]:
+    """Return the file count and total size of the tracked paths."""
+    files = 0
+    size = 0
+    for path in paths:
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                files += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+    return files, size
+
+
+def touch_some(paths: list[Path], fraction: float) -> None:
+    """Rewrite a fraction of the files of the tracked paths."""
+    for path in paths:
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames[: max(1, int(len(filenames) * fraction))]:
+                with open(os.path.join(dirpath, filename), "ab") as f:
+                    f.write(b"\n")
+
+
+def run_scenario(bench: Bench, name: str, scale: float, jobs: int | None) -> dict:
+    """Generate a scenario and time all operations on it."""
+    rng = random.Random(name)
+    with tempfile.TemporaryDirectory(prefix="stasher-bench-") as tmp:
+        tmp = Path(tmp)
+        live = tmp / "live"
+        paths = SCENARIOS[name](live, scale, rng)
+        files, size = tree_stats(paths)
+
+        root = tmp / "data" / "stasher"
+        root.mkdir(parents=True)
+        service = Service(root)
+        if jobs:
+            service.engine.jobs = jobs
+
+        service.create(name)
+        service.activate(name)
+
+        def track_all() -> None:
+            service.track([str(path) for path in paths])
+
+        def untrack_all() -> None:
+            tracked = service.catalog.tracked(name).values()
+            service.untrack([str(path) for path in paths if str(path) in tracked])
+
+        bench.time(name, "track", track_all, setup=untrack_all)
+        bench.time(name, "untrack", untrack_all, setup=track_all)
+        track_all()
+
+        def reset_store() -> None:
+            service.catalog.update_files(name, {}, service.catalog.files(name))
+            shutil.rmtree(service.store.root, ignore_errors=True)
+
+        bench.time(name, "push (cold)", service.push, setup=reset_store)
+        bench.time(name, "push (unchanged)", service.push)
+        bench.time(
+            name,
+            "push (1% changed)",
+            service.push,
+            setup=lambda: touch_some(paths, 0.01),
+        )
+        bench.time(name, "tree", lambda: sum(1 for _ in service.tree(name)))
+
+        def wipe_live() -> None:
+            for path in paths:
+                shutil.rmtree(path, ignore_errors=True)
+
+        bench.time(name, "apply (cold)", lambda: service.apply(name), setup=wipe_live)
+        bench.time(name, "apply (unchanged)", lambda: service.apply(name))
+        bench.time(name, "apply --link", lambda: service.apply(name, link=True))
+
+    return {"files": files, "bytes": size}
+
+
+def run_stashes(bench: Bench, scale: float) -> None:
+    """Time list and activate against hundreds of stashes."""
+    with tempfile.TemporaryDirectory(prefix="stasher-bench-") as tmp:
+        root = Path(tmp) / "stasher"
+        root.mkdir()
+        service = Service(root)
+        count = int(500 * scale)
+        for i in range(count):
+            service.create(f"stash{i}")
+
+        bench.time("stashes", "list", service.list)
+        bench.time(
+            "stashes", "activate", lambda: service.activate(f"stash{count // 2}")
+        )
+        bench.time("stashes", "status", service.status)
+
+
+def run_chunking(bench: Bench, scale: float) -> None:
+    """Time splitting random data into chunks, with NumPy and without.
+
+    The pure Python rolling hash is far slower, so it gets less data.
+    """
+    import io
+
+    from core import chunking
+
+    rng = random.Random("chunking")
+    sizes = {
+        "numpy": int(64 * 1024 * 1024 * scale),
+        "python": int(4 * 1024 * 1024 * scale),
+    }
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        del sizes["numpy"]
+        print("chunking: numpy is not installed, skipping split (numpy)")
+
+    try:
+        for kind, size in sizes.items():
+            data = rng.randbytes(size)
+            chunking._candidates = getattr(chunking, f"candidates_{kind}")
+            bench.time(
+                "chunking",
+                f"split ({kind})",
+                lambda: sum(1 for _ in chunking.split(io.BytesIO(data))),
+                size=size,
+            )
+    finally:
+        chunking._candidates = None
+
+
+def git_revision() -> str | None:
+    """Return the current commit of the repository."""
+    try:
+        return subprocess.run(
+            ["git", "-C", str(ROOT_DIR), "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_file: Path) -> None:
+    """Print the change of every operation against an earlier run."""
+    with open(baseline_file, "r") as f:
+        baseline = {
+            (result["scenario"], result["operation"]): result["seconds"]
+            for result in json.load(f)["results"]
+        }
+
+    print(f"\ncompared to {baseline_file}:")
+    for result in results:
+        before = baseline.get((result["scenario"], result["operation"]))
+        if not before:
+            continue
+        change = (result["seconds"] - before) / before * 100
+        print(f"{result['scenario']:>8} {result['operation']:<20} {change:+8.1f}%")
+
+
+# Scenarios that time their own operations instead of a tracked tree.
+EXTRA = {
+    "stashes": run_stashes,
+    "chunking": run_chunking,
+}
+
+
+def main() -> None:
+    """The main entry point for the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help=f"Scenarios to run, all by default: {', '.join([*SCENARIOS, *EXTRA])}.",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Scale factor for the data size."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Repeats per operation, best is kept."
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="Number of copy workers.")
+    parser.add_argument(
+        "-o", "--output", type=Path, help="Write the results to a JSON file."
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="Compare against an earlier JSON result file."
+    )
+    args = parser.parse_args()
+
+    bench = Bench(args.repeat)
+    scenarios = args.scenarios or [*SCENARIOS, *EXTRA]
+    for name in scenarios:
+        if name not in SCENARIOS and name not in EXTRA:
+            parser.error(f"unknown scenario: '{name}'")
+    sizes = {}
+    for name in scenarios:
+        if name in EXTRA:
+            EXTRA[name](bench, args.scale)
+        else:
+            sizes[name] = run_scenario(bench, name, args.scale, args.jobs)
+
+    report = {
+        "revision": git_revision(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "jobs": args.jobs,
+        "scenarios": sizes,
+        "results": bench.results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
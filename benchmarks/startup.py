@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+startup.py - Enforces the cold-start budget of stasher's read-only commands
+
+Runs each command in a fresh interpreter against an empty, isolated data
+directory and fails if it imports a module reserved for rendering commands
+or if its median startup overhead exceeds the budget.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+
+ROOT_DIR = Path(__file__).parent.parent.resolve()
+ENTRY_POINT = ROOT_DIR / "src" / "main.py"
+COMMANDS = ["status", "list", "tracked"]
+FORBIDDEN_MODULES = ["rich", "platformdirs", "argparse", "concurrent.futures"]
+
+
+def measure(command: list[str], env: dict, runs: int) -> float:
+    """Return the median wall time of a command in milliseconds.
+
+    One warm-up run comes first, so bytecode caches are in place.
+    """
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def imported_modules(command: list[str], env: dict) -> set[str]:
+    """Return all modules a command imports."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *command],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def main() -> None:
+    """The main entry point for the startup check."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=80.0,
+        help="Allowed startup overhead over a bare interpreter in ms.",
+    )
+    parser.add_argument("--runs", type=int, default=15, help="Runs per command.")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = {**os.environ, "XDG_DATA_HOME": data_dir}
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        baseline = measure([sys.executable, "-c", "pass"], env, args.runs)
+        print(f"interpreter: {baseline:.1f} ms")
+
+        for command in COMMANDS:
+            argv = [str(ENTRY_POINT), command]
+            overhead = measure([sys.executable, *argv], env, args.runs) - baseline
+            forbidden = [
+                module
+                for module in imported_modules(argv, env)
+                if module.split(".")[0] in FORBIDDEN_MODULES
+                or module in FORBIDDEN_MODULES
+            ]
+
+            verdict = "ok"
+            if overhead > args.budget:
+                verdict = f"over budget ({args.budget:.0f} ms)"
+                failed = True
+            if forbidden:
+                verdict = f"imports {', '.join(sorted(forbidden))}"
+                failed = True
+            print(f"{command}: +{overhead:.1f} ms {verdict}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
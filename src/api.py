@@ -1,13 +1,211 @@
 """
 api.py - Exposes a clean and stable API for frontends
+
+Everything runs in-process and returns result objects from core.results
+instead of printing, and failures raise the errors from core.errors.
+Call setup once before anything else.
 """
 
+from typing import Callable, Iterable, Iterator
+
+
 from core.stasher import Stasher
+from core.results import (
+    BackupResult,
+    BundleResult,
+    Change,
+    GcResult,
+    ProgressEvent,
+    RestoreResult,
+    Revision,
+    Snapshot,
+    StashInfo,
+    StashStats,
+    TreeNode,
+    Usage,
+)
 
 
 _stasher = Stasher()
+_service = _stasher.service
+_subscribers: dict[Callable, Callable] = {}
+
+
+def setup() -> list[tuple[str, str | None]]:
+    """Setup Stasher and roll back operations that were interrupted.
+
+    Returns the operation and stash name of every rolled back operation.
+    """
+    _stasher.prepare()
+    return _service.recover()
+
+
+def create(name: str) -> None:
+    """Create a new stash."""
+    _service.create(name)
+
+
+def delete(name: str) -> None:
+    """Delete a stash."""
+    _service.delete(name)
+
+
+def stashes() -> list[StashInfo]:
+    """Return all stashes."""
+    return _service.list()
+
+
+def active() -> str | None:
+    """Return the active stash, or None if there is none."""
+    return _service._get_active_name()
+
+
+def activate(name: str) -> None:
+    """Activate a stash."""
+    _service.activate(name)
+
+
+def clear() -> None:
+    """Go out of the active stash."""
+    _service.clear()
+
+
+def apply(name: str, link: bool = False) -> RestoreResult:
+    """Restore a stash or bundle to its tracked paths and activate it."""
+    return _service.apply(name, link)
+
+
+def checkout(spec: str) -> RestoreResult:
+    """Restore a revision of a stash, given as name@rev, and activate it."""
+    return _service.checkout(spec)
+
+
+def restore(
+    name: str,
+    rev: int | None = None,
+    only: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+) -> RestoreResult:
+    """Restore a stash, or one of its revisions, without activating it.
+
+    only and exclude are glob patterns selecting the paths to restore.
+    """
+    return _service.restore(name, rev, only, exclude)
+
+
+def log(name: str | None = None) -> list[Revision]:
+    """Return the revisions of a stash, newest first."""
+    return _service.log(name)
+
+
+def stats(name: str | None = None) -> list[StashStats]:
+    """Return how well stashes are deduplicated, with a total without name."""
+    return _service.stats(name)
+
+
+def usage(name: str | None = None) -> list[Usage]:
+    """Return the cached usage of all stashes, or of a stash and its paths."""
+    return _service.usage(name)
+
+
+def recount() -> list[str]:
+    """Recompute the cached usage of all stashes and return the stale ones."""
+    return _service.recount()
+
+
+def gc(
+    keep_last: int | None = None,
+    keep_daily: int | None = None,
+    max_size: int | None = None,
+    dry_run: bool = False,
+) -> GcResult:
+    """Remove objects no stash needs anymore and prune old revisions."""
+    return _service.gc(keep_last, keep_daily, max_size, dry_run)
+
+
+def push(codec: str | None = None, chunked: bool | None = None) -> int:
+    """Push the active stash and return the number of changed entries."""
+    return _service.push(codec, chunked)
+
+
+def push_paths(paths: Iterable[str]) -> int:
+    """Push only the given live paths and return the number of changes."""
+    return _service.push_paths(paths)
+
+
+def diff(name: str | None = None, patch: bool = False) -> Iterator[Change]:
+    """Yield the differences between the tracked paths and a stash."""
+    return _service.diff(name, patch)
+
+
+def tree(
+    name: str, depth: int | None = None, max_entries: int | None = None
+) -> Iterator[TreeNode]:
+    """Yield the tree of a stash or bundle, starting with its root."""
+    return _service.tree(name, depth, max_entries)
+
+
+def cat(name: str, relpath: str) -> Iterator[bytes]:
+    """Yield the contents of a file in a stash or bundle in chunks."""
+    return _service.cat(name, relpath)
+
+
+def export_bundle(name: str, path: str, compress: bool = False) -> BundleResult:
+    """Write a stash to a bundle file."""
+    return _service.export_bundle(name, path, compress)
+
+
+def import_bundle(path: str, name: str | None = None) -> BundleResult:
+    """Create a stash from a bundle file."""
+    return _service.import_bundle(path, name)
+
+
+def track(paths: Iterable[str]) -> dict[str, str]:
+    """Track paths to the active stash and return the new ones by key."""
+    return _service.track(paths)
+
+
+def untrack(paths_or_keys: Iterable[str]) -> dict[str, str]:
+    """Untrack paths of the active stash and return them by key."""
+    return _service.untrack(paths_or_keys)
+
+
+def tracked() -> dict[str, str]:
+    """Return all tracked paths of the active stash by key."""
+    return _service.tracked()
+
+
+def backup(target: str, keep: int | None = None) -> BackupResult:
+    """Back up the store and catalog to a directory, incrementally."""
+    return _service.backup(target, keep)
+
+
+def backups(target: str) -> list[Snapshot]:
+    """Return the snapshots of a backup, oldest first."""
+    return _service.backups(target)
+
+
+def verify_backup(target: str) -> list[str]:
+    """Check a backup against its checksums and return the bad files."""
+    return _service.verify_backup(target)
+
+
+def restore_backup(target: str, snapshot: int | None = None) -> BackupResult:
+    """Restore the store and catalog to a snapshot of a backup."""
+    return _service.restore_backup(target, snapshot)
+
+
+def subscribe(callback: Callable[[ProgressEvent], None]) -> None:
+    """Call callback with every progress event of the running operations."""
+
+    def _forward(event: dict) -> None:
+        """Pass a timing event on as a progress event."""
+        callback(ProgressEvent(**event))
+
+    _subscribers[callback] = _forward
+    _service.timings.subscribe(_forward)
 
 
-def setup() -> None:
-    """Setup Stasher."""
-    _stasher.setup()
+def unsubscribe(callback: Callable[[ProgressEvent], None]) -> None:
+    """Stop calling callback with progress events."""
+    _service.timings.unsubscribe(_subscribers.pop(callback))
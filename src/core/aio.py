@@ -0,0 +1,284 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable, Sequence
+
+
+from core.service import Service
+from core.results import (
+    BackupResult,
+    BundleResult,
+    Change,
+    GcResult,
+    ProgressEvent,
+    RestoreResult,
+    Revision,
+    Snapshot,
+    StashInfo,
+    StashStats,
+    TreeNode,
+    Usage,
+)
+
+
+# Items a streaming query hands over to the event loop at once, and the
+# number of such batches that may wait for the consumer.
+STREAM_BATCH = 256
+STREAM_DEPTH = 4
+
+
+class AsyncService:
+    """An asyncio counterpart of Service for frontends and daemons.
+
+    Every call runs the blocking Service method on a worker thread, so the
+    event loop is never held up by file I/O or catalog queries. Operations
+    that change stashes run one at a time, queries run concurrently with
+    them and with each other, each on its own catalog connection. Only
+    walks of a stash wait for a write to that same stash, through its
+    lock. Results of iterating queries are streamed in batches with
+    bounded memory.
+    """
+
+    def __init__(self, service: Service, workers: int = 4) -> None:
+        self.service = service
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="stasher-aio"
+        )
+        self._write_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "AsyncService":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut the worker threads down once their calls are done."""
+        self.executor.shutdown(wait=False)
+
+    async def _read(self, func: Callable, *args):
+        """Run a query on a worker thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def _write(self, func: Callable, *args):
+        """Run an operation on a worker thread, after the ones before it."""
+        async with self._write_lock:
+            return await self._read(func, *args)
+
+    async def _stream(self, func: Callable, *args) -> AsyncIterator:
+        """Yield the items of a blocking iterator produced on a worker thread.
+
+        The iterator runs start to end on one thread, which its catalog
+        cursors require, and hands its items over in batches. Once
+        STREAM_DEPTH batches wait for the consumer, it blocks until they
+        are taken. When the consumer stops early, it is closed on its thread.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_DEPTH)
+        stop = threading.Event()
+
+        def _put(item: tuple) -> bool:
+            """Hand an item over to the event loop, unless it stopped listening."""
+            if stop.is_set():
+                return False
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            return True
+
+        def _produce() -> None:
+            """Run the iterator and pass on its items, the end or its error."""
+            iterator = None
+            try:
+                iterator = iter(func(*args))
+                batch = []
+                for item in iterator:
+                    if stop.is_set():
+                        return
+                    batch.append(item)
+                    if len(batch) >= STREAM_BATCH:
+                        if not _put(("items", batch)):
+                            return
+                        batch = []
+                _put(("done", batch))
+            except Exception as e:
+                _put(("error", e))
+            finally:
+                if hasattr(iterator, "close"):
+                    iterator.close()
+
+        producer = loop.run_in_executor(self.executor, _produce)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "error":
+                    raise value
+                for item in value:
+                    yield item
+                if kind == "done":
+                    break
+        finally:
+            stop.set()
+            # Make room for the one batch the producer may be handing over.
+            while not queue.empty():
+                queue.get_nowait()
+            await producer
+
+    async def progress(self) -> AsyncIterator[ProgressEvent]:
+        """Yield the progress events of all operations as they are recorded.
+
+        Events are recorded on worker threads and delivered on the event
+        loop, until the consumer stops iterating.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def _forward(event: dict) -> None:
+            """Pass a timing event on to the event loop."""
+            loop.call_soon_threadsafe(queue.put_nowait, ProgressEvent(**event))
+
+        self.service.timings.subscribe(_forward)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.service.timings.unsubscribe(_forward)
+
+    async def create(self, name: str) -> None:
+        """Create a new stash."""
+        await self._write(self.service.create, name)
+
+    async def delete(self, name: str) -> None:
+        """Delete a stash."""
+        await self._write(self.service.delete, name)
+
+    async def list(self) -> Sequence[StashInfo]:
+        """Return all stashes."""
+        return await self._read(self.service.list)
+
+    async def activate(self, name: str) -> None:
+        """Activate a stash."""
+        await self._write(self.service.activate, name)
+
+    async def clear(self) -> None:
+        """Go out of the current active stash."""
+        await self._write(self.service.clear)
+
+    async def status(self) -> str:
+        """Return the current active stash."""
+        return await self._read(self.service.status)
+
+    async def apply(self, name: str, link: bool = False) -> RestoreResult:
+        """Restore a stash or bundle to its tracked paths and activate it."""
+        return await self._write(self.service.apply, name, link)
+
+    async def checkout(self, spec: str) -> RestoreResult:
+        """Restore a revision of a stash, given as name@rev, and activate it."""
+        return await self._write(self.service.checkout, spec)
+
+    async def restore(
+        self,
+        name: str,
+        rev: int | None = None,
+        only: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+    ) -> RestoreResult:
+        """Restore a stash, or one of its revisions, without activating it."""
+        return await self._write(self.service.restore, name, rev, only, exclude)
+
+    async def push(self, codec: str | None = None, chunked: bool | None = None) -> int:
+        """Push changes to the active stash, returning the number of changes."""
+        return await self._write(self.service.push, codec, chunked)
+
+    async def push_paths(self, paths: Iterable[str]) -> int:
+        """Push only the given live paths to the active stash."""
+        return await self._write(self.service.push_paths, paths)
+
+    async def gc(
+        self,
+        keep_last: int | None = None,
+        keep_daily: int | None = None,
+        max_size: int | None = None,
+        dry_run: bool = False,
+    ) -> GcResult:
+        """Remove objects no stash needs anymore and prune old revisions."""
+        return await self._write(
+            self.service.gc, keep_last, keep_daily, max_size, dry_run
+        )
+
+    async def log(self, name: str | None = None) -> Sequence[Revision]:
+        """Return the revisions of a stash, newest first."""
+        return await self._read(self.service.log, name)
+
+    async def stats(self, name: str | None = None) -> Sequence[StashStats]:
+        """Return how well stashes are deduplicated, with a total without name."""
+        return await self._read(self.service.stats, name)
+
+    async def usage(self, name: str | None = None) -> Sequence[Usage]:
+        """Return the cached usage of all stashes, or of a stash and its paths."""
+        return await self._read(self.service.usage, name)
+
+    async def recount(self) -> Sequence[str]:
+        """Recompute the cached usage of all stashes and return the stale ones."""
+        return await self._write(self.service.recount)
+
+    def diff(
+        self, name: str | None = None, patch: bool = False
+    ) -> AsyncIterator[Change]:
+        """Yield the differences between the tracked paths and a stash.
+
+        Like a query it runs alongside operations, and it waits for writes
+        to the stash through its lock, which it holds exclusively itself
+        while it refreshes the stat cache of files found unchanged.
+        """
+        return self._stream(self.service.diff, name, patch)
+
+    def tree(
+        self, name: str, depth: int | None = None, max_entries: int | None = None
+    ) -> AsyncIterator[TreeNode]:
+        """Yield the tree of a stash or bundle, starting with its root."""
+        return self._stream(self.service.tree, name, depth, max_entries)
+
+    def cat(self, name: str, relpath: str) -> AsyncIterator[bytes]:
+        """Yield the contents of a file in a stash or bundle in chunks."""
+        return self._stream(self.service.cat, name, relpath)
+
+    async def export_bundle(
+        self, name: str, path: str, compress: bool = False
+    ) -> BundleResult:
+        """Write a stash to a bundle file."""
+        return await self._read(self.service.export_bundle, name, path, compress)
+
+    async def import_bundle(self, path: str, name: str | None = None) -> BundleResult:
+        """Create a stash from a bundle file."""
+        return await self._write(self.service.import_bundle, path, name)
+
+    async def backup(self, target: str, keep: int | None = None) -> BackupResult:
+        """Back up the store and catalog to a directory, incrementally."""
+        return await self._write(self.service.backup, target, keep)
+
+    async def backups(self, target: str) -> Sequence[Snapshot]:
+        """Return the snapshots of a backup, oldest first."""
+        return await self._read(self.service.backups, target)
+
+    async def verify_backup(self, target: str) -> Sequence[str]:
+        """Check a backup against its checksums and return the bad files."""
+        return await self._read(self.service.verify_backup, target)
+
+    async def restore_backup(
+        self, target: str, snapshot: int | None = None
+    ) -> BackupResult:
+        """Restore the store and catalog to a snapshot of a backup."""
+        return await self._write(self.service.restore_backup, target, snapshot)
+
+    async def track(self, paths: Iterable[str]) -> dict[str, str]:
+        """Track paths to the active stash and return the new ones by key."""
+        return await self._write(self.service.track, paths)
+
+    async def untrack(self, paths_or_keys: Iterable[str]) -> dict[str, str]:
+        """Untrack paths of the active stash and return them by key."""
+        return await self._write(self.service.untrack, paths_or_keys)
+
+    async def tracked(self) -> dict[str, str]:
+        """Return all tracked paths of the active stash by key."""
+        return await self._read(self.service.tracked)
@@ -0,0 +1,407 @@
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from contextlib import ExitStack
+from typing import Callable, Iterable
+
+
+from core.catalog import migrate
+from core.copier import copy_file
+from core.errors import BackupError, CopyError
+from core.results import BackupResult, Snapshot
+from core.utils import pid_alive
+
+
+# Each migration upgrades the manifest schema by one version.
+MIGRATIONS = [
+    """
+    CREATE TABLE snapshots (
+        id INTEGER PRIMARY KEY,
+        created REAL NOT NULL,
+        checksum TEXT NOT NULL,
+        objects INTEGER NOT NULL,
+        size INTEGER NOT NULL
+    );
+    CREATE TABLE objects (
+        name TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        checksum TEXT NOT NULL,
+        added INTEGER NOT NULL,
+        seen INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    """,
+]
+
+# Object names written per manifest statement.
+BATCH_SIZE = 512
+
+# Errors of a single scheduled backup, which the next one tries again.
+RUN_ERRORS = (OSError, sqlite3.Error, BackupError, CopyError)
+
+
+def checksum(path: str) -> str:
+    """Return the sha256 digest of a file."""
+    import hashlib
+
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class Backup:
+    """An incremental mirror of the object store and catalog snapshots.
+
+    Objects never change once stored, so a backup copies just the ones
+    that are new since the last, by name. The catalog is copied whole as
+    a numbered snapshot with the sqlite backup API, which is consistent
+    while other processes keep writing to it. The manifest in the target
+    records every object and snapshot with its checksum, and which
+    snapshots each object was in the store for, so any snapshot can be
+    restored and old ones pruned along with the objects only they needed.
+
+    The target holds manifest.db, objects/ like the store and
+    snapshots/<id>.db. Link trees of stashes in link mode are not backed
+    up, pushing them stores their contents as objects.
+    """
+
+    def __init__(self, service, target: str) -> None:
+        self.service = service
+        self.catalog = service.catalog
+        self.store = service.store
+        self.timings = service.timings
+        self.target = Path(target)
+        self.objects_dir = self.target / "objects"
+        self.snapshots_dir = self.target / "snapshots"
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the manifest on first use and bring its schema up to date."""
+        if self._conn is None:
+            self.target.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.target / "manifest.db")
+            migrate(self._conn, MIGRATIONS)
+        return self._conn
+
+    def __enter__(self) -> "Backup":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the manifest."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _stored(self) -> set[str]:
+        """Return the names of all objects in the store, like "ab/cdef.zlib"."""
+        names = set()
+        if not self.store.root.exists():
+            return names
+        with os.scandir(self.store.root) as prefixes:
+            for prefix in prefixes:
+                if len(prefix.name) != 2 or not prefix.is_dir():
+                    continue
+                with os.scandir(prefix.path) as it:
+                    names.update(
+                        f"{prefix.name}/{entry.name}"
+                        for entry in it
+                        if not entry.name.startswith(".")
+                    )
+        return names
+
+    def _mirrored(self) -> dict[str, tuple]:
+        """Return the size, checksum and snapshot range of mirrored objects."""
+        rows = self.conn.execute(
+            "SELECT name, size, checksum, added, seen FROM objects"
+        )
+        return {name: tuple(row) for name, *row in rows}
+
+    def _write(self, dst: Path, write: Callable[[str], None]) -> tuple[int, str]:
+        """Write a file durably through a temporary one and return its checksum.
+
+        The written file itself is checksummed, so what ends up on disk is
+        what gets recorded or verified.
+        """
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            write(str(tmp))
+            fd = os.open(tmp, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            digest = checksum(str(tmp))
+            size = os.path.getsize(tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            raise
+        return size, digest
+
+    def _copy(self, src: Path, dst: Path) -> tuple[int, str]:
+        """Copy a file with the cheapest strategy and return size and checksum."""
+        return self._write(dst, lambda tmp: copy_file(str(src), tmp))
+
+    def _mirror(self, names: Iterable[str]) -> dict[str, tuple[int, str]]:
+        """Copy objects from the store to the target, by name.
+
+        Objects stored without a codec are named by their checksum, which
+        is checked against the copy. Objects a gc removed meanwhile are
+        skipped, they are left out of the returned ones.
+        """
+
+        def _mirror_one(name: str) -> tuple[int, str] | None:
+            """Copy one object and return its size and checksum."""
+            src = self.store.root / name
+            try:
+                size, digest = self._copy(src, self.objects_dir / name)
+            except FileNotFoundError:
+                if os.path.lexists(src):
+                    raise
+                return None
+            if "." not in name and digest != name.replace("/", ""):
+                raise BackupError(f"object '{name}' does not match its name.")
+            return size, digest
+
+        names = sorted(names)
+        start = time.perf_counter()
+        results = self.service.engine.map(_mirror_one, names)
+        copied = {
+            name: result for name, result in zip(names, results) if result
+        }
+        self.timings.record(
+            "copy",
+            time.perf_counter() - start,
+            len(copied),
+            sum(size for size, _ in copied.values()),
+        )
+        return copied
+
+    def run(self, keep: int | None = None) -> BackupResult:
+        """Back up what changed since the last backup as a new snapshot.
+
+        New objects are copied before the catalog snapshot and once more
+        after it, for objects pushed in between. If no object was copied
+        and the snapshot is the same as the latest one, it is dropped and
+        the latest one is returned as unchanged. The manifest is written
+        last, so an interrupted backup is simply done again. With keep,
+        only the newest that many snapshots are kept.
+        """
+        state = self.catalog.gc_state()
+        if state and not state["dry_run"] and pid_alive(state["pid"]):
+            raise BackupError("a gc is running, back up once it is done.")
+
+        with self.timings.phase("metadata"):
+            mirrored = self._mirrored()
+            latest = self.conn.execute(
+                "SELECT id, created, checksum FROM snapshots ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            snapshot = latest[0] + 1 if latest else 1
+            stored = self._stored()
+        copied = self._mirror(stored - mirrored.keys())
+
+        created = time.time()
+        with self.timings.phase("snapshot"):
+            _, sealed = self._write(
+                self.snapshots_dir / f"{snapshot}.db", self.catalog.snapshot
+            )
+
+        with self.timings.phase("metadata"):
+            stored |= self._stored()
+        copied.update(self._mirror(stored - mirrored.keys() - copied.keys()))
+        # Objects a gc removed before they were copied are not in the store.
+        stored &= mirrored.keys() | copied.keys()
+
+        if not copied and latest and sealed == latest[2]:
+            os.unlink(self.snapshots_dir / f"{snapshot}.db")
+            pruned = self._prune(keep) if keep else (0, 0)
+            return BackupResult(latest[0], latest[1], 0, 0, *pruned, unchanged=True)
+
+        with self.timings.phase("metadata"), self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO objects (name, size, checksum, added, seen) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (name, size, digest, snapshot, snapshot)
+                    for name, (size, digest) in copied.items()
+                ],
+            )
+            seen = sorted(stored & mirrored.keys())
+            for i in range(0, len(seen), BATCH_SIZE):
+                batch = seen[i : i + BATCH_SIZE]
+                self.conn.execute(
+                    "UPDATE objects SET seen = ? "
+                    f"WHERE name IN ({', '.join('?' * len(batch))})",
+                    [snapshot, *batch],
+                )
+            total = sum(mirrored[name][0] for name in seen)
+            total += sum(size for size, _ in copied.values())
+            self.conn.execute(
+                "INSERT INTO snapshots (id, created, checksum, objects, size) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (snapshot, created, sealed, len(stored), total),
+            )
+
+        pruned = self._prune(keep) if keep else (0, 0)
+        return BackupResult(
+            snapshot,
+            created,
+            len(copied),
+            sum(size for size, _ in copied.values()),
+            *pruned,
+        )
+
+    def _prune(self, keep: int) -> tuple[int, int]:
+        """Remove all but the newest snapshots and objects only they needed.
+
+        An object that was not in the store when the oldest kept snapshot
+        was taken is not needed by any kept one. Returns the number of
+        removed snapshots and objects.
+        """
+        rows = self.conn.execute(
+            "SELECT id FROM snapshots ORDER BY id DESC LIMIT -1 OFFSET ?", (keep,)
+        )
+        dropped = [row[0] for row in rows]
+        if not dropped:
+            return 0, 0
+
+        oldest = max(dropped) + 1
+        names = [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT name FROM objects WHERE seen < ?", (oldest,)
+            )
+        ]
+        with self.conn:
+            self.conn.execute("DELETE FROM snapshots WHERE id < ?", (oldest,))
+            self.conn.execute("DELETE FROM objects WHERE seen < ?", (oldest,))
+        with self.timings.phase("prune", files=len(names)):
+            for name in names:
+                path = self.objects_dir / name
+                if os.path.lexists(path):
+                    os.unlink(path)
+            for snapshot in dropped:
+                path = self.snapshots_dir / f"{snapshot}.db"
+                if os.path.lexists(path):
+                    os.unlink(path)
+        return len(dropped), len(names)
+
+    def schedule(
+        self,
+        interval: float,
+        keep: int | None = None,
+        on_backup: Callable[[BackupResult], None] | None = None,
+        on_error: Callable[[Exception], None] | None = None,
+    ) -> None:
+        """Back up every interval seconds until interrupted.
+
+        A backup that takes longer than the interval is followed by the
+        next one right away. A backup that fails is passed to on_error and
+        tried again after the interval.
+        """
+        while True:
+            start = time.monotonic()
+            try:
+                result = self.run(keep)
+            except RUN_ERRORS as e:
+                if on_error:
+                    on_error(e)
+            else:
+                if on_backup:
+                    on_backup(result)
+            time.sleep(max(0.0, start + interval - time.monotonic()))
+
+    def snapshots(self) -> list[Snapshot]:
+        """Return all snapshots in the backup, oldest first."""
+        rows = self.conn.execute(
+            "SELECT id, created, objects, size FROM snapshots ORDER BY id"
+        )
+        return [Snapshot(*row) for row in rows]
+
+    def verify(self) -> list[str]:
+        """Check every mirrored file against its checksum in the manifest.
+
+        Returns the paths of missing or corrupt files within the target.
+        """
+        files = [
+            (f"objects/{name}", digest)
+            for name, (_, digest, _, _) in self._mirrored().items()
+        ]
+        files += [
+            (f"snapshots/{snapshot}.db", digest)
+            for snapshot, digest in self.conn.execute(
+                "SELECT id, checksum FROM snapshots"
+            )
+        ]
+
+        def _check(item: tuple[str, str]) -> bool:
+            """Check if a file exists with the recorded checksum."""
+            path, digest = item
+            try:
+                return checksum(str(self.target / path)) == digest
+            except FileNotFoundError:
+                return False
+
+        with self.timings.phase("verify", files=len(files)):
+            results = self.service.engine.map(_check, files)
+        return sorted(path for (path, _), ok in zip(files, results) if not ok)
+
+    def restore(self, snapshot: int | None = None) -> BackupResult:
+        """Restore the store and catalog to a snapshot, the latest by default.
+
+        Only objects the store does not hold already are copied back, and
+        each is checked against its checksum. The catalog is replaced last,
+        while no stash operation runs, so a failed restore changes nothing
+        the catalog refers to.
+        """
+        query = "SELECT id, created, checksum FROM snapshots"
+        if snapshot is None:
+            row = self.conn.execute(query + " ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            row = self.conn.execute(query + " WHERE id = ?", (snapshot,)).fetchone()
+        if row is None:
+            raise BackupError(
+                "the backup has no snapshots."
+                if snapshot is None
+                else f"snapshot {snapshot} was not found in the backup."
+            )
+        snapshot, created, digest = row
+        path = self.snapshots_dir / f"{snapshot}.db"
+        if not path.exists() or checksum(str(path)) != digest:
+            raise BackupError(f"snapshot {snapshot} is missing or corrupt.")
+
+        with self.timings.phase("metadata"):
+            needed = {
+                name: (size, digest)
+                for name, (size, digest, added, seen) in self._mirrored().items()
+                if added <= snapshot <= seen
+            }
+            missing = needed.keys() - self._stored()
+
+        def _restore_one(name: str) -> int:
+            """Copy one object back into the store and return its size."""
+            size, digest = self._copy(self.objects_dir / name, self.store.root / name)
+            if digest != needed[name][1]:
+                os.unlink(self.store.root / name)
+                raise BackupError(f"object '{name}' is corrupt in the backup.")
+            os.chmod(self.store.root / name, 0o444)
+            return size
+
+        names = sorted(missing)
+        start = time.perf_counter()
+        sizes = self.service.engine.map(_restore_one, names)
+        self.timings.record("copy", time.perf_counter() - start, len(names), sum(sizes))
+
+        with ExitStack() as stack:
+            for name in self.catalog.names():
+                stack.enter_context(self.service.locks.stash(name, exclusive=True))
+            stack.enter_context(self.service.locks.catalog())
+            with self.timings.phase("snapshot"):
+                self.catalog.load(path)
+        return BackupResult(snapshot, created, len(names), sum(sizes))
@@ -0,0 +1,309 @@
+import os
+import mmap
+import struct
+from bisect import bisect_left
+from typing import BinaryIO, Iterator
+
+
+from core.store import ObjectStore
+from core.compression import CHUNK_SIZE, compress_stream, decompress_chunks
+from core.errors import BundleError
+
+
+# Layout of a bundle, all integers little-endian:
+#
+#   header    magic, version, entry count, index offset, metadata length
+#   metadata  JSON with the stash name and its tracked paths
+#   payloads  the contents of every distinct object, stored once
+#   index     one slot per entry in relpath order, then the entry records
+#
+# A slot holds the offset of its record within the index and the running
+# file count and byte total up to and including its entry, so a subtree
+# rollup only needs two slots. Records hold everything of a manifest entry
+# plus where and how its payload is stored.
+MAGIC = b"STASHER\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQII")
+SLOT = struct.Struct("<QQQ")
+RECORD = struct.Struct("<BBHIQQQ32sH")
+
+TYPES = ("file", "dir", "link")
+CODECS = ("none", "zlib", "lzma")
+
+
+def write_bundle(
+    path: str,
+    name: str,
+    tracked: dict[str, str],
+    files: dict[str, dict],
+    store: ObjectStore,
+    compress: bool = False,
+) -> int:
+    """Write a stash to a bundle file and return the number of payload bytes.
+
+    Every object is written once, however many entries share it. Objects
+    compressed in the store are copied as they are, deltas are written
+    out in full. With compress, the
+    other ones are zlib compressed when that makes them smaller. The
+    bundle is written to a temporary file first and renamed into place,
+    so an existing bundle is never left half overwritten.
+    """
+    import json
+    import tempfile
+
+    meta = json.dumps({"name": name, "tracked": tracked}).encode()
+    payloads = {}
+    slots = []
+    records = []
+    record_offset = 0
+    file_count = 0
+    byte_total = 0
+
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".stasher-bundle-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"\0" * HEADER.size + meta)
+            for relpath in sorted(files):
+                entry = files[relpath]
+                digest = b""
+                location = (0, 0, 0)
+                if entry["type"] == "file":
+                    digest = bytes.fromhex(entry["hash"])
+                    if entry["hash"] not in payloads:
+                        payloads[entry["hash"]] = _write_payload(
+                            f, store, entry, compress
+                        )
+                    location = payloads[entry["hash"]]
+                    file_count += 1
+                    byte_total += entry["size"]
+
+                encoded = relpath.encode()
+                target = entry.get("target", "").encode()
+                records.append(
+                    RECORD.pack(
+                        TYPES.index(entry["type"]),
+                        location[2],
+                        len(encoded),
+                        entry.get("mode") or 0,
+                        entry.get("size") or 0,
+                        location[0],
+                        location[1],
+                        digest,
+                        len(target),
+                    )
+                    + encoded
+                    + target
+                )
+                slots.append(SLOT.pack(record_offset, file_count, byte_total))
+                record_offset += len(records[-1])
+
+            index_offset = f.tell()
+            payload_size = index_offset - HEADER.size - len(meta)
+            f.write(b"".join(slots))
+            f.write(b"".join(records))
+            f.seek(0)
+            f.write(
+                HEADER.pack(MAGIC, VERSION, 0, len(slots), index_offset, len(meta), 0)
+            )
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return payload_size
+
+
+def _write_payload(
+    f: BinaryIO, store: ObjectStore, entry: dict, compress: bool
+) -> tuple[int, int, int]:
+    """Append an object to a bundle and return its offset, size and codec."""
+    import shutil
+
+    offset = f.tell()
+    codec = entry.get("codec")
+    if codec and codec not in CODECS:
+        f.writelines(store.read(entry["hash"], codec))
+        return offset, f.tell() - offset, CODECS.index("none")
+
+    with open(store.path(entry["hash"], codec), "rb") as src:
+        size = os.fstat(src.fileno()).st_size
+        if codec:
+            shutil.copyfileobj(src, f, CHUNK_SIZE)
+            return offset, size, CODECS.index(codec)
+        if compress and size:
+            stored = compress_stream(src, f, "zlib", 6)
+            if stored < size:
+                return offset, stored, CODECS.index("zlib")
+            f.seek(offset)
+            f.truncate()
+            src.seek(0)
+        shutil.copyfileobj(src, f, CHUNK_SIZE)
+    return offset, size, CODECS.index("none")
+
+
+class Bundle:
+    """A read-only stash stored in a single bundle file.
+
+    The file is memory-mapped and only the pages that are actually read
+    get loaded, so listing entries or looking one up never touches the
+    payloads, and reading one file only touches its own payload.
+    """
+
+    def __init__(self, path: str) -> None:
+        import json
+
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise BundleError(f"'{path}' is not a stash bundle.") from None
+
+        try:
+            magic, version, _, count, index_offset, meta_length, _ = (
+                HEADER.unpack_from(self._map)
+            )
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC:
+            self.close()
+            raise BundleError(f"'{path}' is not a stash bundle.")
+        if version != VERSION:
+            self.close()
+            raise BundleError(
+                f"bundle version {version} of '{path}' is not supported."
+            )
+
+        meta = json.loads(self._map[HEADER.size : HEADER.size + meta_length])
+        self.name = meta["name"]
+        self.tracked = meta["tracked"]
+        self._count = count
+        self._slots = index_offset
+        self._records = index_offset + count * SLOT.size
+        self._keys = _Keys(self)
+
+    def __enter__(self) -> "Bundle":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        """Unmap the bundle."""
+        self._map.close()
+
+    def _slot(self, i: int) -> tuple[int, int, int]:
+        """Return the record offset and running totals of an entry."""
+        return SLOT.unpack_from(self._map, self._slots + i * SLOT.size)
+
+    def _relpath(self, i: int) -> str:
+        """Return the relpath of an entry."""
+        offset = self._records + self._slot(i)[0]
+        length = RECORD.unpack_from(self._map, offset)[2]
+        start = offset + RECORD.size
+        return self._map[start : start + length].decode()
+
+    def _entry(self, i: int) -> tuple[str, dict]:
+        """Return the relpath and manifest entry of an entry.
+
+        File entries carry their payload location as "payload".
+        """
+        offset = self._records + self._slot(i)[0]
+        kind, codec, length, mode, size, start, stored, digest, target_length = (
+            RECORD.unpack_from(self._map, offset)
+        )
+        offset += RECORD.size
+        relpath = self._map[offset : offset + length].decode()
+        kind = TYPES[kind]
+        if kind == "file":
+            entry = {
+                "type": "file",
+                "hash": digest.hex(),
+                "size": size,
+                "mode": mode,
+                "payload": (start, stored, CODECS[codec]),
+            }
+        elif kind == "dir":
+            entry = {"type": "dir", "mode": mode}
+        else:
+            offset += length
+            target = self._map[offset : offset + target_length].decode()
+            entry = {"type": "link", "target": target}
+        return relpath, entry
+
+    def _range(self, prefix: str) -> tuple[int, int]:
+        """Return the index range of everything below a directory."""
+        if not prefix:
+            return 0, self._count
+        return (
+            bisect_left(self._keys, f"{prefix}/"),
+            bisect_left(self._keys, f"{prefix}0"),
+        )
+
+    def files(self) -> dict[str, dict]:
+        """Return the whole manifest."""
+        return dict(self._entry(i) for i in range(self._count))
+
+    def get(self, relpath: str) -> dict | None:
+        """Return the manifest entry of a relpath."""
+        i = bisect_left(self._keys, relpath)
+        if i < self._count and self._relpath(i) == relpath:
+            return self._entry(i)[1]
+        return None
+
+    def children(self, prefix: str = "") -> Iterator[tuple[str, dict]]:
+        """Yield the direct children of a directory in name order."""
+        i, end = self._range(prefix)
+        base = len(prefix) + 1 if prefix else 0
+        while i < end:
+            relpath = self._relpath(i)
+            child, separator, _ = relpath[base:].partition("/")
+            if separator:
+                i = bisect_left(self._keys, f"{relpath[:base]}{child}0", i, end)
+                continue
+            yield self._entry(i)
+            i += 1
+
+    def rollup(self, prefix: str = "") -> tuple[int, int]:
+        """Return the file count and total size below a directory."""
+        start, end = self._range(prefix)
+        if start >= end:
+            return 0, 0
+        _, files, size = self._slot(end - 1)
+        if start:
+            _, before_files, before_size = self._slot(start - 1)
+            files -= before_files
+            size -= before_size
+        return files, size
+
+    def read(self, entry: dict) -> Iterator[bytes]:
+        """Yield the contents of a file entry in chunks."""
+        start, stored, codec = entry["payload"]
+        chunks = (
+            self._map[offset : min(offset + CHUNK_SIZE, start + stored)]
+            for offset in range(start, start + stored, CHUNK_SIZE)
+        )
+        if codec == "none":
+            yield from chunks
+        else:
+            yield from decompress_chunks(chunks, codec)
+
+
+class _Keys:
+    """A sequence view of the relpaths of a bundle, for bisect."""
+
+    def __init__(self, bundle: Bundle) -> None:
+        self.bundle = bundle
+
+    def __len__(self) -> int:
+        return len(self.bundle)
+
+    def __getitem__(self, i: int) -> str:
+        return self.bundle._relpath(i)
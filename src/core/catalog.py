@@ -0,0 +1,1064 @@
+import os
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+
+from core.errors import (
+    RevisionNotFoundError,
+    StashExistsError,
+    StashNotFoundError,
+)
+
+
+# Statements recomputing the cached usage of all stashes from their
+# manifests. Only file rows count, keyed by their first relpath component.
+RECOUNT = (
+    "DELETE FROM usage",
+    """
+    INSERT INTO usage (stash_id, key, files, size)
+    SELECT stash_id, substr(relpath, 1, instr(relpath || '/', '/') - 1),
+        count(*), sum(size)
+    FROM files WHERE type = 'file' GROUP BY 1, 2
+    """,
+    "DELETE FROM contents",
+    """
+    INSERT INTO contents (hash, stash_id, refs, size)
+    SELECT hash, stash_id, count(*), max(size)
+    FROM files WHERE type = 'file' GROUP BY hash, stash_id
+    """,
+    """
+    UPDATE stashes SET
+        unique_size = (
+            SELECT coalesce(sum(size), 0) FROM contents WHERE stash_id = stashes.id
+        ),
+        shared = (
+            SELECT coalesce(sum(c.size), 0) FROM contents c
+            WHERE c.stash_id = stashes.id AND EXISTS (
+                SELECT 1 FROM contents o
+                WHERE o.hash = c.hash AND o.stash_id != c.stash_id
+            )
+        )
+    """,
+)
+
+# Each migration upgrades the schema by one version.
+MIGRATIONS = [
+    """
+    CREATE TABLE stashes (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE tracked (
+        stash_id INTEGER NOT NULL REFERENCES stashes(id) ON DELETE CASCADE,
+        key TEXT NOT NULL,
+        path TEXT NOT NULL,
+        PRIMARY KEY (stash_id, key)
+    ) WITHOUT ROWID;
+    CREATE TABLE files (
+        stash_id INTEGER NOT NULL REFERENCES stashes(id) ON DELETE CASCADE,
+        relpath TEXT NOT NULL,
+        type TEXT NOT NULL,
+        hash TEXT,
+        size INTEGER,
+        mtime_ns INTEGER,
+        inode INTEGER,
+        mode INTEGER,
+        target TEXT,
+        PRIMARY KEY (stash_id, relpath)
+    ) WITHOUT ROWID;
+    CREATE TABLE active (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        stash_id INTEGER REFERENCES stashes(id) ON DELETE SET NULL
+    );
+    INSERT INTO active (id, stash_id) VALUES (0, NULL);
+    """,
+    """
+    CREATE TABLE journal (
+        id INTEGER PRIMARY KEY,
+        operation TEXT NOT NULL,
+        stash TEXT,
+        staging TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        started REAL NOT NULL
+    );
+    """,
+    """
+    ALTER TABLE stashes ADD COLUMN codec TEXT;
+    ALTER TABLE files ADD COLUMN codec TEXT;
+    """,
+    """
+    CREATE TABLE revisions (
+        stash_id INTEGER NOT NULL REFERENCES stashes(id) ON DELETE CASCADE,
+        rev INTEGER NOT NULL,
+        tree TEXT NOT NULL,
+        created REAL NOT NULL,
+        changes INTEGER NOT NULL,
+        PRIMARY KEY (stash_id, rev)
+    ) WITHOUT ROWID;
+    """,
+    """
+    ALTER TABLE stashes ADD COLUMN chunked INTEGER NOT NULL DEFAULT 0;
+    """,
+    """
+    CREATE TABLE gc (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        pid INTEGER NOT NULL,
+        started REAL NOT NULL,
+        cutoff REAL NOT NULL,
+        dry_run INTEGER NOT NULL,
+        max_size INTEGER,
+        phase TEXT NOT NULL,
+        marked_bytes INTEGER NOT NULL DEFAULT 0,
+        cursor TEXT NOT NULL DEFAULT '',
+        removed INTEGER NOT NULL DEFAULT 0,
+        removed_bytes INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE gc_roots (
+        position INTEGER PRIMARY KEY,
+        stash_id INTEGER NOT NULL,
+        rev INTEGER,
+        tree TEXT,
+        latest INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending'
+    );
+    CREATE TABLE gc_queue (
+        digest TEXT NOT NULL,
+        tree INTEGER NOT NULL,
+        codec TEXT,
+        PRIMARY KEY (digest, tree)
+    ) WITHOUT ROWID;
+    CREATE TABLE gc_marks (
+        digest TEXT NOT NULL,
+        tree INTEGER NOT NULL,
+        PRIMARY KEY (digest, tree)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE usage (
+        stash_id INTEGER NOT NULL REFERENCES stashes(id) ON DELETE CASCADE,
+        key TEXT NOT NULL,
+        files INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (stash_id, key)
+    ) WITHOUT ROWID;
+    CREATE TABLE contents (
+        hash TEXT NOT NULL,
+        stash_id INTEGER NOT NULL REFERENCES stashes(id) ON DELETE CASCADE,
+        refs INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (hash, stash_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX contents_stash ON contents (stash_id);
+    ALTER TABLE stashes ADD COLUMN stored INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE stashes ADD COLUMN shared INTEGER NOT NULL DEFAULT 0;
+    """,
+    # The sizes of contents are their logical sizes, not the sizes of their
+    # objects, which may be compressed, deltas or share chunks. The usage is
+    # counted once the column is named after that.
+    """
+    ALTER TABLE stashes RENAME COLUMN stored TO unique_size;
+    """
+    + ";".join(RECOUNT),
+]
+
+# The hash of a dir row is the tree object of its contents, or NULL while
+# the tree needs to be rebuilt. It is not part of the manifest entry.
+FILE_COLUMNS = (
+    "type",
+    "hash",
+    "size",
+    "mtime_ns",
+    "inode",
+    "mode",
+    "target",
+    "codec",
+)
+
+# Number of rows fetched per query when streaming a manifest.
+BATCH_SIZE = 256
+
+
+def subtree_range(prefix: str) -> tuple[str, str | None]:
+    """Return the relpath bounds of everything below a directory.
+
+    All relpaths starting with "prefix/" sort before "prefix0", since "0"
+    directly follows "/". An empty prefix covers the whole manifest.
+    """
+    if not prefix:
+        return "", None
+    return f"{prefix}/", f"{prefix}0"
+
+
+def prefix_range(prefix: str) -> tuple[str, str | None]:
+    """Return the relpath bounds of everything starting with a prefix.
+
+    The upper bound is the prefix with its last character incremented. An
+    empty prefix covers the whole manifest.
+    """
+    if not prefix:
+        return "", None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def statements(script: str) -> Iterator[str]:
+    """Split an SQL script into its statements."""
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip("; \n"):
+                yield statement
+            statement = ""
+
+
+def migrate(conn: sqlite3.Connection, migrations: list[str]) -> None:
+    """Apply all migrations newer than the schema version of a database.
+
+    Each one runs in a write transaction that reads the version again, so
+    when several processes open a database at once, the first one applies
+    a migration and the others skip it.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, script in enumerate(migrations[version:], start=version + 1):
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                continue
+            for statement in statements(script):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+
+
+def ancestors(relpath: str) -> Iterator[str]:
+    """Yield the relpaths of all directories above a relpath."""
+    while "/" in relpath:
+        relpath = relpath.rpartition("/")[0]
+        yield relpath
+
+
+def row_to_entry(row: tuple) -> dict:
+    """Convert a files row (without stash_id and relpath) to a manifest entry."""
+    entry = {"type": row[0]}
+    if row[0] == "file":
+        entry.update(
+            hash=row[1],
+            size=row[2],
+            mtime_ns=row[3],
+            inode=row[4],
+            mode=row[5],
+            codec=row[7],
+        )
+    elif row[0] == "dir":
+        entry["mode"] = row[5]
+    else:
+        entry["target"] = row[6]
+    return entry
+
+
+class Catalog:
+    """The SQLite catalog holding all stash metadata.
+
+    Every thread gets a connection of its own, so threads can read the
+    catalog while another one writes to it, as WAL mode allows.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._migrate_lock = threading.Lock()
+        self._migrated = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the catalog on first use and bring its schema up to date."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            with self._migrate_lock:
+                if not self._migrated:
+                    migrate(conn, MIGRATIONS)
+                    self._migrated = True
+            self._local.conn = conn
+        return conn
+
+    def stash_id(self, name: str) -> int:
+        """Return the id of a stash."""
+        row = self.conn.execute(
+            "SELECT id FROM stashes WHERE name = ?", (name,)
+        ).fetchone()
+        if not row:
+            raise StashNotFoundError(f"stash with name: '{name}' was not found.")
+        return row[0]
+
+    def exists(self, name: str) -> bool:
+        """Check if a stash exists."""
+        row = self.conn.execute(
+            "SELECT 1 FROM stashes WHERE name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    def names(self) -> list[str]:
+        """Return the names of all stashes."""
+        rows = self.conn.execute("SELECT name FROM stashes ORDER BY name")
+        return [row[0] for row in rows]
+
+    def create(self, name: str) -> int:
+        """Create a stash and return its id."""
+        try:
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO stashes (name) VALUES (?)", (name,)
+                )
+        except sqlite3.IntegrityError:
+            raise StashExistsError(
+                f"stash with name: '{name}' already exists."
+            ) from None
+        return cursor.lastrowid
+
+    def delete(self, name: str) -> None:
+        """Delete a stash along with its tracked paths and manifest.
+
+        Contents it shared with just one other stash are no longer shared
+        by that one.
+        """
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.execute(
+                """
+                UPDATE stashes SET shared = shared - (
+                    SELECT coalesce(sum(o.size), 0) FROM contents o
+                    JOIN contents c ON c.hash = o.hash AND c.stash_id = :id
+                    WHERE o.stash_id = stashes.id
+                    AND (SELECT count(*) FROM contents WHERE hash = o.hash) = 2
+                )
+                WHERE id != :id
+                """,
+                {"id": stash_id},
+            )
+            self.conn.execute("DELETE FROM stashes WHERE id = ?", (stash_id,))
+
+    def snapshot(self, path: str) -> None:
+        """Write a consistent copy of the whole catalog to a new file.
+
+        Operations and gcs running meanwhile are left out of the copy, as
+        they had not finished when it was taken.
+        """
+        target = sqlite3.connect(path)
+        try:
+            self.conn.backup(target)
+            target.execute("PRAGMA journal_mode = DELETE")
+            with target:
+                for table in ("journal", "gc", "gc_roots", "gc_queue", "gc_marks"):
+                    target.execute(f"DELETE FROM {table}")
+        finally:
+            target.close()
+
+    def load(self, path: str) -> None:
+        """Replace the whole catalog with a copy written by snapshot."""
+        source = sqlite3.connect(path)
+        try:
+            source.backup(self.conn)
+        finally:
+            source.close()
+
+    def get_active(self) -> str | None:
+        """Return the name of the active stash."""
+        row = self.conn.execute(
+            "SELECT name FROM active JOIN stashes ON stashes.id = active.stash_id"
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_active(self, name: str | None) -> None:
+        """Set the active stash, or clear it with None."""
+        stash_id = self.stash_id(name) if name is not None else None
+        with self.conn:
+            self.conn.execute("UPDATE active SET stash_id = ?", (stash_id,))
+
+    def get_codec(self, name: str) -> str | None:
+        """Return the codec spec new objects of a stash are stored with."""
+        row = self.conn.execute(
+            "SELECT codec FROM stashes WHERE id = ?", (self.stash_id(name),)
+        ).fetchone()
+        return row[0]
+
+    def set_codec(self, name: str, spec: str | None) -> None:
+        """Set the codec spec of a stash, or store it uncompressed with None."""
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE stashes SET codec = ? WHERE id = ?", (spec, stash_id)
+            )
+
+    def get_chunked(self, name: str) -> bool:
+        """Check if large files of a stash are stored in chunks."""
+        row = self.conn.execute(
+            "SELECT chunked FROM stashes WHERE id = ?", (self.stash_id(name),)
+        ).fetchone()
+        return bool(row[0])
+
+    def set_chunked(self, name: str, chunked: bool) -> None:
+        """Set if large files of a stash are stored in chunks from now on."""
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE stashes SET chunked = ? WHERE id = ?", (int(chunked), stash_id)
+            )
+
+    def begin(self, operation: str, stash: str | None, staging: str) -> int:
+        """Record an operation in the journal and return its id."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO journal (operation, stash, staging, pid, started) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (operation, stash, staging, os.getpid(), time.time()),
+            )
+        return cursor.lastrowid
+
+    def end(self, journal_id: int) -> None:
+        """Remove a finished or rolled back operation from the journal."""
+        with self.conn:
+            self.conn.execute("DELETE FROM journal WHERE id = ?", (journal_id,))
+
+    def journal(self) -> list[tuple[int, str, str | None, str, int]]:
+        """Return all unfinished operations."""
+        return self.conn.execute(
+            "SELECT id, operation, stash, staging, pid FROM journal ORDER BY id"
+        ).fetchall()
+
+    def tracked(self, name: str) -> dict[str, str]:
+        """Return the tracked paths of a stash by key."""
+        rows = self.conn.execute(
+            "SELECT key, path FROM tracked WHERE stash_id = ? ORDER BY key",
+            (self.stash_id(name),),
+        )
+        return dict(rows)
+
+    def track(self, name: str, entries: dict[str, str]) -> None:
+        """Add or replace tracked paths of a stash."""
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tracked (stash_id, key, path) VALUES (?, ?, ?)",
+                [(stash_id, key, path) for key, path in entries.items()],
+            )
+
+    def untrack(self, name: str, keys: Iterable[str]) -> None:
+        """Remove tracked paths of a stash."""
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM tracked WHERE stash_id = ? AND key = ?",
+                [(stash_id, key) for key in keys],
+            )
+
+    def files(self, name: str) -> dict[str, dict]:
+        """Return the manifest of a stash."""
+        rows = self.conn.execute(
+            f"SELECT relpath, {', '.join(FILE_COLUMNS)} FROM files "
+            "WHERE stash_id = ? ORDER BY relpath",
+            (self.stash_id(name),),
+        )
+        return {row[0]: row_to_entry(row[1:]) for row in rows}
+
+    def entry(self, name: str, relpath: str) -> dict | None:
+        """Return the manifest entry of a single relpath."""
+        row = self.conn.execute(
+            f"SELECT {', '.join(FILE_COLUMNS)} FROM files "
+            "WHERE stash_id = ? AND relpath = ?",
+            (self.stash_id(name), relpath),
+        ).fetchone()
+        return row_to_entry(row) if row else None
+
+    def subtree(self, name: str, relpath: str) -> dict[str, dict]:
+        """Return the manifest entries of relpath and everything below it."""
+        low, high = subtree_range(relpath)
+        rows = self.conn.execute(
+            f"SELECT relpath, {', '.join(FILE_COLUMNS)} FROM files "
+            "WHERE stash_id = ? AND (relpath = ? OR (relpath >= ? AND relpath < ?))",
+            (self.stash_id(name), relpath, low, high),
+        )
+        return {row[0]: row_to_entry(row[1:]) for row in rows}
+
+    def prefixed(self, name: str, prefix: str) -> dict[str, dict]:
+        """Return the manifest entries whose relpath starts with a prefix.
+
+        This is a single range scan of the primary key.
+        """
+        low, high = prefix_range(prefix)
+        query = (
+            f"SELECT relpath, {', '.join(FILE_COLUMNS)} FROM files "
+            "WHERE stash_id = ? AND relpath >= ?"
+        )
+        parameters = [self.stash_id(name), low]
+        if high is not None:
+            query += " AND relpath < ?"
+            parameters.append(high)
+        rows = self.conn.execute(query + " ORDER BY relpath", parameters)
+        return {row[0]: row_to_entry(row[1:]) for row in rows}
+
+    def update_files(
+        self,
+        name: str,
+        changed: dict[str, dict],
+        removed: Iterable[str] = (),
+        stat_only: bool = False,
+    ) -> None:
+        """Write changed manifest entries and drop removed ones.
+
+        The trees of all directories above them are marked for a rebuild,
+        and the cached usage is updated, unless only the stat cache of
+        unchanged contents is written.
+        """
+        stash_id = self.stash_id(name)
+        removed = list(removed)
+        with self.conn:
+            if not stat_only:
+                # The usage of other stashes sharing contents changes too, so
+                # it is read and written within a single write transaction.
+                self.conn.execute("BEGIN IMMEDIATE")
+                self._count_usage(stash_id, changed, removed)
+            self.conn.executemany(
+                "DELETE FROM files WHERE stash_id = ? AND relpath = ?",
+                [(stash_id, relpath) for relpath in removed],
+            )
+            if not stat_only:
+                dirty = {
+                    parent
+                    for relpath in [*changed, *removed]
+                    for parent in ancestors(relpath)
+                }
+                self.conn.executemany(
+                    "UPDATE files SET hash = NULL "
+                    "WHERE stash_id = ? AND relpath = ? AND type = 'dir'",
+                    [(stash_id, relpath) for relpath in dirty],
+                )
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO files (stash_id, relpath, "
+                f"{', '.join(FILE_COLUMNS)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(FILE_COLUMNS))})",
+                [
+                    (stash_id, relpath, *(entry.get(c) for c in FILE_COLUMNS))
+                    for relpath, entry in changed.items()
+                ],
+            )
+
+    def refresh_stat(self, name: str, entries: dict[str, dict]) -> None:
+        """Write the stat cache of files whose contents were found unchanged.
+
+        Only entries still holding the compared contents are updated, so
+        entries a push replaced meanwhile are left alone.
+        """
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE files SET size = ?, mtime_ns = ?, inode = ? "
+                "WHERE stash_id = ? AND relpath = ? AND hash = ?",
+                [
+                    (
+                        entry["size"],
+                        entry["mtime_ns"],
+                        entry["inode"],
+                        stash_id,
+                        relpath,
+                        entry["hash"],
+                    )
+                    for relpath, entry in entries.items()
+                ],
+            )
+
+    def _rows_in(
+        self, query: str, parameters: list, values: list
+    ) -> Iterator[tuple]:
+        """Yield the rows of a query ending in IN, for values in batches."""
+        for i in range(0, len(values), BATCH_SIZE):
+            batch = values[i : i + BATCH_SIZE]
+            yield from self.conn.execute(
+                f"{query} ({', '.join('?' * len(batch))})", [*parameters, *batch]
+            )
+
+    def _count_usage(
+        self, stash_id: int, changed: dict[str, dict], removed: list[str]
+    ) -> None:
+        """Update the cached usage for manifest entries about to be written.
+
+        The file count and size of every tracked entry change by the files
+        replaced and added. The unique size of a stash changes when it
+        refers to contents for the first or last time, and its shared size
+        too if other stashes refer to them. A stash that shared contents
+        with this one alone starts or stops sharing them as well.
+        """
+        old = self._rows_in(
+            "SELECT relpath, hash, size FROM files "
+            "WHERE stash_id = ? AND type = 'file' AND relpath IN",
+            [stash_id],
+            sorted([*changed, *removed]),
+        )
+        new = (
+            (relpath, entry["hash"], entry["size"])
+            for relpath, entry in changed.items()
+            if entry["type"] == "file"
+        )
+        keys = {}
+        refs = {}
+        for sign, rows in ((-1, old), (1, new)):
+            for relpath, digest, size in rows:
+                counts = keys.setdefault(relpath.partition("/")[0], [0, 0])
+                counts[0] += sign
+                counts[1] += sign * size
+                refs.setdefault(digest, [0, size])[0] += sign
+
+        self.conn.executemany(
+            "INSERT INTO usage (stash_id, key, files, size) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (stash_id, key) DO UPDATE SET "
+            "files = files + excluded.files, size = size + excluded.size",
+            [
+                (stash_id, key, files, size)
+                for key, (files, size) in keys.items()
+                if files or size
+            ],
+        )
+        self.conn.execute(
+            "DELETE FROM usage WHERE stash_id = ? AND files = 0", (stash_id,)
+        )
+
+        refs = {digest: ref for digest, ref in refs.items() if ref[0]}
+        held = dict(
+            self._rows_in(
+                "SELECT hash, refs FROM contents WHERE stash_id = ? AND hash IN",
+                [stash_id],
+                sorted(refs),
+            )
+        )
+        kept = []
+        dropped = []
+        flipped = {}
+        for digest, (delta, size) in refs.items():
+            count = held.get(digest, 0) + delta
+            if count:
+                kept.append((digest, stash_id, count, size))
+            else:
+                dropped.append((digest, stash_id))
+            if bool(count) != (digest in held):
+                flipped[digest] = size if count else -size
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO contents (hash, stash_id, refs, size) "
+            "VALUES (?, ?, ?, ?)",
+            kept,
+        )
+        self.conn.executemany(
+            "DELETE FROM contents WHERE hash = ? AND stash_id = ?", dropped
+        )
+
+        holders = {}
+        for digest, other in self._rows_in(
+            "SELECT hash, stash_id FROM contents WHERE stash_id != ? AND hash IN",
+            [stash_id],
+            sorted(flipped),
+        ):
+            holders.setdefault(digest, []).append(other)
+        unique = shared = 0
+        others = {}
+        for digest, size in flipped.items():
+            unique += size
+            if digest in holders:
+                shared += size
+                if len(holders[digest]) == 1:
+                    other = holders[digest][0]
+                    others[other] = others.get(other, 0) + size
+        self.conn.executemany(
+            "UPDATE stashes SET unique_size = unique_size + ?, "
+            "shared = shared + ? WHERE id = ?",
+            [(unique, shared, stash_id)]
+            + [(0, size, other) for other, size in others.items()],
+        )
+
+    def usage(self, name: str | None = None) -> list[tuple[str, int, int, int, int]]:
+        """Return the cached usage of one or all stashes.
+
+        Rows hold the name, file count, size, unique size and shared size.
+        """
+        query = (
+            "SELECT name, coalesce(sum(files), 0), coalesce(sum(size), 0), "
+            "unique_size, shared FROM stashes LEFT JOIN usage ON stash_id = id"
+        )
+        parameters = []
+        if name is not None:
+            query += " WHERE id = ?"
+            parameters.append(self.stash_id(name))
+        rows = self.conn.execute(query + " GROUP BY id ORDER BY name", parameters)
+        return rows.fetchall()
+
+    def key_usage(self, name: str) -> dict[str, tuple[int, int]]:
+        """Return the cached file count and size of the keys of a stash."""
+        rows = self.conn.execute(
+            "SELECT key, files, size FROM usage WHERE stash_id = ? ORDER BY key",
+            (self.stash_id(name),),
+        )
+        return {key: (files, size) for key, files, size in rows}
+
+    def recount(self) -> list[str]:
+        """Recompute the cached usage of all stashes from their manifests.
+
+        Returns the names of the stashes whose cached usage was off.
+        """
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            before = self._cached_usage()
+            for statement in RECOUNT:
+                self.conn.execute(statement)
+            after = self._cached_usage()
+        return sorted(name for name in after if before.get(name) != after[name])
+
+    def _cached_usage(self) -> dict[str, tuple]:
+        """Return everything cached about the usage of every stash by name."""
+        keys = {}
+        rows = self.conn.execute(
+            "SELECT stash_id, key, files, size FROM usage ORDER BY stash_id, key"
+        )
+        for stash_id, *row in rows:
+            keys.setdefault(stash_id, []).append(tuple(row))
+        rows = self.conn.execute("SELECT id, name, unique_size, shared FROM stashes")
+        return {
+            name: (unique, shared, keys.get(stash_id, []))
+            for stash_id, name, unique, shared in rows
+        }
+
+    def children(self, name: str, prefix: str = "") -> Iterator[tuple[str, dict]]:
+        """Yield the direct children of a manifest directory in name order."""
+        for row in self._child_rows(name, prefix):
+            yield row[0], row_to_entry(row[1:])
+
+    def tree_rows(self, name: str, prefix: str = "") -> Iterator[tuple]:
+        """Yield the rows of the direct children of a directory in name order."""
+        return self._child_rows(name, prefix)
+
+    def _child_rows(self, name: str, prefix: str) -> Iterator[tuple]:
+        """Yield the files rows of the direct children of a directory.
+
+        Rows are fetched in small batches and the rows below a child
+        directory are skipped with a seek, so memory stays bounded and the
+        cost depends on the number of children, not on the subtree size.
+        """
+        stash_id = self.stash_id(name)
+        low, high = subtree_range(prefix)
+        base = len(low)
+        operator = ">="
+        while True:
+            query = (
+                f"SELECT relpath, {', '.join(FILE_COLUMNS)} FROM files "
+                f"WHERE stash_id = ? AND relpath {operator} ?"
+            )
+            parameters = [stash_id, low]
+            if high is not None:
+                query += " AND relpath < ?"
+                parameters.append(high)
+            # The cursor is stepped lazily, a seek right after the first row
+            # of a batch does not read the rest of it.
+            rows = self.conn.execute(
+                query + f" ORDER BY relpath LIMIT {BATCH_SIZE}", parameters
+            )
+            count = 0
+            for count, row in enumerate(rows, start=1):
+                child, separator, _ = row[0][base:].partition("/")
+                if separator:
+                    low, operator = f"{row[0][:base]}{child}0", ">="
+                    break
+                yield row
+                low, operator = row[0], ">"
+            else:
+                if count < BATCH_SIZE:
+                    return
+
+    def rollup(self, name: str, prefix: str = "") -> tuple[int, int]:
+        """Return the file count and total size below a manifest directory.
+
+        The root and the tracked keys, the largest subtrees, are read from
+        the cached usage. Only deeper directories count their manifest rows.
+        """
+        stash_id = self.stash_id(name)
+        if "/" not in prefix:
+            query = (
+                "SELECT coalesce(sum(files), 0), coalesce(sum(size), 0) "
+                "FROM usage WHERE stash_id = ?"
+            )
+            parameters = [stash_id]
+            if prefix:
+                query += " AND key = ?"
+                parameters.append(prefix)
+            return tuple(self.conn.execute(query, parameters).fetchone())
+
+        low, high = subtree_range(prefix)
+        query = (
+            "SELECT count(*), coalesce(sum(size), 0) FROM files "
+            "WHERE stash_id = ? AND type = 'file' AND relpath >= ?"
+        )
+        parameters = [stash_id, low]
+        if high is not None:
+            query += " AND relpath < ?"
+            parameters.append(high)
+        return tuple(self.conn.execute(query, parameters).fetchone())
+
+    def dirty_trees(self, name: str) -> list[str]:
+        """Return the directories whose tree needs to be rebuilt."""
+        rows = self.conn.execute(
+            "SELECT relpath FROM files "
+            "WHERE stash_id = ? AND type = 'dir' AND hash IS NULL",
+            (self.stash_id(name),),
+        )
+        return [row[0] for row in rows]
+
+    def record_revision(
+        self, name: str, trees: dict[str, str], tree: str, changes: int
+    ) -> int | None:
+        """Store rebuilt directory trees and add a revision with a root tree.
+
+        No revision is added if the root tree is the one of the latest
+        revision. Returns the number of the new revision.
+        """
+        stash_id = self.stash_id(name)
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE files SET hash = ? WHERE stash_id = ? AND relpath = ?",
+                [(digest, stash_id, relpath) for relpath, digest in trees.items()],
+            )
+            head = self.conn.execute(
+                "SELECT rev, tree FROM revisions WHERE stash_id = ? "
+                "ORDER BY rev DESC LIMIT 1",
+                (stash_id,),
+            ).fetchone()
+            if head and head[1] == tree:
+                return None
+
+            rev = head[0] + 1 if head else 1
+            self.conn.execute(
+                "INSERT INTO revisions (stash_id, rev, tree, created, changes) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (stash_id, rev, tree, time.time(), changes),
+            )
+        return rev
+
+    def revisions(self, name: str) -> list[tuple[int, str, float, int]]:
+        """Return the number, root tree, time and change count of all revisions."""
+        return self.conn.execute(
+            "SELECT rev, tree, created, changes FROM revisions "
+            "WHERE stash_id = ? ORDER BY rev DESC",
+            (self.stash_id(name),),
+        ).fetchall()
+
+    def revision_tree(self, name: str, rev: int) -> str:
+        """Return the root tree of a revision."""
+        row = self.conn.execute(
+            "SELECT tree FROM revisions WHERE stash_id = ? AND rev = ?",
+            (self.stash_id(name), rev),
+        ).fetchone()
+        if not row:
+            raise RevisionNotFoundError(
+                f"revision {rev} of stash '{name}' was not found."
+            )
+        return row[0]
+
+    def all_revisions(self) -> list[tuple[int, int, str, float]]:
+        """Return the stash id, number, root tree and time of all revisions."""
+        return self.conn.execute(
+            "SELECT stash_id, rev, tree, created FROM revisions"
+        ).fetchall()
+
+    def oldest_operation(self) -> float | None:
+        """Return when the oldest unfinished operation started."""
+        return self.conn.execute("SELECT min(started) FROM journal").fetchone()[0]
+
+    # A gc keeps its progress in the gc tables, so it can be interrupted and
+    # resumed. Its roots are the manifests (rev NULL) and revisions to keep,
+    # processed in position order. Objects reachable from a root are marked
+    # by draining a queue, a tree is only marked along with queueing its
+    # children, so marked trees never hide unmarked objects.
+
+    def gc_state(self) -> dict | None:
+        """Return the state of the running or interrupted gc."""
+        self.conn.row_factory = sqlite3.Row
+        try:
+            row = self.conn.execute("SELECT * FROM gc").fetchone()
+        finally:
+            self.conn.row_factory = None
+        return dict(row) if row else None
+
+    def gc_begin(
+        self,
+        cutoff: float,
+        dry_run: bool,
+        max_size: int | None,
+        roots: list[tuple[int, int | None, str | None, bool]],
+        dropped: list[tuple[int, int]],
+    ) -> None:
+        """Start a gc from scratch with its roots in order.
+
+        Roots are given as stash id, revision, root tree and whether it is
+        the latest revision. Revisions dropped by the retention rules right
+        away are recorded too, so they get pruned along with the others.
+        """
+        with self.conn:
+            for table in ("gc", "gc_roots", "gc_queue", "gc_marks"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.conn.execute(
+                "INSERT INTO gc (id, pid, started, cutoff, dry_run, max_size, phase) "
+                "VALUES (0, ?, ?, ?, ?, ?, 'mark')",
+                (os.getpid(), time.time(), cutoff, int(dry_run), max_size),
+            )
+            self.conn.executemany(
+                "INSERT INTO gc_roots (stash_id, rev, tree, latest) "
+                "VALUES (?, ?, ?, ?)",
+                roots,
+            )
+            self.conn.executemany(
+                "INSERT INTO gc_roots (stash_id, rev, tree, latest, state) "
+                "VALUES (?, ?, NULL, 0, 'dropped')",
+                dropped,
+            )
+
+    def gc_update(self, **fields) -> None:
+        """Update fields of the gc state."""
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE gc SET {', '.join(f'{field} = ?' for field in fields)}",
+                list(fields.values()),
+            )
+
+    def gc_next_root(self) -> tuple[int, int, int | None, str | None, bool] | None:
+        """Return the next root to mark, with its position first."""
+        return self.conn.execute(
+            "SELECT position, stash_id, rev, tree, latest FROM gc_roots "
+            "WHERE state = 'pending' ORDER BY position LIMIT 1"
+        ).fetchone()
+
+    def gc_start_root(self, position: int, stash_id: int, tree: str | None) -> None:
+        """Queue the objects of a root and mark it as kept.
+
+        A manifest root queues the objects of all entries of the stash that
+        are not marked yet.
+        """
+        with self.conn:
+            if tree is None:
+                self._gc_queue_files(stash_id)
+            else:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO gc_queue (digest, tree, codec) "
+                    "VALUES (?, 1, NULL)",
+                    (tree,),
+                )
+            self.conn.execute(
+                "UPDATE gc_roots SET state = 'kept' WHERE position = ?", (position,)
+            )
+
+    def _gc_queue_files(self, stash_id: int | None = None) -> None:
+        """Queue the unmarked objects of the manifest of a stash, or of all."""
+        query = (
+            "INSERT OR IGNORE INTO gc_queue (digest, tree, codec) "
+            "SELECT hash, type = 'dir', codec FROM files "
+            "WHERE hash IS NOT NULL AND type != 'link' "
+            "AND NOT EXISTS (SELECT 1 FROM gc_marks WHERE "
+            "gc_marks.digest = files.hash AND gc_marks.tree = (type = 'dir'))"
+        )
+        if stash_id is None:
+            self.conn.execute(query)
+        else:
+            self.conn.execute(query + " AND stash_id = ?", (stash_id,))
+
+    def gc_drop_roots(self, position: int) -> None:
+        """Drop all pending roots from a position on."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE gc_roots SET state = 'dropped' "
+                "WHERE state = 'pending' AND position >= ?",
+                (position,),
+            )
+
+    def gc_dropped(self) -> list[tuple[int, int]]:
+        """Return the stash id and number of all revisions the gc drops."""
+        return self.conn.execute(
+            "SELECT stash_id, rev FROM gc_roots WHERE state = 'dropped'"
+        ).fetchall()
+
+    def gc_queued(self, limit: int) -> list[tuple[str, bool, str | None]]:
+        """Return queued objects as digest, tree flag and codec."""
+        rows = self.conn.execute(
+            "SELECT digest, tree, codec FROM gc_queue LIMIT ?", (limit,)
+        )
+        return [(digest, bool(tree), codec) for digest, tree, codec in rows]
+
+    def gc_marked(self, objects: list[tuple[str, bool]]) -> set[tuple[str, bool]]:
+        """Return which of the given objects are marked already."""
+        digests = sorted({digest for digest, _ in objects})
+        marked = set()
+        for i in range(0, len(digests), BATCH_SIZE):
+            batch = digests[i : i + BATCH_SIZE]
+            rows = self.conn.execute(
+                "SELECT digest, tree FROM gc_marks "
+                f"WHERE digest IN ({', '.join('?' * len(batch))})",
+                batch,
+            )
+            marked.update((digest, bool(tree)) for digest, tree in rows)
+        return marked & set(objects)
+
+    def gc_mark(
+        self,
+        done: list[tuple[str, bool]],
+        marks: list[tuple[str, bool]],
+        queued: list[tuple[str, bool, str | None]],
+        size: int,
+    ) -> None:
+        """Mark processed objects and queue their children in one go."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM gc_queue WHERE digest = ? AND tree = ?",
+                [(digest, int(tree)) for digest, tree in done],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO gc_marks (digest, tree) VALUES (?, ?)",
+                [(digest, int(tree)) for digest, tree in marks],
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO gc_queue (digest, tree, codec) "
+                "VALUES (?, ?, ?)",
+                [(digest, int(tree), codec) for digest, tree, codec in queued],
+            )
+            self.conn.execute(
+                "UPDATE gc SET marked_bytes = marked_bytes + ?", (size,)
+            )
+
+    def gc_marked_digests(self, prefix: str) -> set[str]:
+        """Return the marked digests starting with a prefix."""
+        rows = self.conn.execute(
+            "SELECT DISTINCT digest FROM gc_marks WHERE digest >= ? AND digest < ?",
+            (prefix, f"{prefix}g"),
+        )
+        return {row[0] for row in rows}
+
+    def gc_catch_up(self, since: float) -> None:
+        """Queue what manifests and revisions added since a time refer to."""
+        with self.conn:
+            self._gc_queue_files()
+            self.conn.execute(
+                "INSERT OR IGNORE INTO gc_queue (digest, tree, codec) "
+                "SELECT tree, 1, NULL FROM revisions WHERE created >= ?",
+                (since,),
+            )
+
+    def gc_prune(self) -> None:
+        """Delete the revisions the gc dropped."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM revisions WHERE stash_id = ? AND rev = ?",
+                self.gc_dropped(),
+            )
+
+    def gc_finish(self) -> None:
+        """Drop the gc state."""
+        with self.conn:
+            for table in ("gc", "gc_roots", "gc_queue", "gc_marks"):
+                self.conn.execute(f"DELETE FROM {table}")
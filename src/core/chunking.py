@@ -0,0 +1,139 @@
+from typing import BinaryIO, Iterator
+
+
+# Files from this size on are split into chunks in chunked stashes.
+CHUNKED_MIN_SIZE = 1024 * 1024
+
+# Chunks are at least MIN_SIZE and at most MAX_SIZE long. Past MIN_SIZE a
+# chunk ends where the rolling hash is below LIMIT, that is where its top
+# 16 bits are zero, which makes them 80 KiB long on average.
+MIN_SIZE = 16 * 1024
+MAX_SIZE = 256 * 1024
+LIMIT = 1 << 16
+
+# Bytes hashed at once, small enough for the hash arrays to stay in the
+# CPU cache. The hash of a position only depends on the WINDOW bytes up to
+# it, so each block is hashed along with the last WINDOW - 1 bytes before.
+BLOCK_SIZE = 128 * 1024
+WINDOW = 32
+
+_gear = None
+_gear_array = None
+
+
+def gear() -> list[int]:
+    """Return the random 32-bit value every byte value is mixed in with.
+
+    The table is derived from a fixed hash, so chunk boundaries never
+    change between runs or machines.
+    """
+    global _gear
+    if _gear is None:
+        import hashlib
+
+        _gear = [
+            int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=4).digest())
+            for i in range(256)
+        ]
+    return _gear
+
+
+def candidates_python(data: bytes, context: bytes) -> list[int]:
+    """Return the offsets in data after which a chunk may end.
+
+    This is the gear hash, h = (h << 1) + gear[byte] in 32 bits, rolled
+    over every byte. Shifting pushes a byte out of the hash after 32 steps,
+    so starting from the bytes before data gives the same hashes as
+    rolling over the whole file.
+    """
+    table = gear()
+    h = 0
+    for byte in context:
+        h = ((h << 1) + table[byte]) & 0xFFFFFFFF
+    found = []
+    for offset, byte in enumerate(data):
+        h = ((h << 1) + table[byte]) & 0xFFFFFFFF
+        if h < LIMIT:
+            found.append(offset)
+    return found
+
+
+def candidates_numpy(data: bytes, context: bytes) -> list[int]:
+    """Return the same offsets as candidates_python, vectorized.
+
+    The hash of a position is the sum of gear[byte] << age over the last
+    32 bytes. Window sums are doubled five times, from one byte to 32, by
+    adding the sum ending w bytes earlier shifted by w, so every byte
+    costs a handful of array operations instead of a Python loop.
+    """
+    import numpy
+
+    global _gear_array
+    if _gear_array is None:
+        _gear_array = numpy.array(gear(), dtype=numpy.uint32)
+    h = numpy.take(_gear_array, numpy.frombuffer(context + data, dtype=numpy.uint8))
+    width = 1
+    while width < WINDOW:
+        h[width:] += h[:-width] << numpy.uint32(width)
+        width *= 2
+    return numpy.flatnonzero(h[len(context) :] < LIMIT).tolist()
+
+
+_candidates = None
+
+
+def candidates(data: bytes, context: bytes) -> list[int]:
+    """Return the offsets after which a chunk may end, with NumPy if present."""
+    global _candidates
+    if _candidates is None:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            _candidates = candidates_python
+        else:
+            _candidates = candidates_numpy
+    return _candidates(data, context)
+
+
+def split(f: BinaryIO) -> Iterator[bytes]:
+    """Split a file into content-defined chunks.
+
+    A chunk ends after the first candidate offset at least MIN_SIZE into
+    it, or after MAX_SIZE bytes. Since candidates only depend on the bytes
+    around them, an edit only changes the chunks it touches, and the ones
+    after it line up again at the next boundary.
+    """
+    buffer = b""
+    cuts = []
+    start = 0
+    context = b""
+    while True:
+        data = f.read(BLOCK_SIZE)
+        end = start + len(buffer)
+        if data:
+            cuts.extend(end + offset + 1 for offset in candidates(data, context))
+            context = (context + data[-(WINDOW - 1) :])[-(WINDOW - 1) :]
+            buffer += data
+            end += len(data)
+
+        i = 0
+        used = 0
+        while True:
+            while i < len(cuts) and cuts[i] - start < MIN_SIZE:
+                i += 1
+            if i < len(cuts) and cuts[i] - start <= MAX_SIZE:
+                cut = cuts[i]
+            elif end - start >= MAX_SIZE:
+                cut = start + MAX_SIZE
+            else:
+                break
+            yield buffer[used : used + cut - start]
+            used += cut - start
+            start = cut
+        del cuts[:i]
+        buffer = buffer[used:]
+
+        if not data:
+            if buffer:
+                yield buffer
+            return
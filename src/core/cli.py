@@ -1,44 +1,431 @@
-from typing import Callable
+import sys
+import time
+from typing import Callable, Sequence
 
 
-from core.parser import Parser
+from core.errors import NoActiveStashError
+from core.results import BackupResult, RestoreResult, TreeNode, Usage
+from core.utils import format_size
+
+
+# Commands without arguments that skip building the argument parser.
+FAST_COMMANDS = ("list", "status", "tracked")
 
 
 class Cli:
     def __init__(self, service) -> None:
-        """Setup parser."""
-        self.parser = Parser()
+        """Setup the command map."""
+        self._parser = None
         self.service = service
         self.command_map = self._setup_command_map()
 
+    @property
+    def parser(self):
+        """Build the argument parser on first use."""
+        if self._parser is None:
+            from core.parser import Parser
+
+            self._parser = Parser()
+        return self._parser
+
     def _setup_command_map(
         self,
     ) -> dict[str, dict[str, list[Callable, tuple[str, ...]]]]:
         """Setup and return the command map."""
         return {
             "create": [self.service.create, "name"],
-            "delete": [self.service.delete, "name"],
-            "list": [self.service.list],
+            "delete": [self.delete, "name"],
+            "list": [self.list, "long"],
             "activate": [self.service.activate, "name"],
+            "apply": [self.apply, "name", "link"],
+            "checkout": [self.checkout, "spec"],
+            "restore": [self.restore, "name", "rev", "only", "exclude"],
+            "log": [self.log, "name"],
+            "stats": [self.stats, "name"],
+            "du": [self.du, "name", "verify"],
+            "gc": [self.gc, "keep_last", "keep_daily", "max_size", "dry_run"],
             "clear": [self.service.clear],
-            "status": [self.service.status],
-            "push": [self.service.push],
-            "tree": [self.service.tree, "name"],
-            "track": [self.service.track, "path"],
-            "untrack": [self.service.untrack, "path_or_key"],
-            "tracked": [self.service.tracked],
+            "status": [self.status, "changes"],
+            "push": [self.service.push, "codec", "chunked"],
+            "watch": [self.watch, "debounce", "rescan"],
+            "tree": [self.tree, "name", "depth", "max_entries"],
+            "diff": [self.diff, "name", "patch"],
+            "cat": [self.cat, "name", "relpath"],
+            "export": [self.export_bundle, "name", "path", "compress"],
+            "import": [self.import_bundle, "path", "name"],
+            "backup": [
+                self.backup,
+                "target",
+                "every",
+                "keep",
+                "list_snapshots",
+                "verify",
+                "restore",
+                "snapshot",
+            ],
+            "track": [self.track, "paths"],
+            "untrack": [self.service.untrack, "paths_or_keys"],
+            "tracked": [self.tracked],
         }
 
-    def execute(self) -> None:
+    def execute(self, argv: list[str] | None = None) -> None:
         """Execute the cli."""
-        args = self.parser.parser.parse_args()
+        argv = sys.argv[1:] if argv is None else argv
+        if len(argv) == 1 and argv[0] in FAST_COMMANDS:
+            self._call(self.command_map[argv[0]][0])
+            return
+
+        args = self.parser.parser.parse_args(argv)
         mapping = self.command_map.get(args.command)
         if not mapping:
             return
 
+        if args.jobs:
+            self.service.engine.jobs = args.jobs
+
         callback = mapping[0]
         parameters = []
         for parameter in mapping[1:]:
             parameters.append(getattr(args, parameter))
 
-        callback(*parameters)
+        profiler = None
+        if args.profile:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if args.trace:
+            self.service.timings.subscribe(self._trace)
+
+        try:
+            self._call(callback, *parameters)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+            if args.trace:
+                self._trace({"totals": self.service.timings.to_dict()})
+            if args.timings:
+                print(self.service.timings.summary(), file=sys.stderr)
+
+    def _trace(self, event: dict) -> None:
+        """Print a timing event to stderr as a JSON line."""
+        import json
+
+        print(json.dumps(event), file=sys.stderr)
+
+    def _call(self, callback: Callable, *parameters) -> None:
+        """Call a command, telling how to activate a stash if it needs one."""
+        try:
+            callback(*parameters)
+        except NoActiveStashError:
+            print("No current active stash.")
+            print("Activate one by doing: stasher activate <name>")
+
+    def recover(self) -> None:
+        """Roll back interrupted operations and report them."""
+        for operation, name in self.service.recover():
+            print(
+                f"Rolled back interrupted {operation}"
+                + (f" of stash '{name}'." if name else "."),
+                file=sys.stderr,
+            )
+
+    def delete(self, name: str) -> None:
+        """Delete a stash, exiting if its directory cannot be removed."""
+        try:
+            self.service.delete(name)
+        except OSError as e:
+            path = self.service.stashes_dir / name
+            print(f"Could not remove directory '{path}': {e}", file=sys.stderr)
+            sys.exit(1)
+
+    def list(self, long: bool = False) -> None:
+        """Print the names of all stashes, with their sizes in long mode."""
+        if long:
+            self._print_usage(self.service.usage())
+            return
+        for stash in self.service.list():
+            print(stash.name)
+
+    def _print_usage(self, rows: Sequence[Usage]) -> None:
+        """Print a table of cached usage rows."""
+        print(f"{'name':<20} {'files':>8} {'size':>10} {'unique':>10} {'shared':>10}")
+        for row in rows:
+            if row.key is None:
+                unique, shared = format_size(row.unique), format_size(row.shared)
+                name = row.name
+            else:
+                unique = shared = "-"
+                name = f"  {row.key}" + ("" if row.path else " (untracked)")
+            print(
+                f"{name:<20} {row.files:>8} {format_size(row.size):>10} "
+                f"{unique:>10} {shared:>10}"
+            )
+
+    def _print_restored(self, result: RestoreResult) -> None:
+        """Print what a restore did."""
+        if result.linked is not None:
+            print(f"linked {result.linked} path(s)")
+            return
+        if result.bundle is not None:
+            print(f"restored {result.restored} file(s) from '{result.bundle}'")
+            if result.removed:
+                print(f"removed {result.removed} path(s) not in the bundle")
+            return
+
+        summary = ", ".join(
+            f"{count} {kind}" for kind, count in result.strategies.items()
+        )
+        print(
+            f"restored {result.restored} file(s)"
+            + (f" ({summary})" if summary else "")
+        )
+        print(f"{result.unchanged} file(s) unchanged")
+        if result.removed:
+            print(f"removed {result.removed} path(s) not in the stash")
+
+    def apply(self, name: str, link: bool = False) -> None:
+        """Apply a stash and print what was restored."""
+        self._print_restored(self.service.apply(name, link))
+
+    def checkout(self, spec: str) -> None:
+        """Check out a stash revision and print what was restored."""
+        self._print_restored(self.service.checkout(spec))
+
+    def restore(
+        self,
+        name: str,
+        rev: int | None = None,
+        only: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+    ) -> None:
+        """Restore a stash revision and print what was restored."""
+        self._print_restored(self.service.restore(name, rev, only, exclude))
+
+    def log(self, name: str | None = None) -> None:
+        """Print the revisions of a stash, newest first."""
+        revisions = self.service.log(name)
+        if not revisions:
+            print("No revisions yet, push to record one.")
+        for revision in revisions:
+            date = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(revision.created)
+            )
+            print(f"{revision.rev:>4}  {date}  {revision.changes} change(s)")
+
+    def gc(
+        self,
+        keep_last: int | None = None,
+        keep_daily: int | None = None,
+        max_size: int | None = None,
+        dry_run: bool = False,
+    ) -> None:
+        """Run a gc and print what it reclaimed."""
+        try:
+            result = self.service.gc(keep_last, keep_daily, max_size, dry_run)
+        except KeyboardInterrupt:
+            print("gc interrupted, run it again to continue.", file=sys.stderr)
+            sys.exit(130)
+
+        if result.resumed is not None:
+            started = time.strftime("%H:%M:%S", time.localtime(result.resumed))
+            print(
+                f"resumed the gc started at {started} with its retention rules.",
+                file=sys.stderr,
+            )
+        removed = f"{result.removed} object(s) ({format_size(result.removed_bytes)})"
+        if result.dry_run:
+            print(
+                f"{result.pruned} revision(s) would be pruned, "
+                f"{removed} can be reclaimed"
+            )
+        else:
+            print(f"pruned {result.pruned} revision(s), removed {removed}")
+
+    def stats(self, name: str | None = None) -> None:
+        """Print the deduplication table of stashes."""
+        print(f"{'stash':<20} {'files':>8} {'size':>10} {'stored':>10} {'dedup':>7}")
+        for row in self.service.stats(name):
+            ratio = f"{row.ratio:.2f}x" if row.ratio is not None else "-"
+            print(
+                f"{row.name or 'total':<20} {row.files:>8} "
+                f"{format_size(row.size):>10} {format_size(row.stored):>10} "
+                f"{ratio:>7}"
+            )
+
+    def du(self, name: str | None = None, verify: bool = False) -> None:
+        """Print the cached usage of stashes, recomputing it first to verify."""
+        if verify:
+            for stale in self.service.recount():
+                print(f"Fixed the cached sizes of stash '{stale}'.", file=sys.stderr)
+        self._print_usage(self.service.usage(name))
+
+    def status(self, changes: bool = False) -> None:
+        """Print the active stash and optionally its unpushed changes."""
+        name = self.service.status()
+        print(name)
+        if changes:
+            self.diff(name)
+
+    def diff(self, name: str | None = None, patch: bool = False) -> None:
+        """Print the differences between the tracked paths and a stash."""
+        for change in self.service.diff(name, patch):
+            print(f"{change.status} {change.relpath}")
+            if change.binary:
+                print(f"Binary files a/{change.relpath} and b/{change.relpath} differ")
+            elif change.patch:
+                sys.stdout.writelines(change.patch)
+
+    def watch(self, debounce: float = 1.0, rescan: float = 300.0) -> None:
+        """Watch the active stash and print every push."""
+
+        def _pushed(name: str, count: int) -> None:
+            """Print a push of the watcher."""
+            print(
+                f"[{time.strftime('%H:%M:%S')}] pushed {count} change(s) "
+                f"to '{name}'",
+                flush=True,
+            )
+
+        name = self.service.status()
+        print(f"Watching stash '{name}', press Ctrl-C to stop.", flush=True)
+        self.service.watch(debounce, rescan, _pushed)
+
+    def tree(
+        self, name: str, depth: int | None = None, max_entries: int | None = None
+    ) -> None:
+        """Print the tree of a stash or bundle as it is walked."""
+
+        def _rollup(node: TreeNode) -> str:
+            """Return the rollup label of a directory."""
+            plural = "s" if node.files != 1 else ""
+            return f"({node.files} file{plural}, {format_size(node.size)})"
+
+        write = sys.stdout.write
+        indents = []
+        for node in self.service.tree(name, depth, max_entries):
+            if node.depth == 0:
+                write(f"{name} {_rollup(node)}\n")
+                continue
+
+            del indents[node.depth - 1 :]
+            indent = "".join(indents)
+            if node.kind == "more":
+                write(f"{indent}└── …\n")
+                continue
+
+            label = node.relpath.rpartition("/")[2]
+            if node.kind == "dir":
+                label = f"{label}/ {_rollup(node)}"
+            elif node.kind == "link":
+                label = f"{label} -> {node.target}"
+            write(f"{indent}{'└── ' if node.last else '├── '}{label}\n")
+            indents.append("    " if node.last else "│   ")
+
+    def cat(self, name: str, relpath: str) -> None:
+        """Write a file of a stash or bundle to stdout."""
+        sys.stdout.buffer.writelines(self.service.cat(name, relpath))
+
+    def export_bundle(self, name: str, path: str, compress: bool = False) -> None:
+        """Export a stash and print what was written."""
+        result = self.service.export_bundle(name, path, compress)
+        print(
+            f"exported {result.entries} entries ({format_size(result.size)}) "
+            f"to '{result.path}'"
+        )
+
+    def import_bundle(self, path: str, name: str | None = None) -> None:
+        """Import a bundle and print what was read."""
+        result = self.service.import_bundle(path, name)
+        print(f"imported {result.entries} entries into stash '{result.name}'")
+
+    def backup(
+        self,
+        target: str,
+        every: float | None = None,
+        keep: int | None = None,
+        list_snapshots: bool = False,
+        verify: bool = False,
+        restore: bool = False,
+        snapshot: int | None = None,
+    ) -> None:
+        """Back up to a directory, or list, verify or restore the backup."""
+        if list_snapshots:
+            snapshots = self.service.backups(target)
+            if not snapshots:
+                print("No snapshots yet, back up to take one.")
+            for snap in snapshots:
+                date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap.created))
+                print(
+                    f"{snap.id:>4}  {date}  {snap.objects} object(s) "
+                    f"({format_size(snap.size)})"
+                )
+            return
+
+        if verify:
+            bad = self.service.verify_backup(target)
+            for path in bad:
+                print(f"Missing or corrupt: {path}", file=sys.stderr)
+            if bad:
+                sys.exit(1)
+            print("backup verified")
+            return
+
+        if restore:
+            result = self.service.restore_backup(target, snapshot)
+            date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(result.created))
+            print(
+                f"restored snapshot {result.snapshot} from {date}, copied "
+                f"{result.objects} object(s) ({format_size(result.size)})"
+            )
+            print("Apply a stash to restore its tracked paths as well.")
+            return
+
+        if every is None:
+            self._print_backup(self.service.backup(target, keep))
+            return
+
+        print(
+            f"Backing up to '{target}' every {every:g} seconds, press Ctrl-C to stop.",
+            flush=True,
+        )
+        try:
+            self.service.backup_every(
+                target, every, keep, self._print_backup, self._print_backup_error
+            )
+        except KeyboardInterrupt:
+            pass
+
+    def _print_backup(self, result: BackupResult) -> None:
+        """Print what a backup copied and pruned."""
+        if result.unchanged:
+            print(f"snapshot {result.snapshot}: nothing changed", flush=True)
+        else:
+            print(
+                f"snapshot {result.snapshot}: backed up {result.objects} new "
+                f"object(s) ({format_size(result.size)})",
+                flush=True,
+            )
+        if result.pruned:
+            print(
+                f"pruned {result.pruned} snapshot(s) and "
+                f"{result.pruned_objects} object(s)",
+                flush=True,
+            )
+
+    def _print_backup_error(self, error: Exception) -> None:
+        """Print why a scheduled backup failed."""
+        print(f"backup failed, trying again next time: {error}", file=sys.stderr)
+
+    def track(self, paths: Sequence[str]) -> None:
+        """Track paths, telling which ones were tracked already."""
+        added = self.service.track(paths).values()
+        for path in dict.fromkeys(paths):
+            if path not in added:
+                print("path already tracked.")
+
+    def tracked(self) -> None:
+        """Print all tracked paths of the active stash."""
+        for key, path in self.service.tracked().items():
+            print(key, path)
@@ -0,0 +1,114 @@
+import os
+from typing import BinaryIO, Iterator
+
+
+from core.errors import CodecError
+
+
+# Supported codecs with their default level and level range.
+CODECS = {
+    "zlib": (6, range(0, 10)),
+    "lzma": (6, range(0, 10)),
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+# Extensions of formats that are compressed already.
+COMPRESSED_EXTENSIONS = set(
+    """
+    .7z .avif .br .bz2 .deb .flac .gif .gz .heic .jar .jpeg .jpg .lz4 .lzma
+    .m4a .mkv .mov .mp3 .mp4 .ogg .opus .png .rar .rpm .tbz2 .tgz .txz .webm
+    .webp .whl .woff .woff2 .xz .zip .zst
+    """.split()
+)
+
+# Leading bytes of formats that are compressed already.
+COMPRESSED_MAGIC = (
+    b"\x1f\x8b",  # gzip
+    b"BZh",  # bzip2
+    b"\xfd7zXZ\x00",  # xz
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"\x04\x22\x4d\x18",  # lz4
+    b"PK\x03\x04",  # zip and friends
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"Rar!",  # rar
+    b"\x89PNG",  # png
+    b"\xff\xd8\xff",  # jpeg
+    b"GIF8",  # gif
+    b"OggS",  # ogg
+    b"fLaC",  # flac
+    b"wOF2",  # woff2
+)
+
+
+def parse_codec(spec: str | None) -> tuple[str, int] | None:
+    """Parse a codec spec like "zlib" or "lzma:9", or "none" for no codec."""
+    if spec is None or spec == "none":
+        return None
+
+    name, _, level = spec.partition(":")
+    if name not in CODECS:
+        raise CodecError(
+            f"unknown codec: '{name}', use one of: none, {', '.join(CODECS)}."
+        )
+    default, levels = CODECS[name]
+    try:
+        level = int(level) if level else default
+    except ValueError:
+        level = None
+    if level not in levels:
+        raise CodecError(
+            f"level of codec '{name}' must be between {levels[0]} and {levels[-1]}."
+        )
+    return name, level
+
+
+def compressible(path: str) -> bool:
+    """Check if a file is worth compressing, judged by its name and magic."""
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    with open(path, "rb") as f:
+        head = f.read(8)
+    return not head.startswith(COMPRESSED_MAGIC)
+
+
+def compressor(name: str, level: int):
+    """Return a streaming compressor object of a codec."""
+    if name == "zlib":
+        import zlib
+
+        return zlib.compressobj(level)
+
+    import lzma
+
+    return lzma.LZMACompressor(preset=level)
+
+
+def decompressor(name: str):
+    """Return a streaming decompressor object of a codec."""
+    if name == "zlib":
+        import zlib
+
+        return zlib.decompressobj()
+
+    import lzma
+
+    return lzma.LZMADecompressor()
+
+
+def compress_stream(src: BinaryIO, dest: BinaryIO, name: str, level: int) -> int:
+    """Compress src into dest chunk by chunk and return the compressed size."""
+    pipe = compressor(name, level)
+    written = 0
+    while chunk := src.read(CHUNK_SIZE):
+        written += dest.write(pipe.compress(chunk))
+    return written + dest.write(pipe.flush())
+
+
+def decompress_chunks(chunks: Iterator[bytes], name: str) -> Iterator[bytes]:
+    """Decompress a stream of chunks compressed with a codec."""
+    pipe = decompressor(name)
+    for chunk in chunks:
+        yield pipe.decompress(chunk)
+    if name == "zlib":
+        yield pipe.flush()
@@ -0,0 +1,148 @@
+import os
+import fcntl
+import errno
+import shutil
+from typing import Callable, Iterable
+
+
+from core.errors import CopyError
+
+
+FICLONE = 0x40049409
+
+# Errors meaning a strategy is not available between two filesystems.
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+}
+_unsupported: set[tuple[str, int, int]] = set()
+
+
+def _reflink(src: int, dst: int, size: int) -> None:
+    """Share the extents of src with dst."""
+    fcntl.ioctl(dst, FICLONE, src)
+
+
+def _copy_file_range(src: int, dst: int, size: int) -> None:
+    """Copy src into dst inside the kernel with copy_file_range."""
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src, dst, size - copied)
+        if sent == 0:
+            break
+        copied += sent
+
+
+def _sendfile(src: int, dst: int, size: int) -> None:
+    """Copy src into dst inside the kernel with sendfile."""
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst, src, copied, size - copied)
+        if sent == 0:
+            break
+        copied += sent
+
+
+STRATEGIES = [
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _sendfile),
+]
+
+
+def copy_file(src: str, dst: str) -> str:
+    """Copy src to dst with the cheapest available strategy.
+
+    Tries a reflink first, then in-kernel copies, and falls back to a
+    buffered copy. Strategies that fail as unsupported are remembered per
+    pair of devices. Returns the name of the strategy that was used.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        src_dev = os.fstat(src_fd).st_dev
+        dst_dev = os.fstat(dst_fd).st_dev
+        size = os.fstat(src_fd).st_size
+
+        for name, strategy in STRATEGIES:
+            key = (name, src_dev, dst_dev)
+            if key in _unsupported:
+                continue
+            try:
+                strategy(src_fd, dst_fd, size)
+                return name
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                _unsupported.add(key)
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        return "buffered"
+
+
+def default_jobs() -> int:
+    """Return the default number of copy workers."""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class CopyEngine:
+    """Dispatches file operations to a bounded thread pool."""
+
+    def __init__(self, jobs: int | None = None) -> None:
+        self.jobs = jobs or default_jobs()
+
+    def map(self, func: Callable, items: Iterable) -> list:
+        """Apply func to every item and return the results in order.
+
+        Failures do not stop the remaining items; once everything has run
+        they are raised together as a CopyError, in the order of items.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+
+        if self.jobs <= 1 or len(items) <= 1:
+            for index, item in enumerate(items):
+                try:
+                    results[index] = func(item)
+                except Exception as e:
+                    errors.append((index, item, e))
+        else:
+            from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                running = {}
+                for index, item in enumerate(items):
+                    if len(running) >= self.jobs * 2:
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        self._collect(done, running, items, results, errors)
+                    running[pool.submit(func, item)] = index
+                done, _ = wait(running)
+                self._collect(done, running, items, results, errors)
+
+        if errors:
+            errors.sort(key=lambda error: error[0])
+            raise CopyError([(item, e) for _, item, e in errors])
+        return results
+
+    def _collect(
+        self,
+        done: set,
+        running: dict,
+        items: list,
+        results: list,
+        errors: list,
+    ) -> None:
+        """Move finished futures from running into results or errors."""
+        for future in done:
+            index = running.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                errors.append((index, items[index], e))
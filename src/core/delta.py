@@ -0,0 +1,98 @@
+import struct
+from typing import BinaryIO, Iterator
+
+
+# Files from this size on are stored as deltas against their previous
+# contents when that saves enough space.
+DELTA_MIN_SIZE = 1024 * 1024
+
+# Deltas copy whole aligned blocks of this size from their base.
+BLOCK_SIZE = 64 * 1024
+
+# A delta is only kept if it is at most this fraction of the file size.
+MAX_RATIO = 0.5
+
+MAGIC = b"SDELTA1\0"
+COPY = struct.Struct("<QQ")
+INSERT = struct.Struct("<Q")
+
+
+def _block_key(block: bytes) -> bytes:
+    """Return the key a block is matched by."""
+    import hashlib
+
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def write_delta(
+    src: BinaryIO, base_path: str, base_digest: str, dest: BinaryIO, limit: int
+) -> bool:
+    """Write a delta from a base file to the contents of src into dest.
+
+    Every aligned block of src that occurs as an aligned block anywhere
+    in the base becomes a copy, everything else is inserted literally, in
+    runs of at most 16 blocks so memory stays bounded. Returns False as
+    soon as the delta grows beyond limit bytes.
+    """
+    blocks = {}
+    with open(base_path, "rb") as base:
+        offset = 0
+        while block := base.read(BLOCK_SIZE):
+            blocks.setdefault(_block_key(block), offset)
+            offset += len(block)
+
+    written = dest.write(MAGIC + bytes.fromhex(base_digest))
+    copy_start, copy_length = 0, 0
+    inserts = []
+    while True:
+        block = src.read(BLOCK_SIZE)
+        start = blocks.get(_block_key(block)) if block else None
+        if copy_length and (not block or start != copy_start + copy_length):
+            written += dest.write(b"C" + COPY.pack(copy_start, copy_length))
+            copy_length = 0
+        if inserts and (not block or start is not None or len(inserts) >= 16):
+            data = b"".join(inserts)
+            written += dest.write(b"I" + INSERT.pack(len(data)) + data)
+            inserts = []
+        if written > limit:
+            return False
+        if not block:
+            return True
+
+        if start is None:
+            inserts.append(block)
+        elif copy_length:
+            copy_length += len(block)
+        else:
+            copy_start, copy_length = start, len(block)
+
+
+def delta_base(path: str) -> str:
+    """Return the digest of the base of a delta."""
+    with open(path, "rb") as f:
+        header = f.read(len(MAGIC) + 32)
+    return header[len(MAGIC) :].hex()
+
+
+def read_delta(path: str, base_path: str) -> Iterator[bytes]:
+    """Yield the contents a delta describes, in chunks."""
+    with open(path, "rb") as f, open(base_path, "rb") as base:
+        f.seek(len(MAGIC) + 32)
+        while op := f.read(1):
+            if op == b"C":
+                start, length = COPY.unpack(f.read(COPY.size))
+                base.seek(start)
+                yield from _read_exactly(base, length)
+            else:
+                (length,) = INSERT.unpack(f.read(INSERT.size))
+                yield from _read_exactly(f, length)
+
+
+def _read_exactly(f: BinaryIO, length: int) -> Iterator[bytes]:
+    """Yield length bytes of a file in chunks."""
+    while length > 0:
+        chunk = f.read(min(length, 1024 * 1024))
+        if not chunk:
+            raise EOFError("delta ends early.")
+        length -= len(chunk)
+        yield chunk
@@ -31,7 +31,59 @@ class StashNotFoundError(Exception):
     pass
 
 
+class NoActiveStashError(Exception):
+    """Raised when a command needs an active stash and there is none."""
+
+    pass
+
+
+class RevisionNotFoundError(Exception):
+    """Raised when a revision of a stash was not found."""
+
+    pass
+
+
 class NoEntrysError(Exception):
     """Raised when no path entries exist."""
 
     pass
+
+
+class WatchError(Exception):
+    """Raised when paths cannot be watched for changes."""
+
+    pass
+
+
+class BundleError(Exception):
+    """Raised when a bundle is invalid or cannot be used."""
+
+    pass
+
+
+class CodecError(Exception):
+    """Raised when a compression codec is unknown or misconfigured."""
+
+    pass
+
+
+class GcError(Exception):
+    """Raised when a garbage collection cannot run."""
+
+    pass
+
+
+class CopyError(Exception):
+    """Raised when one or more file copies failed."""
+
+    def __init__(self, failures: list[tuple[object, Exception]]) -> None:
+        self.failures = failures
+        lines = [f"{len(failures)} copy operation(s) failed:"]
+        lines += [f"  {item}: {error}" for item, error in failures]
+        super().__init__("\n".join(lines))
+
+
+class BackupError(Exception):
+    """Raised when a backup cannot be made, verified or restored."""
+
+    pass
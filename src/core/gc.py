@@ -0,0 +1,220 @@
+import os
+import time
+
+
+from core.errors import GcError
+from core.results import GcResult
+from core.utils import pid_alive
+
+
+# Queued objects marked per catalog transaction.
+BATCH_SIZE = 512
+
+# Seconds the cutoff is moved back, as file times come from a coarser
+# clock than time.time and can be a tick behind it.
+CLOCK_SLACK = 0.1
+
+
+class GarbageCollector:
+    """Removes objects that no stash needs anymore, with mark and sweep.
+
+    Marking starts from the manifests of all stashes and from the revisions
+    the retention rules keep, and follows trees, delta bases and chunks.
+    The sweep then removes every unmarked object created before the gc
+    started. All progress is kept in the catalog and written in small
+    transactions, so other commands are never held up for long and an
+    interrupted gc continues where it stopped when run again.
+    """
+
+    def __init__(self, service) -> None:
+        self.catalog = service.catalog
+        self.store = service.store
+        self.locks = service.locks
+
+    def run(
+        self,
+        keep_last: int | None = None,
+        keep_daily: int | None = None,
+        max_size: int | None = None,
+        dry_run: bool = False,
+    ) -> GcResult:
+        """Run a gc, or resume the interrupted one."""
+        state = self.catalog.gc_state()
+        if state and state["pid"] != os.getpid() and pid_alive(state["pid"]):
+            raise GcError(f"gc is already running as process {state['pid']}.")
+        if state and not state["dry_run"] and dry_run:
+            raise GcError("an interrupted gc has to finish first, run it again.")
+        if state and state["dry_run"] and not dry_run:
+            state = None
+
+        resumed = None
+        if state:
+            resumed = state["started"]
+            self.catalog.gc_update(pid=os.getpid())
+        else:
+            self._begin(keep_last, keep_daily, max_size, dry_run)
+            state = self.catalog.gc_state()
+
+        if state["phase"] == "mark":
+            self._mark(state["max_size"])
+            if not state["dry_run"]:
+                self.catalog.gc_prune()
+            self.catalog.gc_update(phase="sweep")
+        removed, removed_bytes = self._sweep()
+
+        pruned = len(self.catalog.gc_dropped())
+        self.catalog.gc_finish()
+        return GcResult(pruned, removed, removed_bytes, dry_run, resumed)
+
+    def _begin(
+        self,
+        keep_last: int | None,
+        keep_daily: int | None,
+        max_size: int | None,
+        dry_run: bool,
+    ) -> None:
+        """Pick the roots to keep and record them for a new gc.
+
+        The manifests and the latest revision of every stash are always
+        kept, they come first. Older revisions follow newest first, unless
+        the retention rules drop them: with keep_last, the newest that many
+        revisions of a stash are kept, with keep_daily, the newest revision
+        of each of the last that many days. Without either, all are kept.
+        """
+        import datetime
+
+        today = datetime.date.today()
+        recent_days = {
+            today - datetime.timedelta(days=days) for days in range(keep_daily or 0)
+        }
+        stashes = {}
+        for stash_id, rev, tree, created in self.catalog.all_revisions():
+            stashes.setdefault(stash_id, []).append((rev, tree, created))
+
+        roots = [
+            (self.catalog.stash_id(name), None, None, False)
+            for name in self.catalog.names()
+        ]
+        older = []
+        dropped = []
+        for stash_id, revisions in stashes.items():
+            revisions.sort(reverse=True)
+            days = set()
+            for i, (rev, tree, created) in enumerate(revisions):
+                day = datetime.date.fromtimestamp(created)
+                if i == 0:
+                    roots.append((stash_id, rev, tree, True))
+                elif (
+                    (keep_last is None and keep_daily is None)
+                    or (keep_last is not None and i < keep_last)
+                    or (day in recent_days and day not in days)
+                ):
+                    older.append((created, stash_id, rev, tree))
+                else:
+                    dropped.append((stash_id, rev))
+                days.add(day)
+        older.sort(reverse=True)
+        roots += [(stash_id, rev, tree, False) for _, stash_id, rev, tree in older]
+
+        # Objects of operations that were still running when the gc started
+        # may not be in the catalog yet, they are protected by the cutoff.
+        now = time.time()
+        cutoff = min(now, self.catalog.oldest_operation() or now) - CLOCK_SLACK
+        self.catalog.gc_begin(cutoff, dry_run, max_size, roots, dropped)
+
+    def _mark(self, max_size: int | None) -> None:
+        """Mark everything the roots refer to, one root after another.
+
+        With max_size, older revisions are dropped from the first one on
+        that would start while the marked objects take max_size already.
+        """
+        while root := self.catalog.gc_next_root():
+            position, stash_id, rev, tree, latest = root
+            if rev is not None and not latest and max_size is not None:
+                if self.catalog.gc_state()["marked_bytes"] >= max_size:
+                    self.catalog.gc_drop_roots(position)
+                    break
+            self.catalog.gc_start_root(position, stash_id, tree)
+            self._drain()
+
+    def _drain(self) -> None:
+        """Mark all queued objects along with everything they refer to."""
+        while queued := self.catalog.gc_queued(BATCH_SIZE):
+            done = [(digest, tree) for digest, tree, _ in queued]
+            marked = self.catalog.gc_marked(done)
+            marks = []
+            children = []
+            size = 0
+            for digest, tree, codec in queued:
+                if (digest, tree) in marked:
+                    continue
+                marks.append((digest, tree))
+                try:
+                    size += os.path.getsize(self.store.path(digest, codec))
+                    if tree:
+                        children += self._tree_children(digest)
+                    else:
+                        parts = self.store.parts(digest, codec)[1:]
+                        children += [(part, False, stored) for part, stored in parts]
+                except FileNotFoundError:
+                    continue
+            self.catalog.gc_mark(done, marks, children, size)
+
+    def _tree_children(self, digest: str) -> list[tuple[str, bool, str | None]]:
+        """Return the objects a tree object refers to."""
+        import json
+
+        children = []
+        for _, kind, child, _, _, _, codec in json.loads(
+            b"".join(self.store.read(digest))
+        ):
+            if kind == "file":
+                children.append((child, False, codec))
+            elif kind == "dir":
+                children.append((child, True, None))
+        return children
+
+    def _sweep(self) -> tuple[int, int]:
+        """Remove unmarked objects, one prefix directory at a time.
+
+        Anything the catalog started to refer to since the gc started is
+        marked first, and objects touched since are kept, which is how
+        writers keep the stored objects they reuse. Returns the number and
+        size of removed objects.
+        """
+        state = self.catalog.gc_state()
+        self.catalog.gc_catch_up(state["started"])
+        self._drain()
+
+        removed = state["removed"]
+        removed_bytes = state["removed_bytes"]
+        if not self.store.root.exists():
+            return removed, removed_bytes
+
+        prefixes = sorted(
+            name
+            for name in os.listdir(self.store.root)
+            if len(name) == 2 and name > state["cursor"]
+        )
+        for prefix in prefixes:
+            # Writers touch the objects they reuse under the catalog lock, so
+            # holding it makes their check and this sweep exclude each other.
+            with self.locks.catalog():
+                marked = self.catalog.gc_marked_digests(prefix)
+                with os.scandir(self.store.root / prefix) as it:
+                    for entry in it:
+                        if entry.name.startswith("."):
+                            continue
+                        if prefix + entry.name.partition(".")[0] in marked:
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                        if max(st.st_ctime, st.st_mtime) >= state["cutoff"]:
+                            continue
+                        if not state["dry_run"]:
+                            os.unlink(entry.path)
+                        removed += 1
+                        removed_bytes += st.st_size
+                self.catalog.gc_update(
+                    cursor=prefix, removed=removed, removed_bytes=removed_bytes
+                )
+        return removed, removed_bytes
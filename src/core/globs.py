@@ -0,0 +1,86 @@
+import re
+from typing import Iterable
+
+
+# Characters that start a wildcard in an fnmatch pattern.
+WILDCARDS = re.compile(r"[*?\[]")
+
+
+def literal_prefix(pattern: str) -> str:
+    """Return the part of a pattern before its first wildcard.
+
+    Every relpath the pattern matches, and everything below such a
+    relpath, starts with it.
+    """
+    match = WILDCARDS.search(pattern)
+    return pattern[: match.start()] if match else pattern
+
+
+class GlobFilter:
+    """Selects manifest entries by fnmatch patterns on their relpaths.
+
+    An entry is selected when it or a directory above it matches one of
+    the only patterns, or when there are none, and neither it nor a
+    directory above it matches one of the exclude patterns. A "*" also
+    matches slashes, so "*.bak" excludes backups at any depth.
+    """
+
+    def __init__(self, only: Iterable[str] = (), exclude: Iterable[str] = ()) -> None:
+        self.only = list(only)
+        self.exclude = list(exclude)
+        self._only = self._compile(self.only)
+        self._exclude = self._compile(self.exclude)
+        self._dirs = {}
+
+    @staticmethod
+    def _compile(patterns: list[str]):
+        """Compile patterns into a single match function."""
+        if not patterns:
+            return None
+        import fnmatch
+
+        return re.compile("|".join(fnmatch.translate(p) for p in patterns)).match
+
+    def prefixes(self) -> list[str] | None:
+        """Return the literal prefixes covering all selectable relpaths.
+
+        Prefixes covered by a shorter one are left out. None means the
+        whole manifest has to be looked at.
+        """
+        if not self.only:
+            return None
+        prefixes = []
+        for prefix in sorted({literal_prefix(p) for p in self.only}):
+            if not prefix:
+                return None
+            if not prefixes or not prefix.startswith(prefixes[-1]):
+                prefixes.append(prefix)
+        return prefixes
+
+    def _verdict(self, relpath: str) -> tuple[bool, bool]:
+        """Return if a relpath or a directory above it is included, excluded."""
+        verdict = self._dirs.get(relpath)
+        if verdict is None:
+            parent = relpath.rpartition("/")[0]
+            included, excluded = self._verdict(parent) if parent else (False, False)
+            included = included or bool(self._only and self._only(relpath))
+            excluded = excluded or bool(self._exclude and self._exclude(relpath))
+            verdict = self._dirs[relpath] = (included, excluded)
+        return verdict
+
+    def selected(self, relpath: str) -> bool:
+        """Check if a manifest entry is selected."""
+        parent = relpath.rpartition("/")[0]
+        included, excluded = self._verdict(parent) if parent else (False, False)
+        if excluded or (self._exclude and self._exclude(relpath)):
+            return False
+        return not self._only or included or bool(self._only(relpath))
+
+    def filter(self, files: dict[str, dict]) -> dict[str, dict]:
+        """Return the selected entries of a manifest."""
+        return {
+            relpath: entry
+            for relpath, entry in files.items()
+            if self.selected(relpath)
+        }
+
@@ -0,0 +1,162 @@
+import os
+import re
+from typing import Iterable
+
+
+# Name of the files holding ignore patterns, in the data directory for
+# all tracked paths and at the top of a tracked directory for that one.
+IGNORE_FILE = ".stasherignore"
+
+
+def read_patterns(path: str) -> list[str]:
+    """Return the patterns of an ignore file, or none if it does not exist."""
+    try:
+        with open(path, "r") as f:
+            return f.read().splitlines()
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def translate(pattern: str) -> str:
+    """Translate a gitignore-style pattern into a regular expression.
+
+    The expression matches relpaths below a tracked directory, with a
+    trailing slash for directories. Patterns containing a slash other than
+    a trailing one are anchored to the tracked directory, others match at
+    any depth. A trailing slash only matches directories.
+    """
+    directory = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            parts.append("/.*")
+            i += 3
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            body = pattern[i + 1 : end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+
+    regex = "".join(parts)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return regex + ("/" if directory else "/?")
+
+
+class IgnoreRules:
+    """Gitignore-style patterns compiled into a single regular expression.
+
+    Every pattern becomes one alternative of the expression, the last
+    pattern first, so the alternative that matches belongs to the last
+    pattern matching a path, which decides like in gitignore. Patterns
+    starting with "!" include paths again. An ignored directory is pruned
+    as a whole, nothing below it can be included again.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self._dirs = {}
+        alternatives = []
+        for index, line in reversed(list(enumerate(patterns))):
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            kind = "i"
+            if line.startswith("!"):
+                kind = "n"
+                line = line[1:]
+            alternatives.append(f"(?P<{kind}{index}>{translate(line)})")
+        self._match = (
+            re.compile("|".join(alternatives)).fullmatch if alternatives else None
+        )
+
+    def __bool__(self) -> bool:
+        return self._match is not None
+
+    def ignored(self, relpath: str, is_dir: bool = False) -> bool:
+        """Check if a relpath below a tracked path is ignored by itself."""
+        match = self._match(f"{relpath}/" if is_dir else relpath)
+        return match is not None and match.lastgroup[0] == "i"
+
+    def pruned(self, relpath: str, is_dir: bool = False) -> bool:
+        """Check if a relpath or any directory above it is ignored.
+
+        The verdicts of directories are remembered, so checking a whole
+        manifest costs about one match per entry.
+        """
+        parent = relpath.rpartition("/")[0]
+        if parent and self._dir_pruned(parent):
+            return True
+        return self.ignored(relpath, is_dir)
+
+    def _dir_pruned(self, dirpath: str) -> bool:
+        """Check if a directory or any directory above it is ignored."""
+        pruned = self._dirs.get(dirpath)
+        if pruned is None:
+            parent = dirpath.rpartition("/")[0]
+            pruned = bool(parent) and self._dir_pruned(parent)
+            pruned = pruned or self.ignored(dirpath, True)
+            self._dirs[dirpath] = pruned
+        return pruned
+
+
+def build_rules(
+    global_patterns: list[str], patterns: dict[str, list[str]]
+) -> dict[str, IgnoreRules]:
+    """Return the rules of every key that has any, given its own patterns.
+
+    The global patterns come first, the ones of a tracked directory after
+    them, so they can override the global ones.
+    """
+    rules = {}
+    for key, own in patterns.items():
+        ignore = IgnoreRules(global_patterns + own)
+        if ignore:
+            rules[key] = ignore
+    return rules
+
+
+def load_rules(global_file: str, tracked: dict[str, str]) -> dict[str, IgnoreRules]:
+    """Return the rules of every tracked path that has any, by key."""
+    return build_rules(
+        read_patterns(global_file),
+        {
+            key: read_patterns(os.path.join(path, IGNORE_FILE))
+            for key, path in tracked.items()
+        },
+    )
+
+
+def filter_files(
+    files: dict[str, dict], rules: dict[str, IgnoreRules]
+) -> dict[str, dict]:
+    """Return the manifest entries that the rules do not ignore."""
+    if not rules:
+        return files
+    kept = {}
+    for relpath, entry in files.items():
+        key, _, rest = relpath.partition("/")
+        if rest and key in rules and rules[key].pruned(rest, entry["type"] == "dir"):
+            continue
+        kept[relpath] = entry
+    return kept
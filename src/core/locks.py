@@ -0,0 +1,116 @@
+import os
+import time
+import fcntl
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterator
+
+
+from core.timings import Timings
+
+
+class Locks:
+    """Advisory file locks that let processes share the data directory.
+
+    Every stash has a lock file that readers hold shared and writers hold
+    exclusively, so different stashes are changed independently. Changes
+    to the catalog itself, like creating a stash or switching the active
+    one, take the global lock for just as long as the change takes. A
+    stash lock is always taken before the global lock, never after it.
+
+    The locks are flocks on descriptors of their own, so threads exclude
+    each other like processes do, while a thread taking a lock it holds
+    already just goes on. Time spent waiting is recorded as "lock wait".
+    Lock files of deleted stashes are removed while they are held, so a
+    lock only counts once its file is still the one at its path.
+    """
+
+    def __init__(self, root: Path, timings: Timings | None = None) -> None:
+        self.root = root
+        self.timings = timings or Timings()
+        self._local = threading.local()
+
+    def _acquire(self, fd: int, operation: int) -> None:
+        """Lock a descriptor, recording the wait if the lock is taken."""
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            start = time.perf_counter()
+            fcntl.flock(fd, operation)
+            self.timings.record("lock wait", time.perf_counter() - start)
+
+    @staticmethod
+    def _current(fd: int, path: Path) -> bool:
+        """Check if a descriptor still refers to the file at path."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        locked = os.fstat(fd)
+        return (st.st_dev, st.st_ino) == (locked.st_dev, locked.st_ino)
+
+    @contextmanager
+    def _lock(self, path: Path, exclusive: bool) -> Iterator[None]:
+        """Hold the lock of a lock file, shared or exclusively."""
+        held = getattr(self._local, "held", None)
+        if held is None:
+            held = self._local.held = {}
+
+        if path in held:
+            fd, holds_exclusive = held[path]
+            if holds_exclusive or not exclusive:
+                yield
+                return
+
+            self._acquire(fd, fcntl.LOCK_EX)
+            held[path] = (fd, True)
+            try:
+                yield
+            finally:
+                held[path] = (fd, False)
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+            try:
+                self._acquire(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except BaseException:
+                os.close(fd)
+                raise
+            if self._current(fd, path):
+                break
+            os.close(fd)
+        try:
+            held[path] = (fd, exclusive)
+            try:
+                yield
+            finally:
+                del held[path]
+        finally:
+            # Closing the last descriptor of a lock file releases its lock.
+            os.close(fd)
+
+    @contextmanager
+    def stash(self, name: str, exclusive: bool = False) -> Iterator[None]:
+        """Hold the lock of a stash, shared for reading or exclusively."""
+        with self._lock(self.root / "stashes" / f"{name}.lock", exclusive):
+            yield
+
+    @contextmanager
+    def catalog(self) -> Iterator[None]:
+        """Hold the global lock while changing the catalog."""
+        with self._lock(self.root / "catalog.lock", True):
+            yield
+
+    def remove_stash(self, name: str) -> None:
+        """Remove the lock file of a deleted stash, which has to be held.
+
+        Anyone waiting for the lock takes the lock of a new file instead.
+        """
+        try:
+            os.unlink(self.root / "stashes" / f"{name}.lock")
+        except FileNotFoundError:
+            pass
@@ -1,6 +1,9 @@
 import argparse
 
 
+from core.utils import parse_size
+
+
 class Parser:
     """The main argument parsing handler for Stasher."""
 
@@ -8,8 +11,195 @@ class Parser:
         self.parser = argparse.ArgumentParser(
             description="A simple snapshot manager for Linux."
         )
+        self.parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of parallel copy workers.",
+        )
+        self.parser.add_argument(
+            "--timings",
+            action="store_true",
+            help="Print a table of per-phase timings to stderr.",
+        )
+        self.parser.add_argument(
+            "--trace",
+            action="store_true",
+            help="Stream timing events and totals to stderr as JSON lines.",
+        )
+        self.parser.add_argument(
+            "--profile",
+            metavar="FILE",
+            help="Write a cProfile dump of the command to FILE.",
+        )
         self.subparsers = self.parser.add_subparsers(dest="command")
         self.parsers = self._create_parsers()
+        self.parsers["tree"].add_argument(
+            "--depth",
+            type=int,
+            help="Only show entries up to this depth, 0 shows just the root.",
+        )
+        self.parsers["tree"].add_argument(
+            "--max-entries",
+            type=int,
+            help="Only show this many entries per directory.",
+        )
+        self.parsers["track"].add_argument("paths", nargs="+", metavar="path")
+        self.parsers["untrack"].add_argument(
+            "paths_or_keys", nargs="+", metavar="path_or_key"
+        )
+        self.parsers["status"].add_argument(
+            "--changes",
+            action="store_true",
+            help="Also list changes not pushed to the active stash yet.",
+        )
+        self.parsers["diff"].add_argument(
+            "name", nargs="?", help="The stash to compare, the active one by default."
+        )
+        self.parsers["diff"].add_argument(
+            "-p",
+            "--patch",
+            action="store_true",
+            help="Show unified diffs of changed text files.",
+        )
+        self.parsers["push"].add_argument(
+            "--codec",
+            metavar="CODEC[:LEVEL]",
+            help="Compress new contents of the stash with zlib or lzma from now "
+            "on, or stop with none.",
+        )
+        self.parsers["push"].add_argument(
+            "--chunked",
+            action=argparse.BooleanOptionalAction,
+            help="Store large files of the stash in content-defined chunks from "
+            "now on, so similar files share their unchanged parts.",
+        )
+        self.parsers["watch"].add_argument(
+            "--debounce",
+            type=float,
+            default=1.0,
+            metavar="SECONDS",
+            help="Push once no change came in for this long (default: 1).",
+        )
+        self.parsers["watch"].add_argument(
+            "--rescan",
+            type=float,
+            default=300.0,
+            metavar="SECONDS",
+            help="Interval of full pushes when the inotify watch limit is hit "
+            "(default: 300).",
+        )
+        self.parsers["export"].add_argument(
+            "--compress",
+            action="store_true",
+            help="Compress the file contents in the bundle.",
+        )
+        self.parsers["import"].add_argument(
+            "name", nargs="?", help="Name of the new stash, the bundled one by default."
+        )
+        self.parsers["backup"].add_argument(
+            "--every",
+            type=float,
+            metavar="SECONDS",
+            help="Keep running and back up this often.",
+        )
+        self.parsers["backup"].add_argument(
+            "--keep",
+            type=int,
+            metavar="N",
+            help="Keep only the newest N snapshots in the backup.",
+        )
+        self.parsers["backup"].add_argument(
+            "--list",
+            action="store_true",
+            dest="list_snapshots",
+            help="List the snapshots in the backup instead.",
+        )
+        self.parsers["backup"].add_argument(
+            "--verify",
+            action="store_true",
+            help="Check the backup against its checksums instead.",
+        )
+        self.parsers["backup"].add_argument(
+            "--restore",
+            action="store_true",
+            help="Restore all stashes from the backup instead.",
+        )
+        self.parsers["backup"].add_argument(
+            "--snapshot",
+            type=int,
+            metavar="ID",
+            help="The snapshot to restore, the latest by default.",
+        )
+        self.parsers["restore"].add_argument(
+            "--rev", type=int, help="Restore this revision instead of the latest."
+        )
+        self.parsers["restore"].add_argument(
+            "--only",
+            action="append",
+            default=[],
+            metavar="GLOB",
+            help="Restore only paths matching GLOB, like 'waybar/**'. Can be "
+            "given more than once.",
+        )
+        self.parsers["restore"].add_argument(
+            "--exclude",
+            action="append",
+            default=[],
+            metavar="GLOB",
+            help="Leave out paths matching GLOB, like '*.bak'. Can be given more "
+            "than once.",
+        )
+        self.parsers["log"].add_argument(
+            "name", nargs="?", help="The stash to list, the active one by default."
+        )
+        self.parsers["list"].add_argument(
+            "-l",
+            "--long",
+            action="store_true",
+            help="Also show the number of files and the size of every stash.",
+        )
+        self.parsers["du"].add_argument(
+            "name", nargs="?", help="Show the tracked paths of this stash."
+        )
+        self.parsers["du"].add_argument(
+            "--verify",
+            action="store_true",
+            help="Recompute the cached sizes from the manifests first.",
+        )
+        self.parsers["stats"].add_argument(
+            "name", nargs="?", help="The stash to show, all of them by default."
+        )
+        self.parsers["gc"].add_argument(
+            "--keep-last",
+            type=int,
+            metavar="N",
+            help="Keep the newest N revisions of every stash.",
+        )
+        self.parsers["gc"].add_argument(
+            "--keep-daily",
+            type=int,
+            metavar="DAYS",
+            help="Keep the newest revision of each of the last DAYS days.",
+        )
+        self.parsers["gc"].add_argument(
+            "--max-size",
+            type=parse_size,
+            metavar="SIZE",
+            help="Drop the oldest revisions once the kept ones take SIZE, like "
+            "500M or 2G.",
+        )
+        self.parsers["gc"].add_argument(
+            "-n",
+            "--dry-run",
+            action="store_true",
+            help="Only show what would be pruned and how much space it frees.",
+        )
+        self.parsers["apply"].add_argument(
+            "--link",
+            action="store_true",
+            help="Symlink tracked paths into the stash instead of copying.",
+        )
 
     def _create_parsers(self) -> dict[str, argparse.ArgumentParser]:
         return {
@@ -17,19 +207,58 @@ class Parser:
             "delete": self._create_parser("delete", "Delete a stash.", "name"),
             "list": self._create_parser("list", "List all created stashes."),
             "activate": self._create_parser("activate", "Activate a stash.", "name"),
+            "apply": self._create_parser(
+                "apply", "Restore the contents of a stash and activate it.", "name"
+            ),
+            "checkout": self._create_parser(
+                "checkout",
+                "Restore a revision of a stash, given as name@rev, and activate it.",
+                "spec",
+            ),
+            "restore": self._create_parser(
+                "restore", "Restore a stash without activating it.", "name"
+            ),
+            "log": self._create_parser("log", "List the revisions of a stash."),
+            "stats": self._create_parser(
+                "stats", "Show how well stashes are deduplicated in the store."
+            ),
+            "du": self._create_parser(
+                "du", "Show how much space stashes take, from cached sizes."
+            ),
+            "gc": self._create_parser(
+                "gc", "Remove stored contents no stash needs anymore."
+            ),
             "clear": self._create_parser(
                 "clear", "Go out of the current active stash."
             ),
             "push": self._create_parser(
                 "push", "Push changes to the current active stash."
             ),
-            "track": self._create_parser("track", "Track a path.", "path"),
-            "untrack": self._create_parser("untrack", "Untrack a path.", "path_or_key"),
+            "watch": self._create_parser(
+                "watch", "Push changes to the active stash as they happen."
+            ),
+            "track": self._create_parser("track", "Track paths."),
+            "untrack": self._create_parser("untrack", "Untrack paths."),
             "tracked": self._create_parser(
                 "tracked", "List all tracked paths in the current active stash."
             ),
             "status": self._create_parser("status", "Show current active stash."),
             "tree": self._create_parser("tree", "Print the tree of a stash.", "name"),
+            "diff": self._create_parser(
+                "diff", "Show changes between the tracked paths and a stash."
+            ),
+            "cat": self._create_parser(
+                "cat", "Print a file of a stash or bundle.", "name", "relpath"
+            ),
+            "export": self._create_parser(
+                "export", "Write a stash to a bundle file.", "name", "path"
+            ),
+            "import": self._create_parser(
+                "import", "Create a stash from a bundle file.", "path"
+            ),
+            "backup": self._create_parser(
+                "backup", "Back up all stashes to a directory, incrementally.", "target"
+            ),
         }
 
     def _create_parser(
@@ -0,0 +1,167 @@
+"""Results returned by the service, for the cli and other frontends.
+
+They are named tuples rather than dataclasses, which keeps importing
+them cheap enough for the commands that have to start fast.
+"""
+
+from typing import NamedTuple
+
+
+class StashInfo(NamedTuple):
+    """A stash and whether it is the active one."""
+
+    name: str
+    active: bool = False
+
+
+class Revision(NamedTuple):
+    """A recorded revision of a stash."""
+
+    rev: int
+    created: float
+    changes: int
+
+
+class RestoreResult(NamedTuple):
+    """What restoring a stash, revision or bundle did.
+
+    In link mode only linked is set, to the number of paths that were
+    pointed at the stash. A restore from a bundle file sets bundle to it.
+    Removed counts the live entries deleted because the stash lacks them.
+    """
+
+    strategies: dict[str, int]
+    unchanged: int = 0
+    removed: int = 0
+    linked: int | None = None
+    bundle: str | None = None
+
+    @property
+    def restored(self) -> int:
+        """Return the number of files that were copied."""
+        return sum(self.strategies.values())
+
+
+class StashStats(NamedTuple):
+    """How well the files of a stash are deduplicated in the store.
+
+    The name is None for the total over all stashes.
+    """
+
+    name: str | None
+    files: int
+    size: int
+    stored: int
+
+    @property
+    def ratio(self) -> float | None:
+        """Return how many times smaller the stored size is, if known."""
+        return self.size / self.stored if self.stored else None
+
+
+class Usage(NamedTuple):
+    """The cached file count and size of a stash or one of its tracked paths.
+
+    key and path are None for a stash as a whole, which also carries the
+    size of the contents it refers to, each counted once, and how much of
+    that other stashes refer to as well. Both are logical sizes, as the
+    files had them, the objects in the store may be smaller. Both are None
+    for tracked paths.
+    """
+
+    name: str
+    key: str | None
+    path: str | None
+    files: int
+    size: int
+    unique: int | None = None
+    shared: int | None = None
+
+
+class TreeNode(NamedTuple):
+    """An entry of a stash tree, in the order it is printed.
+
+    The root has depth 0 and an empty relpath. Directories carry the
+    number and size of the files below them, files their own size. A node
+    of kind "more" stands for the children left out of a directory by
+    max_entries.
+    """
+
+    relpath: str
+    kind: str
+    depth: int
+    last: bool
+    target: str | None = None
+    files: int | None = None
+    size: int | None = None
+
+
+class Change(NamedTuple):
+    """A difference between the tracked paths and a stash.
+
+    With a patch requested, patch holds the unified diff lines of a text
+    file, and binary is set for files that are not text.
+    """
+
+    status: str
+    relpath: str
+    patch: list[str] | None = None
+    binary: bool = False
+
+
+class BundleResult(NamedTuple):
+    """A bundle written from or read into a stash."""
+
+    name: str
+    path: str
+    entries: int
+    size: int
+
+
+class GcResult(NamedTuple):
+    """What a gc pruned and removed, or would in a dry run.
+
+    resumed is when the interrupted gc it finished was started.
+    """
+
+    pruned: int
+    removed: int
+    removed_bytes: int
+    dry_run: bool = False
+    resumed: float | None = None
+
+
+class Snapshot(NamedTuple):
+    """A catalog snapshot in a backup and the store it was taken with."""
+
+    id: int
+    created: float
+    objects: int
+    size: int
+
+
+class BackupResult(NamedTuple):
+    """What a backup, or a restore from one, copied.
+
+    snapshot is the one written or restored. A backup that pruned old
+    snapshots also counts them and the objects removed with them. If
+    nothing changed since the latest snapshot, unchanged is set and
+    snapshot is that one.
+    """
+
+    snapshot: int
+    created: float
+    objects: int
+    size: int
+    pruned: int = 0
+    pruned_objects: int = 0
+    unchanged: bool = False
+
+
+class ProgressEvent(NamedTuple):
+    """A measurement recorded while an operation runs."""
+
+    phase: str
+    seconds: float
+    files: int
+    bytes: int
@@ -1,35 +1,78 @@
 import os
-import sys
-import json
+import stat
+import time
 import shutil
+from typing import Callable, Iterable, Iterator, Sequence
+from functools import partial
+from collections import Counter
+from contextlib import contextmanager
 from pathlib import Path
 
 
-import platformdirs
-from rich.tree import Tree
-from rich import print as rprint
-
-
+from core.store import ObjectStore
+from core.bundle import Bundle
+from core.locks import Locks
+from core.globs import GlobFilter
+from core.ignore import (
+    IGNORE_FILE,
+    IgnoreRules,
+    build_rules,
+    filter_files,
+    load_rules,
+    read_patterns,
+)
+from core.timings import Timings
+from core.catalog import Catalog, ancestors
+from core.compression import parse_codec
+from core.copier import CopyEngine, copy_file
+from core.utils import pid_alive, user_data_dir
 from core.errors import (
+    BundleError,
     DirectoryNameError,
-    StashNotFoundError,
+    GcError,
+    NoActiveStashError,
     StashExistsError,
+    StashNotFoundError,
+)
+from core.results import (
+    BackupResult,
+    BundleResult,
+    Change,
+    GcResult,
+    RestoreResult,
+    Revision,
+    Snapshot,
+    StashInfo,
+    StashStats,
+    TreeNode,
+    Usage,
 )
 
 
-def no_active_stash() -> None:
-    print("No current active stash.")
-    print("Activate one by doing: stasher activate <name>")
+def read_lines(chunks: Iterable[bytes]) -> list[str] | None:
+    """Read text contents as lines, or return None if they are binary."""
+    content = b"".join(chunks)
+    if b"\0" in content[:8192]:
+        return None
+    try:
+        return content.decode().splitlines(keepends=True)
+    except UnicodeDecodeError:
+        return None
 
 
 class Service:
     """The main service for Stasher."""
 
-    def __init__(self):
-        self.user_data_dir = Path(platformdirs.user_data_dir())
-        self.root_dir = self.user_data_dir / "stasher"
+    def __init__(self, root_dir: Path | None = None) -> None:
+        self.root_dir = root_dir or user_data_dir() / "stasher"
         self.active_file = self.root_dir / "active.txt"
         self.stashes_dir = self.root_dir / "stashes"
+        self.staging_dir = self.root_dir / "staging"
+        self.catalog = Catalog(self.root_dir / "catalog.db")
+        self.timings = Timings()
+        self.store = ObjectStore(self.root_dir / "objects", self.timings)
+        self.locks = Locks(self.root_dir / "locks", self.timings)
+        self.engine = CopyEngine()
 
     def _validate_name(self, name: str) -> None:
         """Validate a name to be used for a stash."""
@@ -54,198 +97,1387 @@ class Service:
             raise FileNotFoundError(f"path: '{path}' was not found.")
 
     def _get_stash(self, name: str) -> Path:
-        """Check if a stash exists and return it."""
-        path = self.stashes_dir / name
-        if not path.exists() or path.parent.name != "stashes":
+        """Check if a stash exists and return its directory."""
+        if not self.catalog.exists(name):
             raise StashNotFoundError(f"stash with name: '{name}' was not found.")
-        else:
-            return path
+        return self.stashes_dir / name
+
+    def _open_bundle(self, name: str) -> Bundle | None:
+        """Open name as a bundle if it is a bundle file and not a stash."""
+        if self.catalog.exists(name) or not os.path.isfile(name):
+            return None
+        return Bundle(name)
+
+    def _ignore_rules(self, tracked: dict[str, str]) -> dict[str, IgnoreRules]:
+        """Return the ignore rules of the tracked paths that have any, by key."""
+        return load_rules(str(self.root_dir / IGNORE_FILE), tracked)
+
+    def _stored_rules(
+        self,
+        keys: Iterable[str],
+        get_entry: Callable[[str], dict | None],
+        read: Callable[[dict], Iterator[bytes]],
+    ) -> dict[str, IgnoreRules]:
+        """Return the ignore rules a stash or bundle holds, by key.
+
+        The patterns of a tracked directory come from the ignore file
+        stored along with it rather than the live one, so listing stored
+        contents does not depend on what is checked out.
+        """
+        patterns = {}
+        for key in keys:
+            entry = get_entry(f"{key}/{IGNORE_FILE}")
+            patterns[key] = []
+            if entry and entry["type"] == "file":
+                text = b"".join(read(entry)).decode(errors="replace")
+                patterns[key] = text.splitlines()
+        global_patterns = read_patterns(str(self.root_dir / IGNORE_FILE))
+        return build_rules(global_patterns, patterns)
+
+    def _read_stored(self, entry: dict) -> Iterator[bytes]:
+        """Yield the contents of a stored file entry."""
+        return self.store.read(entry["hash"], entry["codec"])
 
     def _get_stash_data(self, name: str) -> dict:
-        """Get the data of a stash."""
-        path = self._get_stash(name)
-        data = path / ".stash.json"
-        if data.exists():
-            with open(data, "r") as f:
-                return json.load(f)
-        else:
-            raise FileNotFoundError(
-                f"'.stash.json' could not be found in path: '{path}'."
+        """Get the tracked paths and manifest of a stash."""
+        return {"tracked": self.catalog.tracked(name), "files": self.catalog.files(name)}
+
+    def migrate(self) -> None:
+        """Move stashes kept in .stash.json files and active.txt into the catalog.
+
+        Stashes that still hold plain copies of their tracked paths are
+        stored in the object store on the way.
+        """
+        if not self.active_file.exists():
+            return
+
+        import json
+
+        with self.locks.catalog():
+            # Another process may have migrated while this one waited.
+            if not self.active_file.exists():
+                return
+
+            for path in sorted(self.stashes_dir.iterdir()):
+                data_file = path / ".stash.json"
+                if not data_file.exists():
+                    continue
+
+                with open(data_file, "r") as f:
+                    data = json.load(f)
+                legacy = "files" not in data
+                if legacy:
+                    data["files"] = {}
+                    with self._staged("migrate", path.name) as staging:
+                        for key in data["tracked"]:
+                            copy = path / key
+                            if copy.exists() or copy.is_symlink():
+                                data["files"].update(self._scan(key, str(copy)))
+                        self._store_pending(data["files"], staging)
+                        self._commit_staged(staging)
+                    for entry in data["files"].values():
+                        entry.pop("mtime_ns", None)
+                        entry.pop("inode", None)
+
+                if not self.catalog.exists(path.name):
+                    self.catalog.create(path.name)
+                self.catalog.track(path.name, data["tracked"])
+                self.catalog.update_files(path.name, data["files"])
+
+                data_file.unlink()
+                if legacy:
+                    for key in data["tracked"]:
+                        self._clear_path(str(path / key))
+                        if os.path.lexists(path / key):
+                            os.unlink(path / key)
+                if not any(path.iterdir()):
+                    path.rmdir()
+
+            with open(self.active_file, "r") as f:
+                name = f.read().strip()
+            if name and self.catalog.exists(name):
+                self.catalog.set_active(name)
+            self.active_file.unlink()
+
+    def _entry(self, path: str, st: os.stat_result, previous: dict | None) -> dict:
+        """Return the manifest entry of a single path.
+
+        Files whose size, mtime and inode match the previous entry are
+        considered unchanged and keep their hash. Other files get a
+        "source" instead, to be stored by _store_pending.
+        """
+        mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            return {"type": "link", "target": os.readlink(path)}
+        elif stat.S_ISDIR(st.st_mode):
+            return {"type": "dir", "mode": mode}
+
+        if previous and self._unchanged(previous, st):
+            return previous
+
+        return {
+            "type": "file",
+            "source": path,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "inode": st.st_ino,
+            "mode": mode,
+        }
+
+    def _unchanged(self, entry: dict, st: os.stat_result) -> bool:
+        """Check if a file still matches the stat data of its manifest entry."""
+        return (
+            entry["type"] == "file"
+            and stat.S_ISREG(st.st_mode)
+            and entry.get("size") == st.st_size
+            and entry.get("mtime_ns") == st.st_mtime_ns
+            and entry.get("inode") == st.st_ino
+            and entry.get("mode") == stat.S_IMODE(st.st_mode)
+        )
+
+    def _scan(
+        self,
+        key: str,
+        path: str,
+        previous: dict[str, dict] | None = None,
+        follow: bool = True,
+        ignore: IgnoreRules | None = None,
+    ) -> dict[str, dict]:
+        """Scan a path stored under key and return its manifest entries.
+
+        Tracked paths themselves are followed when they are symlinks, which
+        is what makes link mode work. Paths below them are not. Entries the
+        ignore rules match are skipped before they are even stat'ed, and
+        ignored directories are not descended into. Entries that vanish
+        while they are scanned are left out, as if they were gone already.
+        """
+        previous = previous or {}
+        st = os.stat(path) if follow else os.lstat(path)
+        entries = {key: self._entry(path, st, previous.get(key))}
+        if entries[key]["type"] != "dir":
+            return entries
+
+        stack = [(path, key)]
+        while stack:
+            dirpath, prefix = stack.pop()
+            try:
+                it = os.scandir(dirpath)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with it:
+                for child in it:
+                    relpath = f"{prefix}/{child.name}"
+                    if ignore and ignore.ignored(
+                        relpath.partition("/")[2], child.is_dir(follow_symlinks=False)
+                    ):
+                        continue
+                    try:
+                        st = child.stat(follow_symlinks=False)
+                        entry = self._entry(child.path, st, previous.get(relpath))
+                    except FileNotFoundError:
+                        continue
+                    entries[relpath] = entry
+                    if stat.S_ISDIR(st.st_mode):
+                        stack.append((child.path, relpath))
+        return entries
+
+    @contextmanager
+    def _staged(self, operation: str, name: str | None) -> Iterator[Path]:
+        """Journal an operation and yield a staging directory for new objects.
+
+        If the operation fails, or the process dies before it finishes, the
+        staging directory is thrown away, either right away or by recover
+        on the next run. The catalog never references staged objects. The
+        directory is named after the pid, so recover can tell whether its
+        process is running before the journal row exists.
+        """
+        import tempfile
+
+        self.staging_dir.mkdir(exist_ok=True)
+        staging = Path(
+            tempfile.mkdtemp(
+                dir=self.staging_dir, prefix=f"{operation}-{os.getpid()}-"
+            )
+        )
+        journal_id = self.catalog.begin(operation, name, str(staging))
+        try:
+            yield staging
+        finally:
+            self.store.release(staging)
+            shutil.rmtree(staging, ignore_errors=True)
+            self.catalog.end(journal_id)
+
+    def _commit_staged(self, staging: Path) -> None:
+        """Move staged objects into the store, once the reused ones are safe.
+
+        Stored objects the operation reused were touched, so a gc keeps them
+        unless it swept them before. That is checked under the catalog lock,
+        which a gc holds while it sweeps, so the operation fails before the
+        catalog refers to an object that is gone.
+        """
+        with self.locks.catalog():
+            missing = self.store.missing(staging)
+        if missing:
+            raise GcError(
+                f"{len(missing)} object(s) were removed by a gc meanwhile, "
+                "try again."
             )
+        self.store.commit(staging)
 
-    def _write_stash_data(self, name: str, data: dict):
-        """Write to the data of a stash."""
-        path = self._get_stash(name)
-        with open(path / ".stash.json", "w") as f:
-            json.dump(data, f, indent=4)
-
-    def _get_stash_code(self, name: str) -> int:
-        """Check if a stash exists and return an exit code."""
-        path = self.stashes_dir / name
-        if not path.exists() or path.parent.name != "stashes":
-            return 1
-        else:
-            return 0
+    def recover(self) -> list[tuple[str, str | None]]:
+        """Roll back operations whose process died before they finished.
+
+        Returns the operation and stash name of every rolled back operation.
+        Staging directories without a journal row are removed once the pid
+        in their name is not running anymore.
+        """
+        if not self.staging_dir.exists() or not any(self.staging_dir.iterdir()):
+            return []
+
+        running = set()
+        rolled_back = []
+        for journal_id, operation, name, staging, pid in self.catalog.journal():
+            if pid_alive(pid):
+                running.add(staging)
+                continue
+
+            shutil.rmtree(staging, ignore_errors=True)
+            self.catalog.end(journal_id)
+            rolled_back.append((operation, name))
+
+        for path in self.staging_dir.iterdir():
+            if str(path) in running:
+                continue
+            pid = path.name.partition("-")[2].partition("-")[0]
+            if pid.isdigit() and not pid_alive(int(pid)):
+                shutil.rmtree(path, ignore_errors=True)
+        return rolled_back
+
+    def _store_pending(
+        self,
+        entries: dict[str, dict],
+        staging: Path,
+        codec: tuple[str, int] | None = None,
+        previous: dict[str, dict] | None = None,
+        chunked: bool = False,
+    ) -> None:
+        """Stage all entries that still have a source, in parallel.
+
+        Compression and chunking run on the same workers as the copies, one
+        file each. Changed files can be stored as deltas against the
+        uncompressed object of their previous entry, or against the base of
+        its delta, so no delta is ever based on another delta. Files that
+        vanished since they were scanned are dropped from entries.
+        """
+        previous = previous or {}
+        pending = []
+        for relpath, entry in entries.items():
+            if "source" not in entry:
+                continue
+            base = None
+            old = previous.get(relpath)
+            if old and old["type"] == "file" and old["codec"] is None:
+                base = old["hash"]
+            elif old and old["type"] == "file" and old["codec"] == "delta":
+                base = self.store.delta_base(old["hash"])
+            pending.append((relpath, entry, base))
+
+        def add(item: tuple) -> tuple[str, str | None] | None:
+            _, entry, base = item
+            try:
+                return self.store.add(entry["source"], staging, codec, base, chunked)
+            except FileNotFoundError:
+                if os.path.lexists(entry["source"]):
+                    raise
+                return None
+
+        results = self.engine.map(add, pending)
+        for (relpath, entry, _), result in zip(pending, results):
+            if result is None:
+                del entries[relpath]
+                continue
+            digest, stored = result
+            entry["hash"] = digest
+            entry["codec"] = stored
+            del entry["source"]
+
+    def _clear_path(self, path: str, keep_dir: bool = False) -> None:
+        """Remove whatever is at path, unless it is a directory to keep."""
+        if os.path.isdir(path) and not os.path.islink(path):
+            if not keep_dir:
+                shutil.rmtree(path)
+        elif os.path.lexists(path) and keep_dir:
+            os.unlink(path)
+
+    def _restore_file(
+        self, item: tuple[dict, str], bundle: Bundle | None = None
+    ) -> str:
+        """Restore a stored file and return the copy strategy used."""
+        import tempfile
+
+        entry, dest = item
+        start = time.perf_counter()
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(dest), prefix=f".{os.path.basename(dest)}."
+        )
+        os.close(fd)
+        try:
+            if bundle:
+                with open(tmp, "wb") as f:
+                    f.writelines(bundle.read(entry))
+                strategy = "bundle"
+            elif entry["codec"]:
+                with open(tmp, "wb") as f:
+                    f.writelines(self.store.read(entry["hash"], entry["codec"]))
+                strategy = entry["codec"]
+            else:
+                strategy = copy_file(str(self.store.path(entry["hash"])), tmp)
+            os.chmod(tmp, entry["mode"])
+            self._clear_path(dest)
+            os.replace(tmp, dest)
+        except BaseException:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            raise
+        self.timings.record(
+            f"restore ({strategy})", time.perf_counter() - start, 1, entry["size"]
+        )
+        return strategy
+
+    def _restore_link(self, entry: dict, dest: str) -> None:
+        """Point a symlink at the target of an entry.
+
+        The link is created next to dest and renamed over it, so replacing
+        an existing link never leaves dest missing.
+        """
+        tmp = os.path.join(
+            os.path.dirname(dest), f".{os.path.basename(dest)}.{os.getpid()}.link"
+        )
+        os.symlink(entry["target"], tmp)
+        self._clear_path(dest)
+        os.replace(tmp, dest)
 
     def _get_active_name(self) -> str | None:
         """Get the current active stash if it exists."""
-        with open(self.active_file, "r") as f:
-            name = f.read().strip()
-            if self._get_stash_code(name) == 0:
-                return name
+        return self.catalog.get_active()
 
-    def _get_active_path(self) -> Path | None:
-        """Get the current active stash path if it exists."""
+    def _require_active(self) -> str:
+        """Return the current active stash, or raise if there is none."""
         name = self._get_active_name()
         if not name:
-            return
-
-        path = self.stashes_dir / name
-        if path.exists():
-            return path
+            raise NoActiveStashError("no current active stash.")
+        return name
 
     def create(self, name: str) -> None:
         """Create a new stash."""
-        self._validate_name(name)
-
-        path = self.stashes_dir / name
-        data = path / ".stash.json"
-
-        if os.path.exists(path):
-            raise StashExistsError(f"stash with name: '{name}' already exists.")
-        else:
-            path.mkdir()
-            with open(data, "w") as f:
-                json.dump({"tracked": {}}, f, indent=4)
+        with self.locks.catalog():
+            self._validate_name(name)
+            self.catalog.create(name)
 
     def delete(self, name: str) -> None:
-        """Delete a stash."""
-        path = self._get_stash(name)
+        """Delete a stash.
 
-        try:
-            shutil.rmtree(path)
-
-            active_name = self._get_active_name()
-            if active_name == name:
-                self.clear()
-        except Exception as e:
-            print(f"Could not remove directory '{path}': {e}", file=sys.stderr)
-            sys.exit(1)
-
-    def list(self) -> None:
-        """List all created stashes."""
-        for stash in os.listdir(self.stashes_dir):
-            path = os.path.join(self.stashes_dir, stash)
-            if os.path.isdir(path):
-                print(stash)
+        Its objects stay in the store until gc finds nothing refers to them.
+        """
+        with self.locks.stash(name, exclusive=True), self.locks.catalog():
+            path = self._get_stash(name)
+            self.catalog.delete(name)
+            if path.exists():
+                shutil.rmtree(path)
+            self.locks.remove_stash(name)
+
+    def list(self) -> Sequence[StashInfo]:
+        """Return all created stashes."""
+        active = self._get_active_name()
+        return [StashInfo(name, name == active) for name in self.catalog.names()]
 
     def activate(self, name: str) -> None:
         """Activate a stash."""
-        if not self._get_stash(name):
-            return
-
-        with open(self.active_file, "w") as f:
-            f.write(name)
+        with self.locks.catalog():
+            self.catalog.set_active(name)
 
     def clear(self) -> None:
         """Go out of the current active stash."""
-        with open(self.active_file, "w"):
-            pass
+        with self.locks.catalog():
+            self.catalog.set_active(None)
 
-    def status(self) -> None:
-        """Print the current active stash."""
-        active_name = self._get_active_name()
-        if not active_name:
-            no_active_stash()
-        else:
-            print(active_name)
+    def _restore(
+        self,
+        name: str,
+        data: dict,
+        roots: dict[str, str],
+        bundle: Bundle | None = None,
+        cache: bool = True,
+        prune: bool = True,
+    ) -> tuple[Counter, int, int]:
+        """Restore the entries of the given keys to their root paths.
 
-    def push(self) -> None:
-        """Push changes to the current active stash."""
-        active_path = self._get_active_path()
-        active_name = self._get_active_name()
-        if not active_name:
-            no_active_stash()
-            return
+        Contents come from the object store, or from bundle if given. With
+        cache, the stat cache of the manifest is updated for the restored
+        files. With prune, live entries in the restored directories that
+        the manifest does not hold are removed, unless they are ignored.
+        Returns the copy strategies used, the number of unchanged files and
+        the number of removed entries.
+        """
+        jobs = []
+        restored = []
+        unchanged = 0
+        removed = 0
+        rules = self._ignore_rules(roots) if prune else {}
+        start = time.perf_counter()
+        for relpath in sorted(data["files"]):
+            entry = data["files"][relpath]
+            key, _, rest = relpath.partition("/")
+            if key not in roots:
+                continue
+
+            dest = roots[key]
+            if rest:
+                dest = os.path.join(dest, rest)
+            if not rest or relpath.rpartition("/")[0] not in data["files"]:
+                # Directories left out of a partial restore may be missing.
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
 
-        data = self._get_stash_data(active_name)
-        for path in data["tracked"].values():
-            dest = active_path / Path(path).name
-            if os.path.isfile(path):
-                shutil.copy2(path, dest)
+            if entry["type"] == "dir":
+                self._clear_path(dest, keep_dir=True)
+                os.makedirs(dest, exist_ok=True)
+                os.chmod(dest, entry["mode"])
+                if prune:
+                    removed += self._prune_dir(
+                        dest, relpath, data["files"], rules.get(key)
+                    )
+            elif entry["type"] == "link":
+                self._restore_link(entry, dest)
+            elif os.path.lexists(dest) and self._unchanged(entry, os.lstat(dest)):
+                unchanged += 1
             else:
-                shutil.copytree(path, dest)
+                jobs.append((entry, dest))
+                restored.append((relpath, entry))
+        self.timings.record("walk", time.perf_counter() - start, len(data["files"]))
 
-    def tree(self, name: str) -> None:
-        """Print the tree of a stash."""
+        strategies = Counter(
+            self.engine.map(partial(self._restore_file, bundle=bundle), jobs)
+        )
+        if not cache:
+            return strategies, unchanged, removed
 
-        def _build(path: Path, tree: Tree) -> None:
-            """Recursively build the tree of a path."""
-            for child in sorted(path.iterdir()):
-                if child.is_dir():
-                    branch = tree.add(f"{child.name}/")
-                    _build(child, branch)
+        for entry, dest in jobs:
+            st = os.lstat(dest)
+            entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns, inode=st.st_ino)
+        with self.timings.phase("metadata", files=len(restored)):
+            self.catalog.update_files(name, dict(restored), stat_only=True)
+        return strategies, unchanged, removed
+
+    def _prune_dir(
+        self,
+        path: str,
+        relpath: str,
+        files: dict[str, dict],
+        ignore: IgnoreRules | None,
+    ) -> int:
+        """Remove the children of a live directory that a manifest lacks.
+
+        Children the ignore rules match are kept, pushing never stored
+        them. Returns the number of removed children.
+        """
+        removed = 0
+        with os.scandir(path) as entries:
+            for child in entries:
+                child_relpath = f"{relpath}/{child.name}"
+                if child_relpath in files:
+                    continue
+                is_dir = child.is_dir(follow_symlinks=False)
+                if ignore and ignore.ignored(child_relpath.partition("/")[2], is_dir):
+                    continue
+                if is_dir:
+                    shutil.rmtree(child.path)
                 else:
-                    tree.add(child.name)
+                    os.unlink(child.path)
+                removed += 1
+        return removed
 
-        path = self._get_stash(name)
-        treeObj = Tree(path.name)
-        _build(path, treeObj)
-        rprint(treeObj)
+    def _link(self, name: str, data: dict) -> int:
+        """Point the tracked paths of a stash at its link tree.
 
-    def track(self, path: str) -> None:
-        """Track a path to the current active stash."""
-        active_name = self._get_active_name()
-        if not active_name:
-            no_active_stash()
-            return
+        The link tree holds the live contents of a stash in link mode. It is
+        only materialized from the manifest for keys it does not hold yet,
+        so switching back to a stash keeps edits made through its links.
+        Returns the number of links that were changed.
+        """
+        tree = self._get_stash(name) / "tree"
+        missing = {
+            key: str(tree / key)
+            for key in data["tracked"]
+            if not os.path.lexists(tree / key)
+        }
+        self._restore(name, data, missing)
+
+        changed = 0
+        for key, path in data["tracked"].items():
+            target = str(tree / key)
+            if not os.path.lexists(target):
+                continue
+            if os.path.islink(path) and os.readlink(path) == target:
+                continue
+
+            self._restore_link({"target": target}, path)
+            changed += 1
+        return changed
+
+    def apply(self, name: str, link: bool = False) -> RestoreResult:
+        """Restore the contents of a stash to its tracked paths and activate it.
+
+        In link mode the tracked paths become symlinks into the stash instead
+        of copies, which makes switching independent of the content size.
+        A bundle file can be given instead of a stash, its contents are then
+        copied without activating anything.
+        """
+        bundle = self._open_bundle(name)
+        if bundle:
+            with bundle:
+                if link:
+                    raise BundleError("bundles can only be applied as copies.")
+                with self.timings.phase("metadata"):
+                    data = {"tracked": bundle.tracked, "files": bundle.files()}
+                strategies, _, removed = self._restore(
+                    name, data, data["tracked"], bundle, cache=False
+                )
+            return RestoreResult(dict(strategies), removed=removed, bundle=name)
+
+        with self.locks.stash(name, exclusive=True):
+            with self.timings.phase("metadata"):
+                data = self._get_stash_data(name)
+
+            if link:
+                with self.timings.phase("link"):
+                    changed = self._link(name, data)
+                self.activate(name)
+                return RestoreResult({}, linked=changed)
+
+            strategies, unchanged, removed = self._restore(
+                name, data, data["tracked"]
+            )
+            tree = self._get_stash(name) / "tree"
+            if tree.exists():
+                shutil.rmtree(tree)
+            self.activate(name)
+            return RestoreResult(dict(strategies), unchanged, removed)
+
+    def _parse_revision(self, spec: str) -> tuple[str, int | None]:
+        """Split a "name@rev" spec into a stash name and revision number."""
+        name, separator, rev = spec.rpartition("@")
+        if self.catalog.exists(spec) or not separator or not rev.isdigit():
+            return spec, None
+        return name, int(rev)
+
+    def checkout(self, spec: str) -> RestoreResult:
+        """Restore a revision of a stash, given as name@rev, and activate it.
 
-        self._validate_path(path)
+        Without a revision this is the same as apply. The stash itself is
+        not changed, pushing afterwards records the restored contents as a
+        new revision.
+        """
+        name, rev = self._parse_revision(spec)
+        if rev is None:
+            return self.apply(name)
 
-        data = self._get_stash_data(active_name)
-        if path in data["tracked"].values():
-            print("path already tracked.")
+        with self.locks.stash(name, exclusive=True):
+            result = self.restore(name, rev)
+            tree = self._get_stash(name) / "tree"
+            if tree.exists():
+                shutil.rmtree(tree)
+            self.activate(name)
+            return result
+
+    def _selected_files(
+        self, name: str, rev: int | None, selection: GlobFilter
+    ) -> dict[str, dict]:
+        """Return the manifest entries of a stash or revision a selection holds.
+
+        Only the relpaths starting with the literal prefixes of the
+        patterns are read from the catalog, so selecting a single file
+        costs one index lookup.
+        """
+        prefixes = selection.prefixes()
+        if rev is not None:
+            files = self._revision_files(name, rev)
+        elif prefixes is None:
+            files = self.catalog.files(name)
         else:
-            data["tracked"][Path(path).name] = path
-            self._write_stash_data(active_name, data)
+            files = {}
+            for prefix in prefixes:
+                files.update(self.catalog.prefixed(name, prefix))
+
+        files = selection.filter(files)
+        if selection.only and not files:
+            raise FileNotFoundError(
+                f"no path in '{name}' matches: {', '.join(selection.only)}."
+            )
+        return files
+
+    def restore(
+        self,
+        name: str,
+        rev: int | None = None,
+        only: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+    ) -> RestoreResult:
+        """Restore a stash, or one of its revisions, without activating it.
+
+        With only patterns just the entries matching them are restored,
+        with everything below matching directories, and entries matching
+        the exclude patterns are left out. Only a full restore removes live
+        entries the stash does not hold.
+        """
+        selection = GlobFilter(only, exclude)
+        with self.locks.stash(name, exclusive=True):
+            with self.timings.phase("metadata"):
+                if selection.only or selection.exclude:
+                    data = {
+                        "tracked": self.catalog.tracked(name),
+                        "files": self._selected_files(name, rev, selection),
+                    }
+                else:
+                    data = self._get_stash_data(name)
+                    if rev is not None:
+                        data["files"] = self._revision_files(name, rev)
+            strategies, unchanged, removed = self._restore(
+                name,
+                data,
+                data["tracked"],
+                cache=rev is None,
+                prune=not (selection.only or selection.exclude),
+            )
+            return RestoreResult(dict(strategies), unchanged, removed)
 
-    def untrack(self, path_or_key: str) -> None:
-        """Untrack a path of the current active stash."""
+    def log(self, name: str | None = None) -> Sequence[Revision]:
+        """Return the revisions of a stash, newest first."""
+        name = name or self._require_active()
+        return [
+            Revision(rev, created, changes)
+            for rev, _, created, changes in self.catalog.revisions(name)
+        ]
+
+    def gc(
+        self,
+        keep_last: int | None = None,
+        keep_daily: int | None = None,
+        max_size: int | None = None,
+        dry_run: bool = False,
+    ) -> GcResult:
+        """Remove objects no stash needs anymore and prune old revisions.
+
+        Without retention rules all revisions are kept. An interrupted gc is
+        resumed by the next one.
+        """
+        from core.gc import GarbageCollector
+
+        return GarbageCollector(self).run(keep_last, keep_daily, max_size, dry_run)
+
+    def stats(self, name: str | None = None) -> Sequence[StashStats]:
+        """Return how well the files of stashes are deduplicated in the store.
+
+        The stored size of a stash counts every object its files are read
+        from once, delta bases and chunks included, so files sharing
+        contents or chunks are what makes it smaller than the files. Without
+        a name all stashes are listed, followed by a total over all of them.
+        """
+        names = [name] if name else self.catalog.names()
+        sizes = {}
+
+        def stored_size(objects: set[tuple]) -> int:
+            for part in objects - sizes.keys():
+                sizes[part] = os.path.getsize(self.store.path(*part))
+            return sum(sizes[part] for part in objects)
+
+        rows = []
+        everything = set()
+        for stash in names:
+            files = [
+                entry
+                for entry in self.catalog.files(stash).values()
+                if entry["type"] == "file"
+            ]
+            objects = set()
+            for entry in {(entry["hash"], entry["codec"]) for entry in files}:
+                objects.update(self.store.parts(*entry))
+            everything |= objects
+            rows.append(
+                StashStats(
+                    stash,
+                    len(files),
+                    sum(e["size"] for e in files),
+                    stored_size(objects),
+                )
+            )
+        if name is None and rows:
+            rows.append(
+                StashStats(
+                    None,
+                    sum(row.files for row in rows),
+                    sum(row.size for row in rows),
+                    stored_size(everything),
+                )
+            )
+        return rows
+
+    def backup(self, target: str, keep: int | None = None) -> BackupResult:
+        """Back up the store and catalog to a directory, incrementally.
+
+        With keep, only the newest that many snapshots stay in the backup.
+        """
+        from core.backup import Backup
+
+        with Backup(self, target) as backup:
+            return backup.run(keep)
+
+    def backup_every(
+        self,
+        target: str,
+        interval: float,
+        keep: int | None = None,
+        on_backup: Callable[[BackupResult], None] | None = None,
+        on_error: Callable[[Exception], None] | None = None,
+    ) -> None:
+        """Back up to a directory every interval seconds until interrupted.
+
+        on_backup is called with the result of every backup, on_error with
+        the error of every backup that failed.
+        """
+        from core.backup import Backup
+
+        with Backup(self, target) as backup:
+            backup.schedule(interval, keep, on_backup, on_error)
+
+    def backups(self, target: str) -> Sequence[Snapshot]:
+        """Return the snapshots of a backup, oldest first."""
+        from core.backup import Backup
+
+        with Backup(self, target) as backup:
+            return backup.snapshots()
+
+    def verify_backup(self, target: str) -> Sequence[str]:
+        """Check a backup against its checksums and return the bad files."""
+        from core.backup import Backup
+
+        with Backup(self, target) as backup:
+            return backup.verify()
+
+    def restore_backup(self, target: str, snapshot: int | None = None) -> BackupResult:
+        """Restore the store and catalog to a snapshot of a backup.
+
+        Without a snapshot the latest one is restored. Tracked paths are
+        not touched, apply a stash afterwards to restore them as well.
+        """
+        from core.backup import Backup
+
+        with Backup(self, target) as backup:
+            return backup.restore(snapshot)
+
+    def usage(self, name: str | None = None) -> Sequence[Usage]:
+        """Return the cached usage of stashes, from the catalog alone.
+
+        Without a name every stash gets a row. With one, the row of the
+        stash is followed by one for each of its tracked paths and any
+        untracked ones whose files are still stored.
+        """
+        rows = [
+            Usage(stash, None, None, files, size, unique, shared)
+            for stash, files, size, unique, shared in self.catalog.usage(name)
+        ]
+        if name is None:
+            return rows
+
+        tracked = self.catalog.tracked(name)
+        keys = self.catalog.key_usage(name)
+        for key in sorted(tracked.keys() | keys.keys()):
+            files, size = keys.get(key, (0, 0))
+            rows.append(Usage(name, key, tracked.get(key), files, size))
+        return rows
+
+    def recount(self) -> Sequence[str]:
+        """Recompute the cached usage of all stashes from their manifests.
+
+        Returns the names of the stashes whose cached usage was off.
+        """
+        with self.locks.catalog(), self.timings.phase("metadata"):
+            return self.catalog.recount()
+
+    def status(self) -> str:
+        """Return the current active stash."""
+        return self._require_active()
+
+    def _changes(self, name: str) -> Iterator[tuple[str, str, dict | None]]:
+        """Compare the tracked paths of a stash with its manifest.
+
+        Yields a status ("A", "M" or "D"), the relpath and the stored entry
+        for every difference, in relpath order. Only files whose stat data
+        disagrees with the manifest are hashed. When their contents turn
+        out unchanged, their stat data is refreshed in the catalog so they
+        are not hashed again, holding the stash lock exclusively for that.
+        """
+        with self.timings.phase("metadata"):
+            data = self._get_stash_data(name)
+        rules = self._ignore_rules(data["tracked"])
+        stored = filter_files(data["files"], rules)
+
+        start = time.perf_counter()
+        live = {}
+        for key, path in data["tracked"].items():
+            if os.path.lexists(path):
+                live.update(self._scan(key, path, stored, ignore=rules.get(key)))
+        self.timings.record("walk", time.perf_counter() - start, len(live))
+
+        suspects = [
+            relpath
+            for relpath, entry in live.items()
+            if "source" in entry and relpath in stored
+        ]
+        digests = self.engine.map(
+            self.store.hash_file, [live[relpath]["source"] for relpath in suspects]
+        )
+        refreshed = {}
+        for relpath, digest in zip(suspects, digests):
+            entry = live[relpath]
+            entry["hash"] = digest
+            del entry["source"]
+            old = stored[relpath]
+            if (
+                old["type"] == "file"
+                and old["hash"] == digest
+                and old["mode"] == entry["mode"]
+            ):
+                entry["codec"] = old["codec"]
+                refreshed[relpath] = entry
+        if refreshed:
+            with self.locks.stash(name, exclusive=True):
+                with self.timings.phase("metadata", files=len(refreshed)):
+                    self.catalog.refresh_stat(name, refreshed)
+
+        for relpath in sorted(live.keys() | stored.keys()):
+            old = stored.get(relpath)
+            new = live.get(relpath)
+            if old is None:
+                yield "A", relpath, None
+            elif new is None:
+                yield "D", relpath, old
+            elif new != old and relpath not in refreshed:
+                yield "M", relpath, old
+
+    def _live_path(self, tracked: dict[str, str], relpath: str) -> str:
+        """Return the live path of a manifest relpath."""
+        key, _, rest = relpath.partition("/")
+        return os.path.join(tracked[key], rest) if rest else tracked[key]
+
+    def diff(self, name: str | None = None, patch: bool = False) -> Iterator[Change]:
+        """Yield the differences between the tracked paths and a stash."""
+        import difflib
+
+        name = name or self._require_active()
+        with self.locks.stash(name):
+            tracked = self.catalog.tracked(name)
+            for status, relpath, old in self._changes(name):
+                if not patch:
+                    yield Change(status, relpath)
+                    continue
+
+                old_chunks = ()
+                if old and old["type"] == "file":
+                    old_chunks = self.store.read(old["hash"], old["codec"])
+                new_chunks = ()
+                new_path = self._live_path(tracked, relpath)
+                if status != "D" and os.path.isfile(new_path):
+                    with open(new_path, "rb") as f:
+                        new_chunks = (f.read(),)
+                old_lines = read_lines(old_chunks)
+                new_lines = read_lines(new_chunks)
+                if old_lines is None or new_lines is None:
+                    yield Change(status, relpath, binary=True)
+                    continue
+                lines = difflib.unified_diff(
+                    old_lines, new_lines, f"a/{relpath}", f"b/{relpath}"
+                )
+                yield Change(status, relpath, list(lines))
+
+    def push(self, codec: str | None = None, chunked: bool | None = None) -> int:
+        """Push changes to the current active stash.
+
+        A codec spec like "zlib:9" is saved as the codec the stash stores
+        new contents with from now on, "none" turns compression off again.
+        Likewise chunked turns storing large files in chunks on or off.
+        Returns the number of manifest entries that changed.
+        """
+        active_name = self._require_active()
+
+        with self.locks.stash(active_name, exclusive=True):
+            if codec is not None:
+                parsed = parse_codec(codec)
+                spec = f"{parsed[0]}:{parsed[1]}" if parsed else None
+                self.catalog.set_codec(active_name, spec)
+            if chunked is not None:
+                self.catalog.set_chunked(active_name, chunked)
+
+            with self.timings.phase("metadata"):
+                data = self._get_stash_data(active_name)
+            previous = data["files"]
+            rules = self._ignore_rules(data["tracked"])
+            files = {}
+            start = time.perf_counter()
+            for key, path in data["tracked"].items():
+                files.update(
+                    self._scan(key, path, previous, ignore=rules.get(key))
+                )
+            self.timings.record("walk", time.perf_counter() - start, len(files))
+
+            return self._commit_entries(active_name, files, previous)
+
+    def _commit_entries(
+        self, name: str, files: dict[str, dict], previous: dict[str, dict]
+    ) -> int:
+        """Store scanned entries and replace the previous ones with them.
+
+        A new revision is recorded if anything changed. Returns the number
+        of manifest entries that changed.
+        """
+        codec = parse_codec(self.catalog.get_codec(name))
+        chunked = self.catalog.get_chunked(name)
+        with self._staged("push", name) as staging:
+            self._store_pending(files, staging, codec, previous, chunked)
+
+            changed = {
+                relpath: entry
+                for relpath, entry in files.items()
+                if previous.get(relpath) != entry
+            }
+            removed = previous.keys() - files.keys()
+            trees = self._stage_trees(name, changed, removed, staging)
+            self._commit_staged(staging)
+
+            count = len(changed) + len(removed)
+            with self.timings.phase("metadata", files=count):
+                if count:
+                    self.catalog.update_files(name, changed, removed)
+                if trees:
+                    self.catalog.record_revision(name, *trees, count)
+        return count
+
+    def _stage_trees(
+        self,
+        name: str,
+        changed: dict[str, dict],
+        removed: Iterable[str],
+        staging: Path,
+    ) -> tuple[dict[str, str], str] | None:
+        """Stage the trees of all directories a manifest change affects.
+
+        A tree lists the contents of the direct children of a directory,
+        with the trees of child directories by digest, so unchanged
+        directories are shared by all revisions that contain them. Only the
+        directories above changed entries and those whose tree is missing
+        in the catalog are rebuilt, from their catalog rows with the
+        changes applied on top. Returns the trees by relpath and the root
+        tree, or None if there is nothing to rebuild.
+        """
+        removed = set(removed)
+        dirty = set(self.catalog.dirty_trees(name))
+        added = {}
+        for relpath, entry in changed.items():
+            if entry["type"] == "dir":
+                dirty.add(relpath)
+            added.setdefault(relpath.rpartition("/")[0], {})[relpath] = entry
+        for relpath in [*changed, *removed]:
+            dirty.update(ancestors(relpath))
+        dirty -= removed
+        if not dirty and not changed and not removed:
+            return None
+
+        trees = {}
+        for prefix in sorted(dirty, key=lambda path: path.count("/"), reverse=True):
+            trees[prefix] = self._store_tree(
+                name, prefix, trees, added.get(prefix, {}), removed, staging
+            )
+        root = self._store_tree(name, "", trees, added.get("", {}), removed, staging)
+        return trees, root
+
+    def _store_tree(
+        self,
+        name: str,
+        prefix: str,
+        trees: dict[str, str],
+        added: dict[str, dict],
+        removed: set[str],
+        staging: Path,
+    ) -> str:
+        """Stage the tree object of a directory and return its digest."""
+        import json
+
+        children = {}
+        for relpath, kind, digest, size, _, _, mode, target, codec in (
+            self.catalog.tree_rows(name, prefix)
+        ):
+            if relpath not in removed:
+                children[relpath] = [kind, digest, size, mode, target, codec]
+        for relpath, entry in added.items():
+            children[relpath] = [
+                entry["type"],
+                entry.get("hash"),
+                entry.get("size"),
+                entry.get("mode"),
+                entry.get("target"),
+                entry.get("codec"),
+            ]
+        for relpath in trees.keys() & children.keys():
+            children[relpath][1] = trees[relpath]
+
+        listing = [
+            [relpath.rpartition("/")[2], *children[relpath]]
+            for relpath in sorted(children)
+        ]
+        data = json.dumps(listing, separators=(",", ":")).encode()
+        return self.store.add_bytes(data, staging)
+
+    def _read_tree(self, digest: str) -> list:
+        """Return the children listed in a tree object."""
+        import json
+
+        return json.loads(b"".join(self.store.read(digest)))
+
+    def _revision_files(self, name: str, rev: int) -> dict[str, dict]:
+        """Return the manifest of a revision of a stash.
+
+        Only the trees of the revision are read, so this takes time
+        proportional to the size of the revision. Files equal to the
+        current ones keep their stat cache, so they are not restored again.
+        """
+        head = self.catalog.files(name)
+        files = {}
+        stack = [("", self.catalog.revision_tree(name, rev))]
+        while stack:
+            prefix, tree = stack.pop()
+            for child in self._read_tree(tree):
+                label, kind, digest, size, mode, target, codec = child
+                relpath = f"{prefix}/{label}" if prefix else label
+                if kind == "dir":
+                    files[relpath] = {"type": "dir", "mode": mode}
+                    stack.append((relpath, digest))
+                elif kind == "link":
+                    files[relpath] = {"type": "link", "target": target}
+                else:
+                    current = head.get(relpath)
+                    if current and current.get("hash") == digest:
+                        files[relpath] = current
+                    else:
+                        files[relpath] = {
+                            "type": "file",
+                            "hash": digest,
+                            "size": size,
+                            "mode": mode,
+                            "codec": codec,
+                        }
+        return files
+
+    def push_paths(self, paths: Iterable[str]) -> int:
+        """Push only the given live paths to the active stash.
+
+        Each path is rescanned with everything below it, and stored entries
+        of paths that no longer exist are removed. Paths outside the tracked
+        paths are ignored. Returns the number of manifest entries changed.
+        """
         active_name = self._get_active_name()
         if not active_name:
-            no_active_stash()
-            return
+            return 0
 
-        data = self._get_stash_data(active_name)
-        for filename, tracked_path in data["tracked"].items():
-            if path_or_key == filename:
-                key = filename
-                path = data["tracked"][path_or_key]
-                break
-            elif path_or_key == tracked_path:
-                key = filename
-                path = tracked_path
-                break
-            else:
-                key = None
-                path = None
+        with self.locks.stash(active_name, exclusive=True):
+            tracked = self.catalog.tracked(active_name)
+            rules = self._ignore_rules(tracked)
+            roots = {}
+            for path in sorted(set(paths)):
+                for key, tracked_path in tracked.items():
+                    if path == tracked_path:
+                        roots[key] = (path, True)
+                    elif path.startswith(tracked_path + os.sep):
+                        relpath = f"{key}/{os.path.relpath(path, tracked_path)}"
+                        roots[relpath] = (path, False)
 
-        if not path or not key:
-            raise FileNotFoundError(f"path: '{path}' was not found.")
+            previous = {}
+            files = {}
+            scanned = set()
+            start = time.perf_counter()
+            for relpath in sorted(roots):
+                parts = relpath.split("/")
+                if any("/".join(parts[:i]) in scanned for i in range(1, len(parts))):
+                    continue
+                scanned.add(relpath)
+
+                path, follow = roots[relpath]
+                stored = self.catalog.subtree(active_name, relpath)
+                previous.update(stored)
+                key, _, rest = relpath.partition("/")
+                ignore = rules.get(key)
+                if ignore and rest and ignore.pruned(rest, os.path.isdir(path)):
+                    # Stored entries of paths ignored since are removed.
+                    continue
+                try:
+                    files.update(self._scan(relpath, path, stored, follow, ignore))
+                except FileNotFoundError:
+                    pass
+            self.timings.record("walk", time.perf_counter() - start, len(files))
+
+            return self._commit_entries(active_name, files, previous)
 
-        if not path in data["tracked"].values():
-            print("path is not tracked.")
+    def watch(
+        self,
+        debounce: float = 1.0,
+        rescan: float = 300.0,
+        on_push: Callable[[str, int], None] | None = None,
+    ) -> None:
+        """Push changes to the active stash whenever the tracked paths change.
+
+        on_push is called with the stash and number of changes after every
+        push that changed something.
+        """
+        self._require_active()
+
+        from core.watch import Watcher
+
+        Watcher(self, debounce, rescan, on_push).run()
+
+    def tree(
+        self, name: str, depth: int | None = None, max_entries: int | None = None
+    ) -> Iterator[TreeNode]:
+        """Yield the tree of a stash or bundle, starting with its root.
+
+        Nodes are yielded as soon as they are known, walking the manifest one
+        directory at a time, so memory use only grows with the depth. Every
+        directory comes with the number and size of the files below it.
+        Entries the ignore rules stored in the stash or bundle match are
+        left out, though rollups still count those that were pushed before
+        they were ignored.
+        """
+        bundle = self._open_bundle(name)
+        if bundle:
+            with bundle:
+                yield from self._tree(
+                    bundle.children,
+                    bundle.rollup,
+                    self._stored_rules(bundle.tracked, bundle.get, bundle.read),
+                    depth,
+                    max_entries,
+                )
         else:
-            data["tracked"].pop(key, None)
-            self._write_stash_data(active_name, data)
+            with self.locks.stash(name):
+                rules = self._stored_rules(
+                    self.catalog.tracked(name),
+                    partial(self.catalog.entry, name),
+                    self._read_stored,
+                )
+                yield from self._tree(
+                    partial(self.catalog.children, name),
+                    partial(self.catalog.rollup, name),
+                    rules,
+                    depth,
+                    max_entries,
+                )
 
-    def tracked(self) -> None:
-        """List all tracked paths of the current active stash."""
-        active_name = self._get_active_name()
-        if not active_name:
-            no_active_stash()
-            return
+    def _tree(
+        self,
+        list_children: Callable[[str], Iterator[tuple[str, dict]]],
+        rollup: Callable[[str], tuple[int, int]],
+        rules: dict[str, IgnoreRules],
+        depth: int | None,
+        max_entries: int | None,
+    ) -> Iterator[TreeNode]:
+        """Yield a tree given how to list and roll up a directory."""
+
+        def _children(prefix: str) -> Iterator[tuple[str, dict, bool]]:
+            """Yield the children of a directory along with whether each is last."""
+            previous = None
+            for child in list_children(prefix):
+                key, _, rest = child[0].partition("/")
+                if (
+                    rest
+                    and key in rules
+                    and rules[key].ignored(rest, child[1]["type"] == "dir")
+                ):
+                    continue
+                if previous:
+                    yield *previous, False
+                previous = child
+            if previous:
+                yield *previous, True
+
+        start = time.perf_counter()
+        yield TreeNode("", "dir", 0, True, None, *rollup(""))
+
+        nodes = 1
+        stack = [(_children(""), "", 1, 0)] if depth is None or depth > 0 else []
+        while stack:
+            children, prefix, level, shown = stack.pop()
+            child = next(children, None)
+            if child is None:
+                continue
+            if max_entries is not None and shown >= max_entries:
+                yield TreeNode(prefix, "more", level, True)
+                continue
+            stack.append((children, prefix, level, shown + 1))
+
+            relpath, entry, last = child
+            if entry["type"] == "dir":
+                yield TreeNode(relpath, "dir", level, last, None, *rollup(relpath))
+            else:
+                yield TreeNode(
+                    relpath,
+                    entry["type"],
+                    level,
+                    last,
+                    entry.get("target"),
+                    size=entry.get("size"),
+                )
+            nodes += 1
+
+            if entry["type"] == "dir" and (depth is None or level < depth):
+                stack.append((_children(relpath), relpath, level + 1, 0))
+        self.timings.record("walk", time.perf_counter() - start, nodes)
+
+    def cat(self, name: str, relpath: str) -> Iterator[bytes]:
+        """Yield the contents of a file in a stash or bundle in chunks.
+
+        For a symlink its target is yielded as a line.
+        """
+        bundle = self._open_bundle(name)
+        try:
+            entry = bundle.get(relpath) if bundle else self.catalog.entry(name, relpath)
+            if entry is None:
+                raise FileNotFoundError(
+                    f"path: '{relpath}' was not found in '{name}'."
+                )
+            elif entry["type"] == "dir":
+                raise IsADirectoryError(f"path: '{relpath}' is a directory.")
+            elif entry["type"] == "link":
+                yield os.fsencode(entry["target"]) + b"\n"
+            elif bundle:
+                yield from bundle.read(entry)
+            else:
+                yield from self.store.read(entry["hash"], entry["codec"])
+        finally:
+            if bundle:
+                bundle.close()
+
+    def export_bundle(
+        self, name: str, path: str, compress: bool = False
+    ) -> BundleResult:
+        """Write a stash to a single bundle file."""
+        from core.bundle import write_bundle
+
+        with self.locks.stash(name):
+            with self.timings.phase("metadata"):
+                data = self._get_stash_data(name)
+                rules = self._stored_rules(
+                    data["tracked"], data["files"].get, self._read_stored
+                )
+                data["files"] = filter_files(data["files"], rules)
+            with self.timings.phase("store", files=len(data["files"])):
+                size = write_bundle(
+                    path, name, data["tracked"], data["files"], self.store, compress
+                )
+            return BundleResult(name, path, len(data["files"]), size)
+
+    def import_bundle(self, path: str, name: str | None = None) -> BundleResult:
+        """Create a stash from a bundle file."""
+        with Bundle(path) as bundle:
+            name = name or bundle.name
+            self._validate_name(name)
+            with self.locks.stash(name, exclusive=True):
+                if self.catalog.exists(name):
+                    raise StashExistsError(f"stash with name: '{name}' already exists.")
+
+                with self.timings.phase("metadata"):
+                    files = bundle.files()
+                objects = {
+                    entry["hash"]: entry
+                    for entry in files.values()
+                    if entry["type"] == "file"
+                }
+                size = sum(entry["payload"][1] for entry in objects.values())
+                with self._staged("import", name) as staging:
+                    valid = self.engine.map(
+                        lambda entry: self.store.add_chunks(
+                            entry["hash"], bundle.read(entry), staging
+                        ),
+                        list(objects.values()),
+                    )
+                    corrupt = [digest for digest, ok in zip(objects, valid) if not ok]
+                    if corrupt:
+                        raise BundleError(
+                            f"{len(corrupt)} object(s) in '{path}' are corrupt."
+                        )
+                    self._commit_staged(staging)
+
+                    for entry in files.values():
+                        if entry.pop("payload", None):
+                            # Objects that were stored already keep their codec.
+                            entry["codec"] = self.store.find(entry["hash"])[1]
+                    with self.timings.phase("metadata", files=len(files)):
+                        with self.locks.catalog():
+                            self.catalog.create(name)
+                        try:
+                            self.catalog.track(name, bundle.tracked)
+                            self.catalog.update_files(name, files)
+                            trees = self._stage_trees(name, files, (), staging)
+                            if trees:
+                                self._commit_staged(staging)
+                                self.catalog.record_revision(
+                                    name, *trees, len(files)
+                                )
+                        except BaseException:
+                            # A half imported stash must not be left behind.
+                            with self.locks.catalog():
+                                self.catalog.delete(name)
+                            raise
+        return BundleResult(name, path, len(files), size)
+
+    def track(self, paths: Iterable[str]) -> dict[str, str]:
+        """Track paths to the current active stash, in one catalog write.
+
+        All paths are validated before any is tracked. Paths that are
+        tracked already are skipped. Returns the newly tracked paths by key.
+        """
+        active_name = self._require_active()
+        paths = [paths] if isinstance(paths, str) else paths
+        for path in paths:
+            self._validate_path(path)
+
+        with self.locks.stash(active_name, exclusive=True):
+            tracked = set(self.catalog.tracked(active_name).values())
+            added = {Path(path).name: path for path in paths if path not in tracked}
+            if added:
+                self.catalog.track(active_name, added)
+            return added
+
+    def untrack(self, paths_or_keys: Iterable[str]) -> dict[str, str]:
+        """Untrack paths of the current active stash, given by path or key.
+
+        Nothing is untracked if any of them is not tracked. Returns the
+        untracked paths by key.
+        """
+        active_name = self._require_active()
+        paths_or_keys = (
+            [paths_or_keys] if isinstance(paths_or_keys, str) else paths_or_keys
+        )
+
+        with self.locks.stash(active_name, exclusive=True):
+            tracked = self.catalog.tracked(active_name)
+            keys = {path: key for key, path in tracked.items()}
+            removed = {}
+            for path_or_key in paths_or_keys:
+                key = path_or_key if path_or_key in tracked else keys.get(path_or_key)
+                if key is None:
+                    raise FileNotFoundError(f"path: '{path_or_key}' was not found.")
+                removed[key] = tracked[key]
+
+            self.catalog.untrack(active_name, removed)
+            return removed
 
-        data = self._get_stash_data(active_name)
-        for filename, path in data["tracked"].items():
-            print(filename, path)
+    def tracked(self) -> dict[str, str]:
+        """Return all tracked paths of the current active stash by key."""
+        return self.catalog.tracked(self._require_active())
@@ -1,12 +1,6 @@
-from pathlib import Path
-
-
-import platformdirs
-
-
 from core.service import Service
 from core.cli import Cli
-from core.utils import safemake
+from core.utils import safemake, user_data_dir
 
 
 class Stasher:
@@ -14,11 +8,11 @@ class Stasher:
 
     def __init__(self) -> None:
         """Define paths."""
-        self.user_data_dir = Path(platformdirs.user_data_dir())
+        self.user_data_dir = user_data_dir()
         self.root_dir = self.user_data_dir / "stasher"
         self.stashes_dir = self.root_dir / "stashes"
-        self.active_file = self.root_dir / "active.txt"
-        self.service = Service()
+        self.objects_dir = self.root_dir / "objects"
+        self.service = Service(self.root_dir)
         self.cli = Cli(self.service)
 
     def setup(self) -> None:
@@ -28,13 +22,20 @@ class Stasher:
                 self.user_data_dir: False,
                 self.root_dir: False,
                 self.stashes_dir: False,
-                self.active_file: True,
+                self.objects_dir: False,
             }
         )
 
+    def prepare(self) -> None:
+        """Setup if needed and move data of older versions into the catalog."""
+        if not self.objects_dir.exists():
+            self.setup()
+        self.service.migrate()
+
     def run(self) -> None:
-        """Setup and execute Stasher."""
-        self.setup()
+        """Setup if needed and execute Stasher."""
+        self.prepare()
+        self.cli.recover()
         self.cli.execute()
 
 
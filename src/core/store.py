@@ -0,0 +1,417 @@
+import os
+import time
+from pathlib import Path
+from functools import partial
+from typing import BinaryIO, Iterable, Iterator
+
+
+from core.timings import Timings
+from core.delta import DELTA_MIN_SIZE, MAX_RATIO, delta_base, read_delta, write_delta
+from core.chunking import CHUNKED_MIN_SIZE, split
+from core.compression import (
+    CHUNK_SIZE,
+    CODECS,
+    compressible,
+    compress_stream,
+    compressor,
+    decompress_chunks,
+)
+
+
+def sync_file(f) -> None:
+    """Flush an open file to disk."""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def sync_path(path: str | Path) -> None:
+    """Flush a file or directory to disk by its path."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class HashingReader:
+    """Wraps a binary file and hashes everything read from it."""
+
+    def __init__(self, f: BinaryIO) -> None:
+        import hashlib
+
+        self.f = f
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read from the file and hash what was read."""
+        data = self.f.read(size)
+        self.hasher.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self) -> str:
+        """Return the digest of everything read so far."""
+        return self.hasher.hexdigest()
+
+
+class ObjectStore:
+    """Content-addressed storage for stashed file contents."""
+
+    def __init__(self, root: Path, timings: Timings | None = None) -> None:
+        self.root = root
+        self.timings = timings or Timings()
+        # Stored objects that staged objects or manifests refer to, by
+        # staging directory, so they can be kept from a running gc.
+        self._reused: dict[Path, set[tuple[str, str | None]]] = {}
+
+    def path(self, digest: str, codec: str | None = None) -> Path:
+        """Return the storage path of an object stored with a codec."""
+        name = f"{digest[2:]}.{codec}" if codec else digest[2:]
+        return self.root / digest[:2] / name
+
+    def find(self, digest: str, staging: Path | None = None) -> tuple[bool, str | None]:
+        """Return whether an object is stored, or staged, and its codec."""
+        for codec in (None, *CODECS, "delta", "chunked"):
+            if staging is None:
+                path = self.path(digest, codec)
+            else:
+                path = staging / (f"{digest}.{codec}" if codec else digest)
+            if os.path.exists(path):
+                return True, codec
+        return False, None
+
+    def has(self, digest: str) -> bool:
+        """Check if an object is stored."""
+        return self.find(digest)[0]
+
+    def _reuse(self, staging: Path, digest: str, codec: str | None) -> None:
+        """Keep a stored object a staged operation refers to from a gc.
+
+        A gc never removes objects changed after it started, so the object
+        is touched along with its delta base or chunks. Whether it was
+        removed before that is checked with missing.
+        """
+        self._reused.setdefault(staging, set()).add((digest, codec))
+        try:
+            for part in self.parts(digest, codec):
+                os.utime(self.path(*part))
+        except FileNotFoundError:
+            pass
+
+    def missing(self, staging: Path) -> list[str]:
+        """Return the digests of reused objects that are not stored anymore."""
+        missing = []
+        for digest, codec in self._reused.get(staging, ()):
+            try:
+                parts = self.parts(digest, codec)
+            except FileNotFoundError:
+                parts = [(digest, codec)]
+            if not all(os.path.exists(self.path(*part)) for part in parts):
+                missing.append(digest)
+        return missing
+
+    def release(self, staging: Path) -> None:
+        """Forget the objects a finished staged operation reused."""
+        self._reused.pop(staging, None)
+
+    def read(self, digest: str, codec: str | None = None) -> Iterator[bytes]:
+        """Yield the contents of an object in chunks."""
+        if codec == "delta":
+            path = self.path(digest, codec)
+            yield from read_delta(path, self.path(delta_base(path)))
+            return
+        if codec == "chunked":
+            for chunk, _, chunk_codec in self.recipe(digest):
+                yield from self.read(chunk, chunk_codec)
+            return
+
+        with open(self.path(digest, codec), "rb") as f:
+            chunks = iter(partial(f.read, CHUNK_SIZE), b"")
+            if codec:
+                yield from decompress_chunks(chunks, codec)
+            else:
+                yield from chunks
+
+    def hash_file(self, path: str) -> str:
+        """Return the digest of a file."""
+        import hashlib
+
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+            size = f.tell()
+        self.timings.record("hash", time.perf_counter() - start, 1, size)
+        return digest
+
+    def delta_base(self, digest: str) -> str:
+        """Return the digest of the object a delta object is based on."""
+        return delta_base(self.path(digest, "delta"))
+
+    def recipe(self, digest: str) -> list[list]:
+        """Return the digest, size and codec of every chunk of a chunked object."""
+        import json
+
+        with open(self.path(digest, "chunked"), "rb") as f:
+            return json.load(f)
+
+    def parts(self, digest: str, codec: str | None = None) -> list[tuple]:
+        """Return every object the contents of an object are read from.
+
+        Objects are given as digest and codec, the object itself included.
+        """
+        parts = [(digest, codec)]
+        if codec == "delta":
+            parts.append((self.delta_base(digest), None))
+        elif codec == "chunked":
+            parts.extend((chunk, stored) for chunk, _, stored in self.recipe(digest))
+        return parts
+
+    def add(
+        self,
+        path: str,
+        staging: Path,
+        codec: tuple[str, int] | None = None,
+        base: str | None = None,
+        chunked: bool = False,
+    ) -> tuple[str, str | None]:
+        """Stage a file if its contents are not stored yet.
+
+        With chunked, large files are split into chunks that are stored
+        once, however many files share them. Otherwise large files with a
+        base, the uncompressed object of their previous contents, are stored
+        as a delta against it if that saves enough. Other files are
+        compressed on the way with a codec and level, unless they look
+        compressed already or would not get smaller.
+        New objects are named by the digest of the contents as they were
+        read while writing them, so a file changing after it was hashed
+        never gets stored under the digest of its older contents.
+        Returns the digest and the codec the object is stored with, which is
+        the one of the existing object if the contents were stored before.
+        Staged objects only become part of the store with commit.
+        """
+        digest = self.hash_file(path)
+        for directory in (None, staging):
+            found, stored = self.find(digest, directory)
+            if found:
+                if directory is None:
+                    self._reuse(staging, digest, stored)
+                return digest, stored
+
+        size = os.path.getsize(path)
+        with self.timings.phase("store", 1, size):
+            if chunked and size >= CHUNKED_MIN_SIZE:
+                return self._chunk(path, staging, codec), "chunked"
+            if base and size >= DELTA_MIN_SIZE:
+                written = self._delta(path, staging, base)
+                if written:
+                    return written, "delta"
+            return self._write(path, staging, codec)
+
+    def _delta(self, path: str, staging: Path, base: str) -> str | None:
+        """Stage a file as a delta against base if the delta is small enough.
+
+        Returns the digest of the contents the delta describes, or None if
+        nothing was staged.
+        """
+        import tempfile
+
+        if not os.path.exists(self.path(base)):
+            return None
+        self._reuse(staging, base, None)
+
+        limit = int(os.path.getsize(path) * MAX_RATIO)
+        fd, tmp = tempfile.mkstemp(dir=staging, prefix=".tmp-")
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as f:
+                reader = HashingReader(src)
+                small = write_delta(reader, str(self.path(base)), base, f, limit)
+                if small:
+                    sync_file(f)
+            if not small:
+                os.unlink(tmp)
+                return None
+            digest = reader.hexdigest()
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, staging / f"{digest}.delta")
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest
+
+    def _chunk(
+        self, path: str, staging: Path, codec: tuple[str, int] | None
+    ) -> str:
+        """Stage a file as a recipe of content-defined chunks.
+
+        Chunks that are stored or staged already are only referenced. New
+        ones are compressed with codec if the file is worth compressing and
+        the chunk gets smaller. Returns the digest of the chunks together.
+        """
+        import json
+        import hashlib
+
+        if codec and not compressible(path):
+            codec = None
+        recipe = []
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for data in split(f):
+                hasher.update(data)
+                chunk = hashlib.sha256(data).hexdigest()
+                size = len(data)
+                found, stored = self.find(chunk)
+                if found:
+                    self._reuse(staging, chunk, stored)
+                else:
+                    found, stored = self.find(chunk, staging)
+                if not found:
+                    if codec:
+                        pipe = compressor(*codec)
+                        compressed = pipe.compress(data) + pipe.flush()
+                        if len(compressed) < size:
+                            data, stored = compressed, codec[0]
+                    name = f"{chunk}.{stored}" if stored else chunk
+                    self._write_bytes(data, staging, name)
+                recipe.append([chunk, size, stored])
+
+        digest = hasher.hexdigest()
+        data = json.dumps(recipe, separators=(",", ":")).encode()
+        self._write_bytes(data, staging, f"{digest}.chunked")
+        return digest
+
+    def _write_bytes(self, data: bytes, staging: Path, name: str) -> None:
+        """Write an object to staging through a temporary file."""
+        import tempfile
+
+        fd, tmp = tempfile.mkstemp(dir=staging, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                sync_file(f)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, staging / name)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def add_chunks(self, digest: str, chunks: Iterable[bytes], staging: Path) -> bool:
+        """Stage an object of a known digest from chunks of its contents.
+
+        Returns False without staging anything if the contents do not match
+        the digest.
+        """
+        import hashlib
+        import tempfile
+
+        found, stored = self.find(digest)
+        if found:
+            self._reuse(staging, digest, stored)
+            return True
+        if self.find(digest, staging)[0]:
+            return True
+
+        start = time.perf_counter()
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=staging, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    size += f.write(chunk)
+                sync_file(f)
+            if hasher.hexdigest() != digest:
+                os.unlink(tmp)
+                return False
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, staging / digest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        self.timings.record("store", time.perf_counter() - start, 1, size)
+        return True
+
+    def add_bytes(self, data: bytes, staging: Path) -> str:
+        """Stage a small object from memory and return its digest.
+
+        Meant for metadata like trees, which is always stored uncompressed.
+        """
+        import hashlib
+
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path(digest)):
+            self._reuse(staging, digest, None)
+            return digest
+        if os.path.exists(staging / digest):
+            return digest
+
+        fd = os.open(staging / digest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o444)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            sync_file(f)
+        return digest
+
+    def _write(
+        self, path: str, staging: Path, codec: tuple[str, int] | None
+    ) -> tuple[str, str | None]:
+        """Write a file to staging through a temporary file.
+
+        Returns the digest of the contents that were written and the codec
+        they were written with.
+        """
+        import tempfile
+
+        fd, tmp = tempfile.mkstemp(dir=staging, prefix=".tmp-")
+        try:
+            used = None
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as dest:
+                if codec and compressible(path):
+                    reader = HashingReader(src)
+                    if compress_stream(reader, dest, *codec) < reader.size:
+                        used = codec[0]
+                    else:
+                        src.seek(0)
+                        dest.seek(0)
+                        dest.truncate()
+                if used is None:
+                    reader = HashingReader(src)
+                    while chunk := reader.read(CHUNK_SIZE):
+                        dest.write(chunk)
+                sync_file(dest)
+
+            digest = reader.hexdigest()
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, staging / (f"{digest}.{used}" if used else digest))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest, used
+
+    def commit(self, staging: Path) -> int:
+        """Move all staged objects into the store and return their count.
+
+        Staged objects are flushed to disk by the workers that write them,
+        so only the directories the renames change are synced here, and no
+        object can appear without its contents.
+        """
+        names = [name for name in os.listdir(staging) if not name.startswith(".")]
+        if not names:
+            return 0
+
+        directories = {staging}
+        for name in names:
+            dest = self.root / name[:2] / name[2:]
+            if not dest.parent.is_dir():
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                directories.add(self.root)
+            os.replace(staging / name, dest)
+            directories.add(dest.parent)
+        with self.timings.phase("sync", files=len(names)):
+            for directory in directories:
+                sync_path(directory)
+        return len(names)
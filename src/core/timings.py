@@ -0,0 +1,91 @@
+import time
+import threading
+from typing import Callable
+from contextlib import contextmanager
+
+
+class Timings:
+    """Collects durations, file counts and byte counts per phase.
+
+    Every recorded measurement is also passed to all subscribers as an event
+    dict, which lets frontends follow an operation while it runs. Phases
+    that run on worker threads add up the time of all workers.
+    """
+
+    def __init__(self) -> None:
+        self.phases: dict[str, dict] = {}
+        self.subscribers: list[Callable[[dict], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[dict], None]) -> None:
+        """Call callback with every recorded event."""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[dict], None]) -> None:
+        """Stop calling callback."""
+        self.subscribers.remove(callback)
+
+    def record(
+        self, phase: str, seconds: float = 0.0, files: int = 0, nbytes: int = 0
+    ) -> None:
+        """Add a measurement to a phase."""
+        with self._lock:
+            totals = self.phases.setdefault(
+                phase, {"seconds": 0.0, "calls": 0, "files": 0, "bytes": 0}
+            )
+            totals["seconds"] += seconds
+            totals["calls"] += 1
+            totals["files"] += files
+            totals["bytes"] += nbytes
+
+        if self.subscribers:
+            event = {
+                "phase": phase,
+                "seconds": seconds,
+                "files": files,
+                "bytes": nbytes,
+            }
+            for callback in list(self.subscribers):
+                callback(event)
+
+    @contextmanager
+    def phase(self, phase: str, files: int = 0, nbytes: int = 0):
+        """Time the enclosed block as part of a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start, files, nbytes)
+
+    def reset(self) -> None:
+        """Forget all measurements."""
+        with self._lock:
+            self.phases.clear()
+
+    def to_dict(self) -> dict[str, dict]:
+        """Return a copy of all phase totals."""
+        with self._lock:
+            return {phase: dict(totals) for phase, totals in self.phases.items()}
+
+    def summary(self) -> str:
+        """Return the phase totals as a plain text table."""
+        rows = [("phase", "time", "calls", "files", "bytes")]
+        for phase, totals in self.to_dict().items():
+            rows.append(
+                (
+                    phase,
+                    f"{totals['seconds'] * 1000:.2f} ms",
+                    str(totals["calls"]),
+                    str(totals["files"]),
+                    str(totals["bytes"]),
+                )
+            )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return "\n".join(
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        )
@@ -1,6 +1,54 @@
+import os
+import sys
 from pathlib import Path
 
 
+def user_data_dir() -> Path:
+    """Return the user data directory.
+
+    On Linux the XDG location is resolved directly, which saves importing
+    platformdirs on every invocation.
+    """
+    if sys.platform.startswith("linux"):
+        path = os.environ.get("XDG_DATA_HOME", "").strip()
+        return Path(path) if path else Path.home() / ".local" / "share"
+
+    import platformdirs
+
+    return Path(platformdirs.user_data_dir())
+
+
+def format_size(size: int) -> str:
+    """Format a byte count for humans."""
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KiB", "MiB", "GiB", "TiB"):
+        size /= 1024
+        if size < 1024 or unit == "TiB":
+            return f"{size:.1f} {unit}"
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte count like 512, 200K, 1.5G or 2GiB."""
+    value = text.strip().lower().removesuffix("ib").removesuffix("b")
+    unit = value[-1:] if value[-1:] in ("k", "m", "g", "t") else ""
+    size = float(value[: len(value) - len(unit)])
+    if size < 0:
+        raise ValueError(f"negative size: '{text}'")
+    return int(size * 1024 ** " kmgt".index(unit or " "))
+
+
+def pid_alive(pid: int) -> bool:
+    """Check if a process is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 def safemake(paths: dict[Path, bool]) -> None:
     """Safely create files/directorys if they dont exist"""
     for path, isFile in paths.items():
@@ -0,0 +1,346 @@
+import os
+import sys
+import time
+import errno
+import select
+import sqlite3
+import struct
+import ctypes
+import ctypes.util
+from typing import Callable
+
+
+from core.errors import (
+    CodecError,
+    CopyError,
+    GcError,
+    NoActiveStashError,
+    StashNotFoundError,
+    WatchError,
+)
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Events that can change what a push would store. IN_MODIFY is left out on
+# purpose, a file is pushed once it is closed after writing.
+MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+# Directories below a tracked path are watched as they are, not followed.
+SUBDIR_MASK = MASK | IN_ONLYDIR | IN_DONT_FOLLOW
+
+EVENT = struct.Struct("iIII")
+
+# Touched paths kept before a flush falls back to a full push.
+MAX_PENDING = 4096
+
+# Longest time a change waits for its push while events keep coming in.
+MAX_DELAY = 30.0
+
+# Errors of a single push that the watcher outlives. A file that vanished,
+# a locked catalog or a concurrent gc are gone by the next try.
+PUSH_ERRORS = (
+    OSError,
+    sqlite3.Error,
+    CodecError,
+    CopyError,
+    GcError,
+    NoActiveStashError,
+    StashNotFoundError,
+)
+
+
+class Inotify:
+    """A minimal inotify instance on top of libc."""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise WatchError("inotify is not available on this system.")
+
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch a path and return its watch descriptor."""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        """Stop watching a watch descriptor, if it still exists."""
+        self._rm_watch(self.fd, wd)
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """Return all queued events as (wd, mask, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self) -> None:
+        """Close the instance along with all of its watches."""
+        os.close(self.fd)
+
+
+class Watcher:
+    """Pushes the paths touched in the tracked paths of the active stash.
+
+    Every tracked path is watched through its parent directory, and tracked
+    directories are watched recursively. Bursts of events are collected as
+    a bounded set of touched paths, which is pushed once no event came in
+    for the debounce window. When the set overflows, or the kernel drops
+    events, the next flush pushes all tracked paths instead. When the
+    inotify watch limit is hit, the paths left unwatched are covered by a
+    full push every rescan seconds.
+    """
+
+    def __init__(
+        self,
+        service,
+        debounce: float = 1.0,
+        rescan: float = 300.0,
+        on_push: Callable[[str, int], None] | None = None,
+    ) -> None:
+        self.service = service
+        self.debounce = debounce
+        self.rescan = rescan
+        self.on_push = on_push
+        self.inotify = None
+        self.poller = None
+        self.watches: dict[int, tuple[str, set[str] | None]] = {}
+        self.active = None
+        self.tracked = {}
+        self.limited = False
+        self.pending = set()
+        self.overflow = False
+        self.first = None
+        self.last = None
+        self.last_rescan = time.monotonic()
+
+    def _watch(self, path: str, mask: int, name: str | None = None) -> bool:
+        """Add a watch for a directory, or for one name in it.
+
+        Returns False if the watch limit was hit.
+        """
+        try:
+            wd = self.inotify.add_watch(path, mask)
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                return True
+            if not self.limited:
+                print(
+                    "inotify watch limit reached, some paths are only pushed "
+                    f"every {self.rescan:g}s. Raise fs.inotify.max_user_watches "
+                    "to watch all of them.",
+                    file=sys.stderr,
+                )
+            self.limited = True
+            return False
+
+        names = self.watches.get(wd, (path, set()))[1]
+        if name is None or names is None:
+            names = None
+        else:
+            names = names | {name}
+        self.watches[wd] = (path, names)
+        return True
+
+    def _watch_tree(self, path: str, mask: int = MASK | IN_ONLYDIR) -> bool:
+        """Watch a directory and all directories below it."""
+        stack = [(path, mask)]
+        while stack:
+            dirpath, mask = stack.pop()
+            if not self._watch(dirpath, mask):
+                return False
+            try:
+                with os.scandir(dirpath) as it:
+                    for child in it:
+                        if child.is_dir(follow_symlinks=False):
+                            stack.append((child.path, SUBDIR_MASK))
+            except OSError:
+                continue
+        return True
+
+    def _rebuild(self) -> None:
+        """Replace all watches with ones for the current tracked paths."""
+        if self.inotify:
+            self.inotify.close()
+        self.inotify = Inotify()
+        self.poller = select.poll()
+        self.poller.register(self.inotify.fd, select.POLLIN)
+        self.watches.clear()
+
+        self.active = self.service._get_active_name()
+        self.tracked = self.service.catalog.tracked(self.active) if self.active else {}
+        for path in self.tracked.values():
+            parent, name = os.path.split(path)
+            if not self._watch(parent, MASK | IN_ONLYDIR, name):
+                break
+            if os.path.isdir(path) and not self._watch_tree(path):
+                break
+
+    def _touch(self, path: str) -> None:
+        """Remember a touched path for the next flush."""
+        if self.first is None:
+            self.first = time.monotonic()
+        self.last = time.monotonic()
+        if self.overflow:
+            return
+        self.pending.add(path)
+        if len(self.pending) > MAX_PENDING:
+            self.pending.clear()
+            self.overflow = True
+
+    def _unwatch_tree(self, path: str) -> None:
+        """Drop the watches of a directory that was moved away."""
+        for wd, (watched, names) in list(self.watches.items()):
+            if names is None and (
+                watched == path or watched.startswith(path + os.sep)
+            ):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def _handle(self, wd: int, mask: int, name: str) -> None:
+        """Turn a single event into touched paths and watch changes."""
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            self._touch("")
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if wd not in self.watches:
+            return
+
+        dirpath, names = self.watches[wd]
+        if names is not None and name not in names:
+            return
+        path = os.path.join(dirpath, name) if name else dirpath
+
+        if mask & IN_ISDIR and names is None:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path, SUBDIR_MASK)
+            elif mask & IN_MOVED_FROM:
+                self._unwatch_tree(path)
+        self._touch(path)
+
+    def flush(self) -> None:
+        """Push all touched paths to the active stash."""
+        if self._config() != (self.active, self.tracked):
+            # The events most likely came from applying another stash, they
+            # must not end up in the one that was active before.
+            self.pending.clear()
+            self.overflow = False
+            self._rebuild()
+        elif self.overflow:
+            self.pending = set(self.tracked.values())
+        elif not self.pending:
+            return
+
+        full = self.overflow
+        rebuild = any(
+            path in self.tracked.values() and os.path.isdir(path)
+            for path in self.pending
+        )
+        paths = self.pending
+        self.pending = set()
+        self.overflow = False
+        self.first = self.last = None
+        if full:
+            self.last_rescan = time.monotonic()
+        if rebuild:
+            self._rebuild()
+
+        try:
+            count = self.service.push_paths(paths) if paths else 0
+        except PUSH_ERRORS as e:
+            print(f"Push failed, retrying: {e}", file=sys.stderr)
+            # Keep the paths for the next flush, after another debounce.
+            if full:
+                self.overflow = True
+            else:
+                self.pending |= paths
+            self.first = self.last = time.monotonic()
+            return
+        if count and self.on_push:
+            self.on_push(self.active, count)
+
+    def _config(self) -> tuple[str | None, dict[str, str]]:
+        """Return the active stash and its tracked paths from the catalog."""
+        active = self.service._get_active_name()
+        return active, self.service.catalog.tracked(active) if active else {}
+
+    def _due(self, now: float) -> bool:
+        """Check if the touched paths should be pushed."""
+        if self.last is None:
+            return False
+        return now - self.last >= self.debounce or now - self.first >= MAX_DELAY
+
+    def run(self) -> None:
+        """Watch and push until interrupted."""
+        self._rebuild()
+        try:
+            while True:
+                if self.poller.poll(min(self.debounce, 1.0) * 1000):
+                    for event in self.inotify.read():
+                        self._handle(*event)
+
+                now = time.monotonic()
+                if self.limited and now - self.last_rescan >= self.rescan:
+                    self.overflow = True
+                    self._touch("")
+                if self._due(now):
+                    self.flush()
+                elif self.last is None and self._config() != (
+                    self.active,
+                    self.tracked,
+                ):
+                    self._rebuild()
+        except KeyboardInterrupt:
+            self.flush()
+        finally:
+            self.inotify.close()
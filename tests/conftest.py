@@ -0,0 +1,48 @@
+import pytest
+
+
+from core.service import Service
+
+
+@pytest.fixture
+def service(tmp_path):
+    """A service keeping its data below a temporary directory."""
+    root_dir = tmp_path / "data"
+    for path in (root_dir, root_dir / "stashes", root_dir / "objects"):
+        path.mkdir()
+    service = Service(root_dir)
+    service.migrate()
+    return service
+
+
+@pytest.fixture
+def work(tmp_path):
+    """A directory to track, outside of the data directory."""
+    path = tmp_path / "work" / "cfg"
+    path.mkdir(parents=True)
+    return path
+
+
+def write(path, text):
+    """Write text to a file, creating its directory."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def stash(service, name, path, files):
+    """Create a stash tracking path that holds the given files, and push it."""
+    service.create(name)
+    service.activate(name)
+    service.track([str(path)])
+    for relpath, text in files.items():
+        write(path / relpath, text)
+    service.push()
+
+
+def contents(path):
+    """Return the text of every file below path, by relpath."""
+    return {
+        str(file.relative_to(path)): file.read_text()
+        for file in sorted(path.rglob("*"))
+        if file.is_file()
+    }
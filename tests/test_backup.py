@@ -0,0 +1,88 @@
+import os
+import stat
+import time
+
+import pytest
+
+
+from conftest import contents, stash, write
+from core.backup import Backup
+
+
+def test_backup_skips_unchanged_catalog(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one"})
+    target = str(tmp_path / "backup")
+
+    first = service.backup(target)
+    again = service.backup(target)
+    assert again.unchanged
+    assert again.snapshot == first.snapshot
+    assert len(service.backups(target)) == 1
+
+    write(work / "b", "two")
+    service.push()
+    third = service.backup(target)
+    assert not third.unchanged
+    assert third.snapshot == first.snapshot + 1
+    assert third.objects >= 1
+
+
+def test_backup_restore(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one", "sub/b": "two"})
+    target = str(tmp_path / "backup")
+    snapshot = service.backup(target).snapshot
+
+    service.delete("p1")
+    time.sleep(0.2)
+    service.gc()
+    assert not service.catalog.exists("p1")
+
+    result = service.restore_backup(target, snapshot)
+    assert result.objects >= 2
+    assert service.verify_backup(target) == []
+    for entry in service.catalog.files("p1").values():
+        if entry["type"] == "file":
+            mode = os.stat(service.store.path(entry["hash"], entry["codec"])).st_mode
+            assert stat.S_IMODE(mode) == 0o444
+
+    (work / "a").unlink()
+    service.apply("p1")
+    assert contents(work) == {"a": "one", "sub/b": "two"}
+
+
+def test_verify_backup_finds_corrupt_objects(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one"})
+    target = tmp_path / "backup"
+    service.backup(str(target))
+
+    digest = service.catalog.files("p1")["cfg/a"]["hash"]
+    path = target / "objects" / digest[:2] / digest[2:]
+    os.chmod(path, 0o644)
+    path.write_text("corrupt")
+    assert service.verify_backup(str(target)) == [f"objects/{digest[:2]}/{digest[2:]}"]
+
+
+def test_backup_skips_objects_removed_meanwhile(service, work, tmp_path, monkeypatch):
+    stash(service, "p1", work, {"a": "one"})
+    target = str(tmp_path / "backup")
+    stored = Backup._stored
+    # An object a gc removes between listing the store and copying it.
+    monkeypatch.setattr(Backup, "_stored", lambda self: stored(self) | {"00/gone"})
+
+    result = service.backup(target)
+    assert result.objects == len(stored(Backup(service, target)))
+    assert service.backups(target)[-1].objects == result.objects
+    assert service.verify_backup(target) == []
+
+
+def test_scheduled_backups_outlive_failures(service, tmp_path, monkeypatch):
+    outcomes = [OSError("disk full"), KeyboardInterrupt()]
+
+    def run(self, keep=None):
+        raise outcomes.pop(0)
+
+    monkeypatch.setattr(Backup, "run", run)
+    errors = []
+    with pytest.raises(KeyboardInterrupt):
+        service.backup_every(str(tmp_path / "backup"), 0, on_error=errors.append)
+    assert [str(e) for e in errors] == ["disk full"]
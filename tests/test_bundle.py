@@ -0,0 +1,101 @@
+import pytest
+
+
+from conftest import contents, stash, write
+from core.errors import BundleError, StashExistsError
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_export_import_round_trip(service, work, tmp_path, compress):
+    files = {"a": "one", "sub/b": "two" * 1000, "sub/c": "two" * 1000}
+    stash(service, "p1", work, files)
+    path = str(tmp_path / "p1.bundle")
+
+    result = service.export_bundle("p1", path, compress)
+    assert result.entries == len(service.catalog.files("p1"))
+
+    imported = service.import_bundle(path, "p2")
+    assert imported.name == "p2"
+    assert service.catalog.files("p2").keys() == service.catalog.files("p1").keys()
+    assert b"".join(service.cat("p2", "cfg/sub/b")) == b"two" * 1000
+    assert service.catalog.revisions("p2")
+
+    for relpath in files:
+        (work / relpath).unlink()
+    service.apply("p2")
+    assert contents(work) == files
+
+
+def empty_store(service):
+    """Remove every object from the store."""
+    for prefix in service.store.root.iterdir():
+        for path in prefix.iterdir():
+            path.unlink()
+
+
+def test_import_into_a_fresh_store(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one"})
+    path = str(tmp_path / "p1.bundle")
+    service.export_bundle("p1", path)
+    service.delete("p1")
+    empty_store(service)
+
+    service.import_bundle(path)
+    assert b"".join(service.cat("p1", "cfg/a")) == b"one"
+
+
+def test_import_refuses_existing_stash(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one"})
+    path = str(tmp_path / "p1.bundle")
+    service.export_bundle("p1", path)
+
+    with pytest.raises(StashExistsError):
+        service.import_bundle(path)
+
+
+def test_apply_bundle_file(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one", "b": "two"})
+    path = str(tmp_path / "p1.bundle")
+    service.export_bundle("p1", path)
+    write(work / "a", "changed")
+    write(work / "c", "new")
+
+    result = service.apply(path)
+    assert result.bundle == path
+    assert result.removed == 1
+    assert contents(work) == {"a": "one", "b": "two"}
+
+
+def test_import_rejects_corrupt_bundle(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "x" * 4096})
+    path = tmp_path / "p1.bundle"
+    service.export_bundle("p1", str(path))
+    data = bytearray(path.read_bytes())
+    offset = data.find(b"x" * 64)
+    assert offset != -1
+    data[offset] = ord("y")
+    path.write_bytes(bytes(data))
+    # Objects in the store already are not read from the bundle.
+    empty_store(service)
+
+    with pytest.raises(BundleError):
+        service.import_bundle(str(path), "p2")
+    assert not service.catalog.exists("p2")
+
+
+def test_failed_import_leaves_no_stash(service, work, tmp_path, monkeypatch):
+    stash(service, "p1", work, {"a": "one", "sub/b": "two"})
+    path = str(tmp_path / "p1.bundle")
+    service.export_bundle("p1", path)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(service.catalog, "record_revision", fail)
+        with pytest.raises(OSError):
+            service.import_bundle(path, "p2")
+    assert not service.catalog.exists("p2")
+
+    service.import_bundle(path, "p2")
+    assert service.catalog.files("p2").keys() == service.catalog.files("p1").keys()
@@ -0,0 +1,54 @@
+import multiprocessing
+import sqlite3
+
+
+from conftest import stash
+from core.catalog import MIGRATIONS, Catalog, migrate
+
+
+def open_catalog(path, barrier, versions):
+    barrier.wait()
+    versions.put(Catalog(path).conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def test_concurrent_opens_migrate_once(tmp_path):
+    path = tmp_path / "catalog.db"
+    barrier = multiprocessing.Barrier(4)
+    versions = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=open_catalog, args=(path, barrier, versions))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+    assert [versions.get() for _ in processes] == [len(MIGRATIONS)] * 4
+
+    catalog = Catalog(path)
+    catalog.create("p1")
+    assert catalog.exists("p1")
+
+
+def test_migrate_applies_only_newer_versions(tmp_path):
+    conn = sqlite3.connect(tmp_path / "catalog.db")
+    migrate(conn, MIGRATIONS[:2])
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 2
+
+    migrate(conn, MIGRATIONS)
+    migrate(conn, MIGRATIONS)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+
+
+def test_usage_counts_unique_logical_sizes(service, tmp_path):
+    one, two = tmp_path / "one", tmp_path / "two"
+    one.mkdir()
+    two.mkdir()
+    stash(service, "p1", one, {"a": "x" * 1000, "b": "x" * 1000, "c": "y"})
+    stash(service, "p2", two, {"a": "x" * 1000})
+
+    usage = {row.name: row for row in service.usage()}
+    assert usage["p1"][4:] == (2001, 1001, 1000)
+    assert usage["p2"][4:] == (1000, 1000, 1000)
+    assert service.recount() == []
@@ -0,0 +1,33 @@
+import os
+
+
+from conftest import stash, write
+
+
+def test_diff_lists_changes(service, work):
+    stash(service, "p1", work, {"a": "one", "b": "two"})
+    write(work / "a", "changed")
+    (work / "b").unlink()
+    write(work / "c", "new")
+
+    changes = [(c.status, c.relpath) for c in service.diff("p1")]
+    assert changes == [("M", "cfg/a"), ("D", "cfg/b"), ("A", "cfg/c")]
+
+
+def test_diff_refreshes_stat_of_unchanged_files(service, work):
+    stash(service, "p1", work, {"a": "one"})
+    os.utime(work / "a", ns=(0, 1_000_000_000))
+
+    assert list(service.diff("p1")) == []
+    assert service.catalog.files("p1")["cfg/a"]["mtime_ns"] == 1_000_000_000
+
+
+def test_stat_refresh_leaves_replaced_entries_alone(service, work):
+    stash(service, "p1", work, {"a": "one"})
+    entry = dict(service.catalog.files("p1")["cfg/a"])
+    write(work / "a", "two")
+    service.push()
+
+    entry["mtime_ns"] = 1
+    service.catalog.refresh_stat("p1", {"cfg/a": entry})
+    assert service.catalog.files("p1")["cfg/a"]["mtime_ns"] != 1
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+
+from conftest import contents, stash, write
+from core.errors import GcError
+
+
+def stored(service, name):
+    """Check that every object a stash refers to is in the store."""
+    for entry in service.catalog.files(name).values():
+        if entry["type"] != "file":
+            continue
+        for part in service.store.parts(entry["hash"], entry["codec"]):
+            if not service.store.path(*part).exists():
+                return False
+    return True
+
+
+def test_gc_removes_objects_of_deleted_stashes(service, work):
+    stash(service, "p1", work, {"a": "one"})
+    digest = service.catalog.files("p1")["cfg/a"]["hash"]
+    service.delete("p1")
+    time.sleep(0.2)
+
+    result = service.gc()
+    assert result.removed >= 1
+    assert not service.store.has(digest)
+
+
+def test_gc_keeps_objects_a_push_reuses(service, work, monkeypatch):
+    stash(service, "p1", work, {"a": "one"})
+    service.delete("p1")
+    time.sleep(0.2)
+    missing = service.store.missing
+
+    def gc_first(staging):
+        # The push found the garbage object before this gc sweeps.
+        assert service.gc().removed == 0
+        return missing(staging)
+
+    service.create("p2")
+    service.activate("p2")
+    service.track([str(work)])
+    monkeypatch.setattr(service.store, "missing", gc_first)
+    service.push()
+    assert stored(service, "p2")
+
+
+def test_push_fails_if_a_gc_removed_a_reused_object(service, work, monkeypatch):
+    stash(service, "p1", work, {"a": "one"})
+    digest = service.catalog.files("p1")["cfg/a"]["hash"]
+    service.delete("p1")
+    missing = service.store.missing
+
+    def swept(staging):
+        # A gc removed the object between finding and touching it.
+        service.store.path(digest).unlink()
+        return missing(staging)
+
+    service.create("p2")
+    service.activate("p2")
+    service.track([str(work)])
+    monkeypatch.setattr(service.store, "missing", swept)
+    with pytest.raises(GcError):
+        service.push()
+    assert service.catalog.files("p2") == {}
+
+    monkeypatch.undo()
+    service.push()
+    assert stored(service, "p2")
+
+
+def test_gc_sweeping_after_a_reusing_push(service, work, monkeypatch):
+    stash(service, "p1", work, {"a": "one"})
+    service.delete("p1")
+    time.sleep(0.2)
+    commit = service.store.commit
+
+    def gc_first(staging):
+        # The push kept the garbage object, this gc sweeps before the
+        # catalog refers to it.
+        service.gc()
+        return commit(staging)
+
+    service.create("p2")
+    service.activate("p2")
+    service.track([str(work)])
+    monkeypatch.setattr(service.store, "commit", gc_first)
+    service.push()
+    assert stored(service, "p2")
+
+    (work / "a").unlink()
+    service.apply("p2")
+    assert contents(work) == {"a": "one"}
+
+
+def test_gc_with_concurrent_pushes(service, work):
+    stash(service, "p1", work, {f"f{i}": f"old {i}" for i in range(50)})
+    service.delete("p1")
+    service.create("p2")
+    service.activate("p2")
+    service.track([str(work)])
+    done = threading.Event()
+    errors = []
+
+    def collect():
+        try:
+            while not done.is_set():
+                service.gc()
+        except BaseException as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=collect)
+    thread.start()
+    try:
+        for shift in range(10):
+            for i in range(50):
+                write(work / f"f{i}", f"old {(i + shift) % 50}")
+            try:
+                service.push()
+            except GcError:
+                # Rare, if a sweep removed an object right after it was found.
+                service.push()
+            assert stored(service, "p2")
+    finally:
+        done.set()
+        thread.join()
+    assert not errors
+    service.gc()
+    assert stored(service, "p2")
@@ -0,0 +1,44 @@
+from conftest import stash, write
+from core.bundle import Bundle
+
+
+def listed(service, name):
+    """Return the relpaths the tree of a stash or bundle shows."""
+    return {node.relpath for node in service.tree(name)} - {""}
+
+
+def test_push_skips_ignored_files(service, work):
+    write(work / "run.log", "log")
+    stash(service, "p1", work, {".stasherignore": "*.log\n", "a": "one"})
+    assert set(service.catalog.files("p1")) == {"cfg", "cfg/.stasherignore", "cfg/a"}
+
+
+def test_listings_use_the_ignore_file_of_the_stash(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one", "b.log": "log"})
+    # The live ignore file belongs to whatever is checked out, not to p1.
+    write(work / ".stasherignore", "*.log\n")
+    assert listed(service, "p1") == {"cfg", "cfg/a", "cfg/b.log"}
+
+    path = str(tmp_path / "p1.bundle")
+    service.export_bundle("p1", path)
+    with Bundle(path) as bundle:
+        assert set(bundle.files()) == {"cfg", "cfg/a", "cfg/b.log"}
+
+
+def test_listings_apply_the_stored_ignore_file(service, work, tmp_path):
+    stash(service, "p1", work, {"a": "one", "b.log": "log"})
+    write(work / ".stasherignore", "*.log\n")
+    (work / "b.log").unlink()
+    service.push()
+    # An entry pushed before it was ignored stays in the manifest.
+    service.catalog.update_files(
+        "p1", {"cfg/b.log": dict(service.catalog.files("p1")["cfg/a"])}
+    )
+    (work / ".stasherignore").unlink()
+
+    assert listed(service, "p1") == {"cfg", "cfg/.stasherignore", "cfg/a"}
+    path = str(tmp_path / "p1.bundle")
+    service.export_bundle("p1", path)
+    with Bundle(path) as bundle:
+        assert "cfg/b.log" not in bundle.files()
+    assert listed(service, path) == {"cfg", "cfg/.stasherignore", "cfg/a"}
@@ -0,0 +1,41 @@
+import os
+import threading
+import time
+
+
+from conftest import stash
+from core.locks import Locks
+
+
+def test_delete_removes_the_stash_lock(service, work):
+    stash(service, "p1", work, {"a": "one"})
+    path = service.locks.root / "stashes" / "p1.lock"
+    assert path.exists()
+
+    service.delete("p1")
+    assert not path.exists()
+
+
+def test_waiting_for_a_removed_lock_takes_the_new_one(tmp_path):
+    locks = Locks(tmp_path)
+    path = tmp_path / "stashes" / "p1.lock"
+    waiting = threading.Event()
+    inodes = []
+
+    def wait():
+        waiting.set()
+        with locks.stash("p1", exclusive=True):
+            inodes.append(os.stat(path).st_ino)
+            fd = locks._local.held[path][0]
+            inodes.append(os.fstat(fd).st_ino)
+
+    with locks.stash("p1", exclusive=True):
+        thread = threading.Thread(target=wait)
+        thread.start()
+        waiting.wait()
+        # Let the thread open the old lock file and block on it.
+        time.sleep(0.1)
+        locks.remove_stash("p1")
+    thread.join()
+
+    assert inodes[0] == inodes[1]
@@ -0,0 +1,38 @@
+import os
+
+
+from conftest import stash, write
+
+
+def test_push_skips_files_vanishing_during_the_scan(service, work, monkeypatch):
+    stash(service, "p1", work, {"a": "one", "b": "two"})
+    write(work / "b", "three")
+    entry = service._entry
+
+    def vanish(path, st, previous):
+        if path.endswith("b"):
+            os.unlink(path)
+            raise FileNotFoundError(path)
+        return entry(path, st, previous)
+
+    monkeypatch.setattr(service, "_entry", vanish)
+    assert service.push() == 1
+    assert "cfg/b" not in service.catalog.files("p1")
+
+
+def test_push_skips_files_vanishing_before_they_are_stored(
+    service, work, monkeypatch
+):
+    stash(service, "p1", work, {"a": "one", "b": "two"})
+    write(work / "b", "three")
+    hash_file = service.store.hash_file
+
+    def vanish(path):
+        if path.endswith("b"):
+            os.unlink(path)
+        return hash_file(path)
+
+    monkeypatch.setattr(service.store, "hash_file", vanish)
+    assert service.push() == 1
+    assert "cfg/b" not in service.catalog.files("p1")
+    assert service.push() == 0
@@ -0,0 +1,70 @@
+from conftest import contents, stash, write
+
+
+def test_apply_removes_files_the_stash_lacks(service, work):
+    stash(service, "p1", work, {"a": "one", "b": "two"})
+    (work / "b").unlink()
+    stash(service, "p2", work, {"a": "three"})
+
+    service.apply("p1")
+    assert contents(work) == {"a": "one", "b": "two"}
+
+    result = service.apply("p2")
+    assert contents(work) == {"a": "three"}
+    assert result.removed == 1
+    assert list(service.diff("p2")) == []
+
+
+def test_apply_removes_directories_the_stash_lacks(service, work):
+    stash(service, "p1", work, {"a": "one", "sub/deep/b": "two"})
+    service.create("p2")
+    service.activate("p2")
+    service.track([str(work)])
+    (work / "sub" / "deep" / "b").unlink()
+    (work / "sub" / "deep").rmdir()
+    (work / "sub").rmdir()
+    service.push()
+
+    service.apply("p1")
+    service.apply("p2")
+    assert contents(work) == {"a": "one"}
+    assert not (work / "sub").exists()
+
+
+def test_apply_keeps_ignored_files(service, work):
+    stash(service, "p1", work, {".stasherignore": "*.log\n", "a": "one"})
+    write(work / "run.log", "kept")
+
+    service.apply("p1")
+    assert (work / "run.log").read_text() == "kept"
+
+
+def test_restore_round_trip(service, work):
+    stash(service, "p1", work, {"a": "one", "sub/b": "two"})
+    write(work / "a", "changed")
+    write(work / "sub/c", "new")
+    (work / "sub" / "b").unlink()
+
+    service.restore("p1")
+    assert contents(work) == {"a": "one", "sub/b": "two"}
+
+
+def test_restore_revision(service, work):
+    stash(service, "p1", work, {"a": "one"})
+    write(work / "b", "two")
+    service.push()
+
+    service.restore("p1", rev=1)
+    assert contents(work) == {"a": "one"}
+    service.restore("p1")
+    assert contents(work) == {"a": "one", "b": "two"}
+
+
+def test_selective_restore_keeps_other_files(service, work):
+    stash(service, "p1", work, {"a": "one", "b": "two"})
+    write(work / "a", "changed")
+    write(work / "c", "new")
+
+    result = service.restore("p1", only=["cfg/a"])
+    assert contents(work) == {"a": "one", "b": "two", "c": "new"}
+    assert result.removed == 0
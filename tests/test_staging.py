@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+
+def dead_pid():
+    """Return the pid of a process that has exited."""
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def test_recover_keeps_unjournaled_staging_of_running_processes(service):
+    service.staging_dir.mkdir()
+    running = service.staging_dir / f"push-{os.getpid()}-abc"
+    dead = service.staging_dir / f"push-{dead_pid()}-abc"
+    running.mkdir()
+    dead.mkdir()
+
+    assert service.recover() == []
+    assert running.exists()
+    assert not dead.exists()
+
+
+def test_recover_rolls_back_journaled_operations_of_dead_processes(service):
+    with service._staged("push", "p1") as staging:
+        assert staging.name.startswith(f"push-{os.getpid()}-")
+        service.catalog.conn.execute("UPDATE journal SET pid = ?", (dead_pid(),))
+        service.catalog.conn.commit()
+        assert service.recover() == [("push", "p1")]
+        assert not staging.exists()
@@ -0,0 +1,75 @@
+import hashlib
+import os
+
+import pytest
+
+
+from core.store import ObjectStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    """An empty object store with a staging directory."""
+    store = ObjectStore(tmp_path / "objects")
+    (tmp_path / "staging").mkdir()
+    return store
+
+
+def stage(store, tmp_path, path, **options):
+    """Stage a file and move it into the store."""
+    staging = tmp_path / "staging"
+    digest, codec = store.add(str(path), staging, **options)
+    store.commit(staging)
+    return digest, codec
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"codec": ("zlib", 6)}, {"chunked": True}],
+    ids=["plain", "compressed", "chunked"],
+)
+def test_add_round_trip(store, tmp_path, options):
+    path = tmp_path / "file"
+    data = os.urandom(512 * 1024) * 3
+    path.write_bytes(data)
+
+    digest, codec = stage(store, tmp_path, path, **options)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert b"".join(store.read(digest, codec)) == data
+    assert stage(store, tmp_path, path, **options) == (digest, codec)
+
+
+def test_add_delta_round_trip(store, tmp_path):
+    path = tmp_path / "file"
+    old = os.urandom(2 * 1024 * 1024)
+    path.write_bytes(old)
+    base, _ = stage(store, tmp_path, path)
+    new = old[:1024] + b"changed" + old[1031:]
+    path.write_bytes(new)
+
+    digest, codec = stage(store, tmp_path, path, base=base)
+    assert codec == "delta"
+    assert b"".join(store.read(digest, codec)) == new
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"codec": ("zlib", 6)}, {"chunked": True}],
+    ids=["plain", "compressed", "chunked"],
+)
+def test_add_names_objects_by_written_contents(store, tmp_path, options):
+    path = tmp_path / "file"
+    path.write_bytes(b"before" * 200_000)
+    hash_file = store.hash_file
+
+    def change_after_hashing(path):
+        digest = hash_file(path)
+        with open(path, "wb") as f:
+            f.write(b"after" * 200_000)
+        return digest
+
+    store.hash_file = change_after_hashing
+    digest, codec = stage(store, tmp_path, path, **options)
+    data = b"".join(store.read(digest, codec))
+    assert data == b"after" * 200_000
+    assert digest == hashlib.sha256(data).hexdigest()
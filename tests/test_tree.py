@@ -0,0 +1,28 @@
+import pytest
+
+
+from conftest import stash
+
+
+FILES = {"a": "one", "sub/b": "two", "sub/deep/c": "three"}
+
+
+@pytest.mark.parametrize("depth, count", [(0, 1), (1, 2), (2, 4), (None, 7)])
+def test_tree_depth(service, work, depth, count):
+    stash(service, "p1", work, FILES)
+    nodes = list(service.tree("p1", depth))
+    assert len(nodes) == count
+    assert max(node.depth for node in nodes) == (4 if depth is None else depth)
+
+
+def test_rollups_match_the_manifest(service, work):
+    stash(service, "p1", work, FILES)
+    files, size = zip(
+        *[
+            (node.files, node.size)
+            for node in service.tree("p1")
+            if node.kind == "dir"
+        ]
+    )
+    assert files == (3, 3, 2, 1)
+    assert size == (11, 11, 8, 5)
@@ -0,0 +1,27 @@
+from conftest import stash, write
+from core.watch import Watcher
+
+
+def test_failed_push_keeps_the_paths(service, work, monkeypatch):
+    stash(service, "p1", work, {"a": "one"})
+    watcher = Watcher(service)
+    watcher._rebuild()
+    pushed = []
+    watcher.on_push = lambda name, count: pushed.append((name, count))
+    write(work / "a", "two")
+    watcher._touch(str(work / "a"))
+
+    def fail(paths):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(service, "push_paths", fail)
+        watcher.flush()
+    assert watcher.pending == {str(work / "a")}
+    assert watcher.last is not None
+    assert pushed == []
+
+    watcher.flush()
+    watcher.inotify.close()
+    assert watcher.pending == set()
+    assert pushed == [("p1", 1)]